@@ -0,0 +1,167 @@
+"""
+Profile app startup: module import times and preprocessor construction.
+
+Each measurement runs in a fresh Python process, so nothing is already
+imported or cached:
+
+- `import`: `python -X importtime` profile of importing the app package,
+  reported as the total and the slowest top-level packages (time including
+  their own imports)
+- `startup`: seconds to import the app package, build the text preprocessor
+  (`get_text_preprocessor`), warm it up (`warm_up_preprocessor`) and then
+  preprocess a first message, i.e. the work a gunicorn master does before
+  forking workers with `--preload`
+
+Run from the root of the repository, with the same environment variables as
+the app (only PROMETHEUS_MULTIPROC_DIR is needed, no database):
+
+    python -m benchmarks.import_time --output import_time.json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULE = "core_model.app"
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_import_times(stderr):
+    """
+    Parse `python -X importtime` output into dicts with the module name, its
+    nesting depth and its self and cumulative import times in seconds
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        imports.append(
+            {
+                "module": module,
+                "depth": (len(indent) - 1) // 2,
+                "self_seconds": int(self_us) / 1e6,
+                "cumulative_seconds": int(cumulative_us) / 1e6,
+            }
+        )
+    return imports
+
+
+def profile_import(module):
+    """
+    Import `module` in a fresh process with `-X importtime` and return the
+    parsed import times
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_times(result.stderr)
+
+
+def slowest_packages(imports, n):
+    """
+    Return the `n` top-level packages that took longest to import, including
+    their own imports (so a package imported by another is counted in both)
+    """
+    totals = [
+        (entry["module"], entry["cumulative_seconds"])
+        for entry in imports
+        if "." not in entry["module"]
+    ]
+    return sorted(totals, key=lambda item: item[1], reverse=True)[:n]
+
+
+def time_startup(module):
+    """
+    Child process: time importing the app and building the preprocessor,
+    and print the timings as JSON
+    """
+    timings = {}
+    start = time.perf_counter()
+    app_module = __import__(module, fromlist=["get_text_preprocessor"])
+    timings["import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text_preprocessor = app_module.get_text_preprocessor()
+    timings["build_preprocessor"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    app_module.warm_up_preprocessor(text_preprocessor)
+    timings["warm_up_preprocessor"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    text_preprocessor("When is my next clinic visit?")
+    timings["first_message"] = time.perf_counter() - start
+
+    print(json.dumps(timings))
+
+
+def profile_startup(module):
+    """
+    Run `time_startup` in a fresh process and return its timings
+    """
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.import_time", "--child", module],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    """
+    Parse arguments, run the profiles and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        time_startup(args.child)
+        return
+
+    imports = profile_import(args.module)
+    total = next(
+        entry["cumulative_seconds"]
+        for entry in imports
+        if entry["module"] == args.module
+    )
+    packages = slowest_packages(imports, args.top)
+    startup = profile_startup(args.module)
+
+    print(f"import {args.module}: {total * 1000:.0f} ms")
+    print(f"{'package':<30} {'ms':>8}")
+    for package, seconds in packages:
+        print(f"{package:<30} {seconds * 1000:>8.0f}")
+    print()
+    print(f"{'startup stage':<30} {'ms':>8}")
+    for stage, seconds in startup.items():
+        print(f"{stage:<30} {seconds * 1000:>8.0f}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "module": args.module,
+                    "import_seconds": total,
+                    "slowest_packages": dict(packages),
+                    "startup_seconds": startup,
+                    "imports": imports,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Benchmark analytics queries on inbounds_ud stored as json versus jsonb.
+
+Generates two copies of a synthetic inbounds table with `--rows` messages
+spread over `--days` days, in time order like the live table:
+
+- `json`: the original schema, with `json` columns and only a primary key
+- `jsonb`: the schema of scripts/inbounds_jsonb.sql, with `jsonb` columns,
+  a BRIN index on `inbound_utc` and GIN indexes on the matched rule IDs and
+  on `inbound_metadata`
+
+`--match-percent` of messages match one of `--rules` rules, stored with their
+title and keywords as by `/inbound/check`. Each query is run `--repeats`
+times on each table and the fastest run is kept. Table and index sizes are
+reported too.
+
+Needs a database set up as for the app, with scripts/inbounds_jsonb.sql
+applied (for `inbound_matched_rule_ids`), and the same PG_* environment
+variables. The tables are dropped afterwards unless `--keep` is given. Run
+from the root of the repository:
+
+    python -m benchmarks.inbound_queries --rows 5000000 --output inbound_queries.json
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+from core_model.app import get_config_data
+
+TABLES = {
+    "json": "inbounds_ud_benchmark_json",
+    "jsonb": "inbounds_ud_benchmark_jsonb",
+}
+START_UTC = datetime(2022, 1, 1)
+
+GENERATE_SQL = """
+CREATE TABLE {table} AS
+SELECT
+    inbound_id::integer AS inbound_id,
+    md5(inbound_id::text) AS feedback_secret_key,
+    'benchmark message ' || inbound_id AS inbound_text,
+    json_build_object('channel', channel, 'district', inbound_id % 50)
+        AS inbound_metadata,
+    CAST(:start_utc AS timestamp) + inbound_id * :seconds_per_row
+        * interval '1 second' AS inbound_utc,
+    urgency_score,
+    json_build_object(
+        'urgency_score', CASE WHEN json_array_length(urgency_score) > 0
+            THEN 1.0 ELSE 0.0 END,
+        'matched_urgency_rules', urgency_score,
+        'feedback_secret_key', md5(inbound_id::text),
+        'inbound_id', inbound_id
+    ) AS returned_content,
+    CAST(:start_utc AS timestamp) + inbound_id * :seconds_per_row
+        * interval '1 second' + interval '50 milliseconds' AS returned_utc,
+    NULL::json AS returned_feedback
+FROM (
+    SELECT
+        i AS inbound_id,
+        (ARRAY['sms', 'whatsapp', 'web'])[1 + i % 3] AS channel,
+        CASE WHEN (i * 2654435761) % 100 < :match_percent
+            THEN json_build_array(json_build_object(
+                'rule_id', 1 + (i * 7919) % :n_rules,
+                'title', 'Rule ' || (1 + (i * 7919) % :n_rules),
+                'include', json_build_array('bleed', 'pain', 'pregnant'),
+                'exclude', json_build_array('period')
+            ))
+            ELSE json_build_array()
+        END AS urgency_score
+    FROM generate_series(1::bigint, :n_rows) AS i
+) AS generated
+"""
+
+CONVERT_SQL = """
+CREATE TABLE {jsonb_table} AS
+SELECT
+    inbound_id,
+    feedback_secret_key,
+    inbound_text,
+    inbound_metadata::jsonb AS inbound_metadata,
+    inbound_utc,
+    urgency_score::jsonb AS urgency_score,
+    returned_content::jsonb AS returned_content,
+    returned_utc,
+    returned_feedback::jsonb AS returned_feedback
+FROM {json_table}
+"""
+
+INDEX_SQL = [
+    "CREATE INDEX {table}_inbound_utc_brin_idx ON {table} USING brin (inbound_utc)",
+    "CREATE INDEX {table}_matched_rule_ids_idx ON {table} "
+    "USING gin (inbound_matched_rule_ids(urgency_score))",
+    "CREATE INDEX {table}_inbound_metadata_idx ON {table} "
+    "USING gin (inbound_metadata jsonb_path_ops)",
+]
+
+# Typical dashboard queries, written as they would be for each format
+QUERIES = {
+    "last_day": {
+        "json": "SELECT count(*) FROM {table} "
+        "WHERE inbound_utc >= :end_utc - interval '1 day' AND inbound_utc < :end_utc",
+    },
+    "last_week_by_day": {
+        "json": "SELECT date_trunc('day', inbound_utc) AS day, count(*) FROM {table} "
+        "WHERE inbound_utc >= :end_utc - interval '7 days' AND inbound_utc < :end_utc "
+        "GROUP BY day ORDER BY day",
+    },
+    "rule_matches": {
+        "json": "SELECT count(*) FROM {table} "
+        "WHERE inbound_matched_rule_ids(urgency_score::jsonb) @> ARRAY[:rule_id]",
+        "jsonb": "SELECT count(*) FROM {table} "
+        "WHERE inbound_matched_rule_ids(urgency_score) @> ARRAY[:rule_id]",
+    },
+    "rule_matches_last_month": {
+        "json": "SELECT count(*) FROM {table} "
+        "WHERE inbound_utc >= :end_utc - interval '30 days' AND inbound_utc < :end_utc "
+        "AND inbound_matched_rule_ids(urgency_score::jsonb) @> ARRAY[:rule_id]",
+        "jsonb": "SELECT count(*) FROM {table} "
+        "WHERE inbound_utc >= :end_utc - interval '30 days' AND inbound_utc < :end_utc "
+        "AND inbound_matched_rule_ids(urgency_score) @> ARRAY[:rule_id]",
+    },
+    "metadata_field": {
+        "json": "SELECT count(*) FROM {table} "
+        "WHERE inbound_metadata ->> 'channel' = 'sms' "
+        "AND (inbound_metadata ->> 'district')::integer = 7",
+        "jsonb": "SELECT count(*) FROM {table} "
+        'WHERE inbound_metadata @> \'{{"channel": "sms", "district": 7}}\'',
+    },
+}
+
+
+def drop_tables(connection):
+    """
+    Drop the benchmark tables if they exist
+    """
+    for table in TABLES.values():
+        connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def generate_tables(connection, n_rows, n_days, n_rules, match_percent):
+    """
+    Generate the json table, copy it to the jsonb table, add the primary key
+    and indexes, and update planner statistics. Returns the timestamp just
+    after the last message.
+    """
+    drop_tables(connection)
+    seconds_per_row = n_days * 86400 / n_rows
+    connection.execute(
+        text(GENERATE_SQL.format(table=TABLES["json"])),
+        start_utc=START_UTC,
+        seconds_per_row=seconds_per_row,
+        match_percent=match_percent,
+        n_rules=n_rules,
+        n_rows=n_rows,
+    )
+    connection.execute(
+        text(CONVERT_SQL.format(jsonb_table=TABLES["jsonb"], json_table=TABLES["json"]))
+    )
+    for table in TABLES.values():
+        connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (inbound_id)"))
+    for statement in INDEX_SQL:
+        connection.execute(text(statement.format(table=TABLES["jsonb"])))
+    for table in TABLES.values():
+        connection.execute(text(f"VACUUM ANALYZE {table}"))
+
+    return START_UTC + timedelta(seconds=(n_rows + 1) * seconds_per_row)
+
+
+def table_sizes(connection):
+    """
+    Return the table and index size in bytes of each benchmark table
+    """
+    return {
+        name: dict(
+            connection.execute(
+                text(
+                    "SELECT pg_table_size(:table) AS table_bytes, "
+                    "pg_indexes_size(:table) AS index_bytes"
+                ),
+                table=table,
+            )
+            .mappings()
+            .one()
+        )
+        for name, table in TABLES.items()
+    }
+
+
+def time_query(connection, sql, params, repeats):
+    """
+    Run `sql` `repeats` times and return the fastest time in seconds
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        connection.execute(text(sql), **params).fetchall()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(engine, n_rows, n_days, n_rules, match_percent, repeats, keep):
+    """
+    Generate the tables, time every query on both and return the results
+    """
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        start = time.perf_counter()
+        end_utc = generate_tables(connection, n_rows, n_days, n_rules, match_percent)
+        generate_seconds = time.perf_counter() - start
+
+        try:
+            params = {"end_utc": end_utc, "rule_id": 1}
+            results = []
+            for query, sql_by_format in QUERIES.items():
+                result = {"query": query}
+                for name, table in TABLES.items():
+                    sql = sql_by_format.get(name, sql_by_format["json"])
+                    result[f"{name}_seconds"] = time_query(
+                        connection, sql.format(table=table), params, repeats
+                    )
+                results.append(result)
+            sizes = table_sizes(connection)
+        finally:
+            if not keep:
+                drop_tables(connection)
+
+    return {
+        "n_rows": n_rows,
+        "n_days": n_days,
+        "n_rules": n_rules,
+        "match_percent": match_percent,
+        "generate_seconds": generate_seconds,
+        "sizes": sizes,
+        "queries": results,
+    }
+
+
+def main():
+    """
+    Parse arguments, run the benchmark and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--rules", type=int, default=200)
+    parser.add_argument("--match-percent", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tables")
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    engine = create_engine(get_config_data({})["SQLALCHEMY_DATABASE_URI"])
+    results = run(
+        engine,
+        args.rows,
+        args.days,
+        args.rules,
+        args.match_percent,
+        args.repeats,
+        args.keep,
+    )
+
+    print(f"Generated {args.rows} rows in {results['generate_seconds']:.1f} s")
+    print(f"{'table':<8} {'table MB':>10} {'index MB':>10}")
+    for name, size in results["sizes"].items():
+        print(
+            f"{name:<8} {size['table_bytes'] / 2**20:>10.1f} "
+            f"{size['index_bytes'] / 2**20:>10.1f}"
+        )
+    print()
+    print(f"{'query':<25} {'json ms':>10} {'jsonb ms':>10} {'speedup':>8}")
+    for result in results["queries"]:
+        print(
+            f"{result['query']:<25} {result['json_seconds'] * 1000:>10.1f} "
+            f"{result['jsonb_seconds'] * 1000:>10.1f} "
+            f"{result['json_seconds'] / result['jsonb_seconds']:>7.1f}x"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
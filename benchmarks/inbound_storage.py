@@ -0,0 +1,222 @@
+"""
+Benchmark the size of inbound records in the full and compact storage formats.
+
+Inserts `--rows` synthetic messages into two tables with the columns of
+inbounds_ud, in batches of `--batch-size` rows as the write-behind writer
+does:
+
+- `full`: `urgency_score` holds the matched rules with their title and
+  keywords, and `returned_content` the whole response
+- `compact`: `urgency_score` holds the IDs of the matched rules,
+  `returned_content` the urgency score, and `urgency_rule_version` the
+  version of the rules (`INBOUND_STORAGE_FORMAT=compact`)
+
+`--match-percent` of messages match `--matched-rules` rules, each with
+`--keywords` keywords. The WAL volume of the inserts, the table size and the
+average row size are reported for each format.
+
+Needs a database set up as for the app and the same PG_* environment
+variables. The tables are dropped afterwards unless `--keep` is given. Run
+from the root of the repository:
+
+    python -m benchmarks.inbound_storage --rows 200000 --output inbound_storage.json
+"""
+import argparse
+import json
+
+from sqlalchemy import create_engine, text
+
+from core_model.app import get_config_data
+
+TABLES = {
+    "full": "inbounds_ud_benchmark_full",
+    "compact": "inbounds_ud_benchmark_compact",
+}
+
+CREATE_SQL = """
+CREATE TABLE {table} (
+    inbound_id integer PRIMARY KEY,
+    feedback_secret_key text NOT NULL,
+    inbound_text text NOT NULL,
+    inbound_metadata jsonb,
+    inbound_utc timestamp without time zone NOT NULL,
+    urgency_score jsonb,
+    returned_content jsonb,
+    returned_utc timestamp without time zone NOT NULL,
+    returned_feedback jsonb,
+    urgency_rule_version bigint
+)
+"""
+
+# Matched rules of each message, as returned by /inbound/check
+MATCHED_RULES_SQL = """
+CASE WHEN (i * 2654435761) % 100 < :match_percent THEN (
+    SELECT jsonb_agg(jsonb_build_object(
+        'rule_id', 1 + (i + rule) % 200,
+        'title', 'Rule ' || (1 + (i + rule) % 200),
+        'include', (
+            SELECT jsonb_agg('keyword' || keyword)
+            FROM generate_series(1, :n_keywords) AS keyword
+        ),
+        'exclude', jsonb_build_array('period')
+    ))
+    FROM generate_series(1, :n_matched_rules) AS rule
+) ELSE '[]'::jsonb END
+"""
+
+INSERT_SQL = {
+    "full": """
+INSERT INTO {table}
+SELECT
+    i, md5(i::text), 'benchmark message ' || i,
+    jsonb_build_object('channel', 'sms'), now(),
+    matched_rules,
+    jsonb_build_object(
+        'urgency_score',
+        CASE WHEN jsonb_array_length(matched_rules) > 0 THEN 1.0 ELSE 0.0 END,
+        'matched_urgency_rules', matched_rules,
+        'feedback_secret_key', md5(i::text)
+    ),
+    now(), NULL, NULL
+FROM generate_series(CAST(:first_id AS integer), :last_id) AS i,
+    LATERAL (SELECT {matched_rules} AS matched_rules) AS matched
+""",
+    "compact": """
+INSERT INTO {table}
+SELECT
+    i, md5(i::text), 'benchmark message ' || i,
+    jsonb_build_object('channel', 'sms'), now(),
+    COALESCE(
+        (SELECT jsonb_agg(rule -> 'rule_id') FROM jsonb_array_elements(matched_rules) AS rule),
+        '[]'
+    ),
+    jsonb_build_object(
+        'urgency_score',
+        CASE WHEN jsonb_array_length(matched_rules) > 0 THEN 1.0 ELSE 0.0 END
+    ),
+    now(), NULL, 1
+FROM generate_series(CAST(:first_id AS integer), :last_id) AS i,
+    LATERAL (SELECT {matched_rules} AS matched_rules) AS matched
+""",
+}
+
+
+def drop_tables(connection):
+    """
+    Drop the benchmark tables if they exist
+    """
+    for table in TABLES.values():
+        connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def insert_rows(connection, name, n_rows, batch_size, params):
+    """
+    Insert `n_rows` messages in the `name` format, one transaction per batch,
+    and return the WAL bytes written
+    """
+    sql = INSERT_SQL[name].format(table=TABLES[name], matched_rules=MATCHED_RULES_SQL)
+    start_lsn = connection.execute(text("SELECT pg_current_wal_insert_lsn()")).scalar()
+    for first_id in range(1, n_rows + 1, batch_size):
+        last_id = min(first_id + batch_size - 1, n_rows)
+        connection.execute(text(sql), first_id=first_id, last_id=last_id, **params)
+    return connection.execute(
+        text("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), :start_lsn)"),
+        start_lsn=start_lsn,
+    ).scalar()
+
+
+def run(engine, n_rows, batch_size, match_percent, n_matched_rules, n_keywords, keep):
+    """
+    Insert the rows in both formats and return the WAL and storage sizes
+    """
+    params = {
+        "match_percent": match_percent,
+        "n_matched_rules": n_matched_rules,
+        "n_keywords": n_keywords,
+    }
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        drop_tables(connection)
+        try:
+            results = {}
+            for name, table in TABLES.items():
+                connection.execute(text(CREATE_SQL.format(table=table)))
+                wal_bytes = insert_rows(connection, name, n_rows, batch_size, params)
+                connection.execute(text(f"VACUUM ANALYZE {table}"))
+                sizes = (
+                    connection.execute(
+                        text(
+                            "SELECT pg_table_size(:table) AS table_bytes, "
+                            f"avg(pg_column_size({table}.*)) AS row_bytes, "
+                            "avg(pg_column_size(urgency_score) "
+                            "+ pg_column_size(returned_content)) AS result_bytes "
+                            f"FROM {table}"
+                        ),
+                        table=table,
+                    )
+                    .mappings()
+                    .one()
+                )
+                results[name] = {
+                    "wal_bytes": int(wal_bytes),
+                    "table_bytes": sizes["table_bytes"],
+                    "row_bytes": float(sizes["row_bytes"]),
+                    "result_bytes": float(sizes["result_bytes"]),
+                }
+        finally:
+            if not keep:
+                drop_tables(connection)
+
+    return {
+        "n_rows": n_rows,
+        "batch_size": batch_size,
+        "match_percent": match_percent,
+        "n_matched_rules": n_matched_rules,
+        "n_keywords": n_keywords,
+        "formats": results,
+    }
+
+
+def main():
+    """
+    Parse arguments, run the benchmark and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--match-percent", type=int, default=30)
+    parser.add_argument("--matched-rules", type=int, default=2)
+    parser.add_argument("--keywords", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tables")
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    engine = create_engine(get_config_data({})["SQLALCHEMY_DATABASE_URI"])
+    results = run(
+        engine,
+        args.rows,
+        args.batch_size,
+        args.match_percent,
+        args.matched_rules,
+        args.keywords,
+        args.keep,
+    )
+
+    print(
+        f"{'format':<8} {'WAL MB':>10} {'table MB':>10} "
+        f"{'row bytes':>10} {'result bytes':>13}"
+    )
+    for name, result in results["formats"].items():
+        print(
+            f"{name:<8} {result['wal_bytes'] / 2**20:>10.1f} "
+            f"{result['table_bytes'] / 2**20:>10.1f} "
+            f"{result['row_bytes']:>10.0f} {result['result_bytes']:>13.0f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Replay a JSONL corpus of inbound messages against the urgency detection API.
+
+Each line of the corpus is the JSON body of an `/inbound/check` request, e.g.
+`{"text_to_match": "...", "metadata": {...}}`. A line may also have a
+`feedback` key, which is removed from the check request and sent to
+`/inbound/feedback` with the returned inbound ID once the check completes.
+
+Requests are sent at a fixed rate (open loop) or, without `--rate`, as fast
+as `--concurrency` threads allow. With a fixed rate, latency is measured from
+when each request was due, so a saturated service shows up as high latency
+rather than as a lower request rate.
+
+Requests go to a running service with `--url`, or otherwise to an app created
+in-process from the environment (PG_* variables for a local Postgres), which
+measures the app without a web server. Results per endpoint (requests/sec,
+p50/p95/p99 latency, error rate) are printed and optionally written as JSON.
+The `--max-*` options make the exit code non-zero if they are exceeded, to
+gate releases on performance regressions.
+
+Run from the root of the repository:
+
+    python -m benchmarks.load_test corpus.jsonl --url http://localhost:9902 --rate 50 --duration 60 --output load_test.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from threading import Lock, local
+
+CHECK_PATH = "/inbound/check"
+FEEDBACK_PATH = "/inbound/feedback"
+
+
+def load_corpus(path):
+    """
+    Read check request bodies from a JSONL file, skipping blank lines
+    """
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class HttpClient:
+    """
+    Sends requests to a running service
+    """
+
+    def __init__(self, base_url, token, timeout=30):
+        """
+        Send requests to `base_url`, authenticated with `token`
+        """
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, method, path, body):
+        """
+        Send a JSON request and return the status code and decoded JSON
+        response (None if the response is not JSON)
+        """
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode("utf-8"),
+            method=method,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.token}",
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        except (urllib.error.URLError, OSError):
+            # Refused connections and timeouts count as errors, with status 0
+            return 0, None
+
+        try:
+            return status, json.loads(content)
+        except ValueError:
+            return status, None
+
+
+class FlaskClient:
+    """
+    Sends requests to an in-process app, with one test client per thread
+    """
+
+    def __init__(self, app, token):
+        """
+        Send requests to `app`, authenticated with `token`
+        """
+        self.app = app
+        self.token = token
+        self._local = local()
+
+    def send(self, method, path, body):
+        """
+        Send a JSON request and return the status code and decoded JSON
+        response (None if the response is not JSON)
+        """
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+
+        response = self._local.client.open(
+            path,
+            method=method,
+            json=body,
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        return response.status_code, response.get_json(silent=True)
+
+
+class Recorder:
+    """
+    Thread-safe record of request latencies and outcomes per endpoint
+    """
+
+    def __init__(self):
+        """
+        Start with no requests recorded
+        """
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = Lock()
+
+    def record(self, endpoint, latency, ok):
+        """
+        Record one request
+        """
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile `q` (0-100) of a sorted list
+    """
+    if len(sorted_values) == 0:
+        return None
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(recorder, elapsed):
+    """
+    Return the results per endpoint, with latencies in milliseconds
+    """
+    results = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        n_requests = len(latencies)
+        results[endpoint] = {
+            "requests": n_requests,
+            "errors": recorder.errors[endpoint],
+            "error_rate": recorder.errors[endpoint] / n_requests,
+            "requests_per_second": n_requests / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+    return results
+
+
+def replay(client, corpus, n_requests, concurrency, rate=None):
+    """
+    Replay the corpus (cycling through it) until `n_requests` checks have
+    been sent
+
+    Parameters
+    ----------
+    client : HttpClient or FlaskClient
+    corpus : List[Dict]
+        Check request bodies, optionally with a `feedback` key
+    n_requests : int
+        Number of check requests to send
+    concurrency : int
+        Number of threads sending requests
+    rate : float, optional
+        Check requests per second. As fast as possible if None.
+
+    Returns
+    -------
+    Dict
+        Results per endpoint, see `summarize`
+    """
+    recorder = Recorder()
+    bodies = cycle(corpus)
+    bodies_lock = Lock()
+    start = time.perf_counter()
+
+    def send_check(i):
+        """
+        Send the `i`th check request, and its feedback if any
+        """
+        with bodies_lock:
+            body = dict(next(bodies))
+        feedback = body.pop("feedback", None)
+
+        if rate is None:
+            due = time.perf_counter()
+        else:
+            due = start + i / rate
+            time.sleep(max(due - time.perf_counter(), 0))
+
+        status, response = client.send("POST", CHECK_PATH, body)
+        recorder.record(CHECK_PATH, time.perf_counter() - due, status == 200)
+
+        if feedback is not None and status == 200:
+            feedback_body = {
+                "inbound_id": response["inbound_id"],
+                "feedback_secret_key": response["feedback_secret_key"],
+                "feedback": feedback,
+            }
+            sent = time.perf_counter()
+            status, _ = client.send("PUT", FEEDBACK_PATH, feedback_body)
+            recorder.record(FEEDBACK_PATH, time.perf_counter() - sent, status == 200)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Consume the iterator so that exceptions in threads are raised
+        list(executor.map(send_check, range(n_requests)))
+
+    return summarize(recorder, time.perf_counter() - start)
+
+
+def check_thresholds(results, max_p95_ms=None, max_p99_ms=None, max_error_rate=None):
+    """
+    Return a description of each threshold exceeded by any endpoint
+    """
+    violations = []
+    for endpoint, result in results.items():
+        for key, limit in [
+            ("p95_ms", max_p95_ms),
+            ("p99_ms", max_p99_ms),
+            ("error_rate", max_error_rate),
+        ]:
+            if limit is not None and result[key] > limit:
+                violations.append(f"{endpoint} {key} {result[key]:.3f} > {limit}")
+    return violations
+
+
+def get_client(url):
+    """
+    Return a client for the service at `url`, or for an in-process app
+    """
+    token = os.environ["UD_INBOUND_CHECK_TOKEN"]
+    if url:
+        return HttpClient(url, token)
+
+    from core_model.app import create_app
+
+    return FlaskClient(create_app(), token)
+
+
+def main():
+    """
+    Parse arguments, run the load test and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("corpus", help="JSONL file of check request bodies")
+    parser.add_argument("--url", help="Base URL of the service. In-process if unset")
+    parser.add_argument("--rate", type=float, help="Check requests per second")
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="Seconds to send requests for, with --rate. "
+        "Defaults to one pass through the corpus",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-p95-ms", type=float)
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if args.rate is not None and args.duration is not None:
+        n_requests = int(args.rate * args.duration)
+    else:
+        n_requests = len(corpus)
+
+    results = replay(
+        get_client(args.url), corpus, n_requests, args.concurrency, args.rate
+    )
+
+    print(
+        f"{'endpoint':<18} {'requests':>8} {'req/s':>8} {'p50 (ms)':>9} "
+        f"{'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}"
+    )
+    for endpoint, result in results.items():
+        print(
+            f"{endpoint:<18} {result['requests']:>8} "
+            f"{result['requests_per_second']:>8.1f} {result['p50_ms']:>9.1f} "
+            f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+            f"{result['error_rate']:>7.2%}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    violations = check_thresholds(
+        results, args.max_p95_ms, args.max_p99_ms, args.max_error_rate
+    )
+    for violation in violations:
+        print(f"Threshold exceeded: {violation}", file=sys.stderr)
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
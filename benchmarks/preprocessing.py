@@ -0,0 +1,406 @@
+"""
+Micro-benchmark the preprocessing and rule evaluation hot path stage by stage.
+
+Times, per message, on a synthetic corpus of short, medium and long messages:
+
+- `tokenize`: faqt's preprocessing with spell-checking, stemming and n-grams
+  turned off, i.e. URL parsing, tokenization and stop word removal (which
+  faqt runs as one step)
+- `spell_check`: time spent in Hunspell `spell`/`suggest` calls, uncached
+- `spell_check_cached`: the same with the app's spell-check cache, warm
+- `stemming`: time spent in the Porter stemmer
+- `ngrams`: extra time for n-grams up to `ngram_max`, over unigrams only
+- `preprocess`: the app's full preprocessing pipeline, uncached
+- `match_linear` / `match_indexed`: `RuleBasedUD.predict_scores` and
+  `RuleEvaluator` on preprocessed tokens, across rule counts
+- `end_to_end`: `RuleEvaluator.evaluate` on raw messages with the app's
+  preprocessor (spell-check cache included), across rule counts
+
+Each stage is timed `--repeats` times and the fastest run is kept. Results
+are written as JSON with `--output`; pass an earlier output as `--baseline`
+to flag stages that got slower by more than `--tolerance`, in which case the
+exit code is non-zero.
+
+Run from the root of the repository:
+
+    python -m benchmarks.preprocessing --output preprocessing.json
+    python -m benchmarks.preprocessing --baseline preprocessing.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from functools import partial
+
+from faqt import KeywordRule, preprocess_text_for_keyword_rule
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+from faqt.preprocessing.tokens import CustomHunspell
+from nltk.stem import PorterStemmer
+
+from core_model.app.src.cache import CachedSpellChecker, LRUCache
+from core_model.app.src.rule_evaluation import RuleEvaluator
+from core_model.app.src.utils import load_parameters
+
+DEFAULT_RULE_COUNTS = [10, 100, 1000]
+MESSAGE_LENGTHS = {"short": 6, "medium": 25, "long": 80}
+
+WORDS = (
+    "i am pregnant and my baby is not moving much since yesterday i have "
+    "bleeding pain in my stomach headache fever swollen feet blurry vision "
+    "when should i go to the clinic how do i register for the vaccine can i "
+    "eat fish drink coffee take paracetamol breastfeeding nurse doctor "
+    "appointment hospital weeks months contractions water broke discharge "
+    "dizzy tired vomiting nausea blood pressure sugar diabetes hiv test"
+).split()
+MISSPELLINGS = ["pregnent", "bleding", "headach", "clinik", "vacine", "stomache"]
+URLS = [
+    "https://www.example.org/what-to-do-if-your-baby-stops-moving",
+    "http://example.org/clinic-visits",
+]
+
+
+def make_corpus(n_messages, n_words, rng):
+    """
+    Generate messages of `n_words` words, with occasional misspellings,
+    punctuation and URLs
+    """
+    messages = []
+    for _ in range(n_messages):
+        words = []
+        for _ in range(n_words):
+            if rng.random() < 0.05:
+                words.append(rng.choice(MISSPELLINGS))
+            else:
+                words.append(rng.choice(WORDS))
+            if rng.random() < 0.08:
+                words[-1] += rng.choice([",", ".", "?", "!!"])
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(URLS))
+        messages.append(" ".join(words).capitalize())
+    return messages
+
+
+def make_rules(n_rules, vocabulary, rng):
+    """
+    Generate `n_rules` random keyword rules over `vocabulary`
+    """
+    return [
+        KeywordRule(
+            include=rng.sample(vocabulary, rng.randint(1, 3)),
+            exclude=rng.sample(vocabulary, rng.randint(0, 2)),
+        )
+        for _ in range(n_rules)
+    ]
+
+
+class TimedSpellChecker:
+    """
+    Spell-checker wrapper that accumulates the time spent in its calls
+    """
+
+    def __init__(self, spell_checker):
+        """
+        Wrap `spell_checker`
+        """
+        self.spell_checker = spell_checker
+        self.seconds = 0.0
+
+    def spell(self, word):
+        """
+        Time `spell_checker.spell`
+        """
+        start = time.perf_counter()
+        result = self.spell_checker.spell(word)
+        self.seconds += time.perf_counter() - start
+        return result
+
+    def suggest(self, word):
+        """
+        Time `spell_checker.suggest`
+        """
+        start = time.perf_counter()
+        result = self.spell_checker.suggest(word)
+        self.seconds += time.perf_counter() - start
+        return result
+
+
+class TimedFunction:
+    """
+    Function wrapper that accumulates the time spent in its calls
+    """
+
+    def __init__(self, func):
+        """
+        Wrap `func`
+        """
+        self.func = func
+        self.seconds = 0.0
+
+    def __call__(self, *args):
+        """
+        Time a call to `func`
+        """
+        start = time.perf_counter()
+        result = self.func(*args)
+        self.seconds += time.perf_counter() - start
+        return result
+
+
+class NoSpellCheck:
+    """
+    Spell-checker that accepts every word
+    """
+
+    def spell(self, word):
+        """
+        Return True
+        """
+        return True
+
+    def suggest(self, word):
+        """
+        Return `word` as its only suggestion
+        """
+        return [word]
+
+
+def best_of(repeats, func):
+    """
+    Run `func` `repeats` times and return its smallest result
+    """
+    return min(func() for _ in range(repeats))
+
+
+def time_calls(func, items):
+    """
+    Return mean seconds per item for `func`
+    """
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def time_component(component, pipeline, messages):
+    """
+    Return mean seconds per message spent in a timed component of `pipeline`
+    """
+    component.seconds = 0.0
+    for message in messages:
+        pipeline(message)
+    return component.seconds / len(messages)
+
+
+def run(rule_counts, n_messages, repeats, seed):
+    """
+    Run the benchmark and return one result dict per stage, message length
+    and (where relevant) rule count
+    """
+    rng = random.Random(seed)
+    pp_params = load_parameters("preprocessing")
+    pipeline_params = {
+        "n_min_dashed_words_url": pp_params["min_dashed_words_to_parse_text_from_url"],
+        "reincluded_stop_words": pp_params["reincluded_stop_words"],
+        "ngram_min": pp_params["ngram_min"],
+    }
+    ngram_max = pp_params["ngram_max"]
+
+    hunspell = CustomHunspell(
+        custom_spell_check_list=pp_params["custom_spell_check_list"],
+        custom_spell_correct_map=pp_params["custom_spell_correct_map"],
+        priority_words=pp_params["priority_words"],
+    )
+    spell_checker = TimedSpellChecker(hunspell)
+    cached_spell_checker = TimedSpellChecker(
+        CachedSpellChecker(
+            hunspell, LRUCache(maxsize=max(pp_params["spell_check_cache_size"], 1))
+        )
+    )
+    stemmer = TimedFunction(PorterStemmer().stem)
+
+    def pipeline(spell_checker=spell_checker, stem_func=stemmer, ngram_max=ngram_max):
+        """
+        Return the preprocessing pipeline with the given components
+        """
+        return partial(
+            preprocess_text_for_keyword_rule,
+            spell_checker=spell_checker,
+            stem_func=stem_func,
+            ngram_max=ngram_max,
+            **pipeline_params,
+        )
+
+    def identity(token):
+        """
+        Return `token` unchanged, to skip stemming
+        """
+        return token
+
+    full = pipeline()
+    cached = pipeline(spell_checker=cached_spell_checker)
+    tokenize = pipeline(spell_checker=NoSpellCheck(), stem_func=identity, ngram_max=1)
+    with_ngrams = pipeline(spell_checker=NoSpellCheck(), stem_func=identity)
+
+    results = []
+
+    def add(stage, length, seconds, n_rules=None):
+        """
+        Record the result of a stage
+        """
+        results.append(
+            {
+                "stage": stage,
+                "message_length": length,
+                "n_rules": n_rules,
+                "seconds_per_message": seconds,
+            }
+        )
+
+    for length, n_words in MESSAGE_LENGTHS.items():
+        messages = make_corpus(n_messages, n_words, rng)
+        tokens = [full(message) for message in messages]
+        for message in messages:
+            cached(message)
+
+        tokenize_seconds = best_of(repeats, lambda: time_calls(tokenize, messages))
+        add("tokenize", length, tokenize_seconds)
+        add(
+            "spell_check",
+            length,
+            best_of(repeats, lambda: time_component(spell_checker, full, messages)),
+        )
+        add(
+            "spell_check_cached",
+            length,
+            best_of(
+                repeats, lambda: time_component(cached_spell_checker, cached, messages)
+            ),
+        )
+        add(
+            "stemming",
+            length,
+            best_of(repeats, lambda: time_component(stemmer, full, messages)),
+        )
+        add(
+            "ngrams",
+            length,
+            max(
+                best_of(repeats, lambda: time_calls(with_ngrams, messages))
+                - tokenize_seconds,
+                0.0,
+            ),
+        )
+        add("preprocess", length, best_of(repeats, lambda: time_calls(full, messages)))
+
+        vocabulary = sorted({token for message in tokens for token in message})
+        for n_rules in rule_counts:
+            rules = make_rules(n_rules, vocabulary, rng)
+            linear = RuleBasedUD(model=rules, preprocessor=identity)
+            indexed = RuleEvaluator(model=rules, preprocessor=identity)
+            end_to_end = RuleEvaluator(model=rules, preprocessor=cached)
+
+            add(
+                "match_linear",
+                length,
+                best_of(repeats, lambda: time_calls(linear.predict_scores, tokens)),
+                n_rules,
+            )
+            add(
+                "match_indexed",
+                length,
+                best_of(repeats, lambda: time_calls(indexed.evaluate, tokens)),
+                n_rules,
+            )
+            add(
+                "end_to_end",
+                length,
+                best_of(repeats, lambda: time_calls(end_to_end.evaluate, messages)),
+                n_rules,
+            )
+
+    return results
+
+
+def result_key(result):
+    """
+    Key identifying a result across runs
+    """
+    return result["stage"], result["message_length"], result["n_rules"]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the results that are slower than the baseline by more than
+    `tolerance` (e.g. 0.2 for 20%), with the ratio to the baseline
+    """
+    baseline_seconds = {
+        result_key(result): result["seconds_per_message"] for result in baseline
+    }
+    regressions = []
+    for result in results:
+        previous = baseline_seconds.get(result_key(result))
+        if not previous:
+            continue
+        ratio = result["seconds_per_message"] / previous
+        if ratio > 1 + tolerance:
+            regressions.append({**result, "baseline_ratio": ratio})
+    return regressions
+
+
+def main():
+    """
+    Parse arguments, run the benchmark and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rule-counts", type=int, nargs="+", default=DEFAULT_RULE_COUNTS
+    )
+    parser.add_argument("--n-messages", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="Optional JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    results = run(args.rule_counts, args.n_messages, args.repeats, args.seed)
+
+    print(f"{'stage':<20} {'length':<7} {'rules':>6} {'us/message':>11}")
+    for result in results:
+        n_rules = "" if result["n_rules"] is None else result["n_rules"]
+        print(
+            f"{result['stage']:<20} {result['message_length']:<7} {n_rules:>6} "
+            f"{result['seconds_per_message'] * 1e6:>11.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(
+                f"Regression: {regression['stage']} "
+                f"({regression['message_length']}, rules={regression['n_rules']}) "
+                f"is {regression['baseline_ratio']:.2f}x the baseline",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
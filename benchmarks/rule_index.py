@@ -0,0 +1,141 @@
+"""
+Benchmark urgency rule evaluation latency against the number of rules.
+
+Compares the linear `RuleBasedUD` evaluation with the `KeywordRuleIndex` used
+by `RuleEvaluator` on synthetic rules and pre-tokenised messages, so that only
+rule matching is timed (not preprocessing).
+
+Run from the root of the repository:
+
+    python -m benchmarks.rule_index --output rule_index.json
+"""
+import argparse
+import json
+import random
+import time
+
+from faqt import KeywordRule
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+
+from core_model.app.src.rule_evaluation import RuleEvaluator
+
+DEFAULT_RULE_COUNTS = [10, 100, 1000, 10000, 50000]
+
+
+def make_vocabulary(size):
+    """
+    Return a vocabulary of unigrams and bigrams
+    """
+    unigrams = ["word%d" % i for i in range(size)]
+    bigrams = ["%s_%s" % (unigrams[i], unigrams[i + 1]) for i in range(size - 1)]
+    return unigrams + bigrams
+
+
+def make_rules(n_rules, vocabulary, rng):
+    """
+    Generate `n_rules` random keyword rules with 1-3 include keywords and
+    0-2 exclude keywords
+    """
+    return [
+        KeywordRule(
+            include=rng.sample(vocabulary, rng.randint(1, 3)),
+            exclude=rng.sample(vocabulary, rng.randint(0, 2)),
+        )
+        for _ in range(n_rules)
+    ]
+
+
+def make_messages(n_messages, n_tokens, vocabulary, rng):
+    """
+    Generate `n_messages` random token lists of length `n_tokens`
+    """
+    return [rng.sample(vocabulary, n_tokens) for _ in range(n_messages)]
+
+
+def time_per_message(score_func, messages):
+    """
+    Return mean seconds per message for `score_func`
+    """
+    start = time.perf_counter()
+    for message in messages:
+        score_func(message)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def run(rule_counts, n_messages, n_tokens, vocabulary_size, seed):
+    """
+    Run the benchmark and return one result dict per rule count
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size)
+    messages = make_messages(n_messages, n_tokens, vocabulary, rng)
+
+    def identity(tokens):
+        """
+        Return pre-tokenised messages unchanged
+        """
+        return tokens
+
+    results = []
+    for n_rules in rule_counts:
+        rules = make_rules(n_rules, vocabulary, rng)
+
+        start = time.perf_counter()
+        indexed = RuleEvaluator(model=rules, preprocessor=identity)
+        compile_seconds = time.perf_counter() - start
+        linear = RuleBasedUD(model=rules, preprocessor=identity)
+
+        results.append(
+            {
+                "n_rules": n_rules,
+                "compile_seconds": compile_seconds,
+                "linear_seconds_per_message": time_per_message(
+                    linear.predict_scores, messages
+                ),
+                "indexed_seconds_per_message": time_per_message(
+                    indexed.predict_scores, messages
+                ),
+            }
+        )
+    return results
+
+
+def main():
+    """
+    Parse arguments, run the benchmark and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rule-counts", type=int, nargs="+", default=DEFAULT_RULE_COUNTS
+    )
+    parser.add_argument("--n-messages", type=int, default=100)
+    parser.add_argument("--n-tokens", type=int, default=40)
+    parser.add_argument("--vocabulary-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    results = run(
+        args.rule_counts,
+        args.n_messages,
+        args.n_tokens,
+        args.vocabulary_size,
+        args.seed,
+    )
+
+    print(f"{'rules':>8} {'linear (ms)':>12} {'indexed (ms)':>13} {'compile (ms)':>13}")
+    for result in results:
+        print(
+            f"{result['n_rules']:>8} "
+            f"{result['linear_seconds_per_message'] * 1000:>12.3f} "
+            f"{result['indexed_seconds_per_message'] * 1000:>13.3f} "
+            f"{result['compile_seconds'] * 1000:>13.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
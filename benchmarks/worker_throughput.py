@@ -0,0 +1,195 @@
+"""
+Load test /inbound/check throughput for different gunicorn worker models.
+
+Starts the app under gunicorn once per configuration, pinned to `--cores` CPU
+cores with `taskset`, sends concurrent requests from separate client
+processes for a fixed duration and reports requests per second per core.
+Configurations are given as `WORKERSxTHREADS`: `1x1` is one sync worker,
+`3x8` is three gthread workers with eight threads each.
+
+Needs a database set up as for the app (see `make setup-db-tables`) and the
+same environment variables as `startup.sh`. Run from the root of the
+repository:
+
+    python -m benchmarks.worker_throughput --cores 2 --configs 5x1 2x8 --output throughput.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+CORE_MODEL_DIR = Path(__file__).resolve().parent.parent / "core_model"
+
+DEFAULT_MESSAGES = [
+    "I have been bleeding a lot since yesterday, what should I do?",
+    "When is my next clinic visit?",
+    "My baby is not moving as much as before",
+    "Can I eat fish while pregnant?",
+    "I have a bad headache and blurry vision",
+    "How do I register for the vaccine?",
+]
+
+
+def parse_config(config):
+    """
+    Parse a `WORKERSxTHREADS` configuration
+    """
+    workers, threads = config.lower().split("x")
+    return int(workers), int(threads)
+
+
+def start_server(workers, threads, cores, port):
+    """
+    Start gunicorn pinned to the first `cores` CPU cores, and wait until it
+    serves requests
+    """
+    command = [
+        "gunicorn",
+        "--workers",
+        str(workers),
+        "--threads",
+        str(threads),
+        "--preload",
+        "--bind",
+        f"127.0.0.1:{port}",
+        "flask_app:app",
+    ]
+    if shutil.which("taskset"):
+        command = ["taskset", "-c", f"0-{cores - 1}"] + command
+
+    env = dict(os.environ)
+    env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp()
+    server = subprocess.Popen(command, cwd=CORE_MODEL_DIR, env=env)
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/healthcheck", timeout=1)
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def send_requests(args):
+    """
+    Client process: send requests from `n_threads` threads until `end_time`,
+    and return the number of successful and failed requests
+    """
+    url, token, messages, n_threads, end_time = args
+
+    def client_thread(offset):
+        """
+        Send requests until `end_time`, starting at message `offset`
+        """
+        n_ok, n_failed = 0, 0
+        i = offset
+        while time.time() < end_time:
+            body = json.dumps({"text_to_match": messages[i % len(messages)]})
+            request = urllib.request.Request(
+                url,
+                data=body.encode("utf-8"),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {token}",
+                },
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                n_ok += 1
+            except (urllib.error.URLError, ConnectionError):
+                n_failed += 1
+            i += 1
+        return n_ok, n_failed
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        counts = list(executor.map(client_thread, range(n_threads)))
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def run_config(config, args, messages):
+    """
+    Load test one configuration and return its result dict
+    """
+    workers, threads = parse_config(config)
+    server = start_server(workers, threads, args.cores, args.port)
+    try:
+        url = f"http://127.0.0.1:{args.port}/inbound/check"
+        token = os.environ["UD_INBOUND_CHECK_TOKEN"]
+        end_time = time.time() + args.duration
+        client_args = [
+            (url, token, messages, args.client_threads, end_time)
+        ] * args.client_processes
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.client_processes) as executor:
+            counts = list(executor.map(send_requests, client_args))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    n_ok = sum(c[0] for c in counts)
+    return {
+        "config": config,
+        "workers": workers,
+        "threads": threads,
+        "cores": args.cores,
+        "requests": n_ok,
+        "failed_requests": sum(c[1] for c in counts),
+        "requests_per_second": n_ok / elapsed,
+        "requests_per_second_per_core": n_ok / elapsed / args.cores,
+    }
+
+
+def main():
+    """
+    Parse arguments, run the load test and report results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--configs", nargs="+", default=["3x1", "1x8", "3x4"])
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--client-threads", type=int, default=16)
+    parser.add_argument("--port", type=int, default=9910)
+    parser.add_argument(
+        "--messages", help="Optional file with one message per line to send"
+    )
+    parser.add_argument("--output", help="Optional path to write JSON results to")
+    args = parser.parse_args()
+
+    if args.messages:
+        with open(args.messages) as file:
+            messages = [line.strip() for line in file if line.strip()]
+    else:
+        messages = DEFAULT_MESSAGES
+
+    results = [run_config(config, args, messages) for config in args.configs]
+
+    print(f"{'config':>8} {'req/s':>10} {'req/s/core':>11} {'failed':>7}")
+    for result in results:
+        print(
+            f"{result['config']:>8} "
+            f"{result['requests_per_second']:>10.1f} "
+            f"{result['requests_per_second_per_core']:>11.1f} "
+            f"{result['failed_requests']:>7}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
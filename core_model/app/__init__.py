@@ -1,19 +1,64 @@
 """
 Create and initialise the app. Uses Blueprints to define view.
 """
+import hashlib
+import json
 import os
 from functools import lru_cache, partial
+from threading import Lock
 
 from faqt import KeywordRule, preprocess_text_for_keyword_rule
-from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
-from faqt.preprocessing.tokens import CustomHunspell
 from flask import Flask
-from nltk.stem import PorterStemmer
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import undefer
 
-from .data_models import RulesModel
+from .data_models import DeletedRulesModel, RulesModel
 from .database_sqlalchemy import db
-from .prometheus_metrics import metrics
-from .src.utils import DefaultEnvDict, get_postgres_uri, load_parameters
+from .inbound_ids import InboundIdAllocator
+from .inbound_partitions import (
+    create_inbound_partitions_command,
+    ensure_inbound_partitions,
+    inbound_retention_command,
+)
+from .inbound_writer import InboundWriter
+from .prometheus_metrics import message_cache_events, metrics, spell_check_cache_events
+from .rule_listener import RuleChangeListener
+from .rule_store import SharedRuleStore
+from .src.cache import CachedSpellChecker, LRUCache
+from .src.rule_evaluation import RuleEvaluator, RuleSet
+from .src.shared_rules import SharedRuleEvaluator
+from .src.spell_check import ThreadLocalSpellChecker
+from .src.utils import (
+    DefaultEnvDict,
+    get_config_generation,
+    get_parameters,
+    get_postgres_uri,
+    increment_config_generation,
+    reload_yaml_configs,
+)
+
+# Optional config values, used when not set in `params` or env variables
+OPTIONAL_CONFIG_DEFAULTS = {
+    "CHECK_RULES_HISTORY_CHUNK_SIZE": 1000,
+    "CHECK_RULES_MAX_QUERIES": 10000,
+    "INBOUND_BATCH_MAX_SIZE": 500,
+    "INBOUND_CACHE_SIZE": 0,
+    "INBOUND_CACHE_TTL": 300,
+    "INBOUND_ID_BLOCK_SIZE": 100,
+    "INBOUND_PARTITIONS_AHEAD": 0,
+    "INBOUND_SAVE_TOKENS": "false",
+    "INBOUND_STORAGE_FORMAT": "full",
+    "INBOUND_WRITE_MODE": "sync",
+    "INBOUND_WRITE_BATCH_SIZE": 100,
+    "INBOUND_WRITE_FLUSH_INTERVAL": 1.0,
+    "INBOUND_WRITE_QUEUE_SIZE": 10000,
+    "INBOUND_WRITE_OVERFLOW": "sync",
+    "RULE_REFRESH_MODE": "poll",
+    "RULE_REFRESH_INCREMENTAL": "false",
+    "RULE_FULL_REFRESH_EVERY": 12,
+    "RULE_SHARED_DIR": "",
+}
 
 
 def create_app(params=None):
@@ -24,8 +69,12 @@ def create_app(params=None):
     setup(app, params)
 
     from .main import main as main_blueprint
+    from .rescore import rescore_inbounds_command
 
     app.register_blueprint(main_blueprint)
+    app.cli.add_command(rescore_inbounds_command)
+    app.cli.add_command(create_inbound_partitions_command)
+    app.cli.add_command(inbound_retention_command)
     return app
 
 
@@ -45,7 +94,35 @@ def setup(app, params):
         params = {}
 
     config = get_config_data(params)
-    config.update({"RULE_REFRESH_FREQ": int(config["RULE_REFRESH_FREQ"])})
+    config.update(
+        {
+            "RULE_REFRESH_FREQ": int(config["RULE_REFRESH_FREQ"]),
+            "CHECK_RULES_HISTORY_CHUNK_SIZE": int(
+                config["CHECK_RULES_HISTORY_CHUNK_SIZE"]
+            ),
+            "CHECK_RULES_MAX_QUERIES": int(config["CHECK_RULES_MAX_QUERIES"]),
+            "INBOUND_BATCH_MAX_SIZE": int(config["INBOUND_BATCH_MAX_SIZE"]),
+            "INBOUND_CACHE_SIZE": int(config["INBOUND_CACHE_SIZE"]),
+            "INBOUND_CACHE_TTL": float(config["INBOUND_CACHE_TTL"]),
+            "INBOUND_ID_BLOCK_SIZE": int(config["INBOUND_ID_BLOCK_SIZE"]),
+            "INBOUND_PARTITIONS_AHEAD": int(config["INBOUND_PARTITIONS_AHEAD"]),
+            "INBOUND_SAVE_TOKENS": str(config["INBOUND_SAVE_TOKENS"]).lower() == "true",
+            "INBOUND_WRITE_BATCH_SIZE": int(config["INBOUND_WRITE_BATCH_SIZE"]),
+            "INBOUND_WRITE_FLUSH_INTERVAL": float(
+                config["INBOUND_WRITE_FLUSH_INTERVAL"]
+            ),
+            "INBOUND_WRITE_QUEUE_SIZE": int(config["INBOUND_WRITE_QUEUE_SIZE"]),
+            "RULE_REFRESH_INCREMENTAL": str(config["RULE_REFRESH_INCREMENTAL"]).lower()
+            == "true",
+            "RULE_FULL_REFRESH_EVERY": int(config["RULE_FULL_REFRESH_EVERY"]),
+        }
+    )
+
+    storage_format = config["INBOUND_STORAGE_FORMAT"]
+    if storage_format not in ("full", "compact"):
+        raise ValueError(
+            f"INBOUND_STORAGE_FORMAT must be 'full' or 'compact', not {storage_format!r}"
+        )
 
     app.config.from_mapping(
         JSON_SORT_KEYS=False,
@@ -60,9 +137,26 @@ def setup(app, params):
 
     db.init_app(app)
     metrics.init_app(app)
+    ensure_inbound_partitions(app)
 
+    app.config_generation = get_config_generation()
+    app.parameters_generation = get_parameters().generation
     app.preprocess_text = get_text_preprocessor()
+    warm_up_preprocessor(app.preprocess_text)
+    app.preprocessor_version = get_preprocessor_version()
+    app.before_request(partial(reload_config_if_stale, app))
     app.cached_rule_refresh = cached_rule_based_model_wrapper(app)
+    app.rule_refresh_lock = Lock()
+    app.rule_set = RuleSet(
+        rules=[], evaluator=None, version=0, db_version=None, rules_version=None
+    )
+    app.n_incremental_rule_refreshes = 0
+    app.rule_store = get_rule_store(app.config)
+    app.shared_rule_generation = 0
+    app.message_cache = get_message_cache(app.config)
+    app.rule_listener = get_rule_listener(app)
+    app.inbound_id_allocator = InboundIdAllocator(app.config["INBOUND_ID_BLOCK_SIZE"])
+    app.inbound_writer = get_inbound_writer(app)
 
 
 def get_config_data(params):
@@ -81,6 +175,9 @@ def get_config_data(params):
         config["PG_PASSWORD"],
     )
 
+    for key, default in OPTIONAL_CONFIG_DEFAULTS.items():
+        config[key] = config.get(key, default)
+
     return config
 
 
@@ -89,21 +186,43 @@ def get_text_preprocessor():
     Return a partial function that takes one argument - the raw function
     to be processed.
     """
-
-    pp_params = load_parameters("preprocessing")
-    n_min_dashed_words_url = pp_params["min_dashed_words_to_parse_text_from_url"]
-    reincluded_stop_words = pp_params["reincluded_stop_words"]
-    ngram_min = pp_params["ngram_min"]
-    ngram_max = pp_params["ngram_max"]
-    custom_spell_check_list = pp_params["custom_spell_check_list"]
-    custom_spell_correct_map = pp_params["custom_spell_correct_map"]
-    priority_words = pp_params["priority_words"]
-
-    custom_spell_checker = CustomHunspell(
-        custom_spell_check_list=custom_spell_check_list,
-        custom_spell_correct_map=custom_spell_correct_map,
-        priority_words=priority_words,
+    # Imported here since NLTK is slow to import, and only needed once the
+    # preprocessor is built
+    from faqt.preprocessing.tokens import CustomHunspell
+    from nltk.stem import PorterStemmer
+
+    params = get_parameters()
+    n_min_dashed_words_url = params.get_int(
+        "preprocessing", "min_dashed_words_to_parse_text_from_url"
+    )
+    reincluded_stop_words = params.get_list("preprocessing", "reincluded_stop_words")
+    ngram_min = params.get_int("preprocessing", "ngram_min")
+    ngram_max = params.get_int("preprocessing", "ngram_max")
+    spell_check_cache_size = params.get_int("preprocessing", "spell_check_cache_size")
+    custom_spell_check_list = params.get_list(
+        "preprocessing", "custom_spell_check_list"
+    )
+    custom_spell_correct_map = params.get_dict(
+        "preprocessing", "custom_spell_correct_map"
     )
+    priority_words = params.get_list("preprocessing", "priority_words")
+
+    custom_spell_checker = ThreadLocalSpellChecker(
+        partial(
+            CustomHunspell,
+            custom_spell_check_list=custom_spell_check_list,
+            custom_spell_correct_map=custom_spell_correct_map,
+            priority_words=priority_words,
+        )
+    )
+    if spell_check_cache_size > 0:
+        custom_spell_checker = CachedSpellChecker(
+            custom_spell_checker,
+            LRUCache(
+                maxsize=spell_check_cache_size,
+                events_counter=spell_check_cache_events,
+            ),
+        )
 
     text_preprocessor = partial(
         preprocess_text_for_keyword_rule,
@@ -118,9 +237,152 @@ def get_text_preprocessor():
     return text_preprocessor
 
 
+def warm_up_preprocessor(text_preprocessor):
+    """
+    Preprocess a sample message, so that resources loaded on first use (like
+    NLTK's stop words) are loaded now. When gunicorn preloads the app, they
+    are then loaded once in the master and shared copy-on-write with the
+    workers, rather than loaded by each worker on its first request.
+    """
+    text_preprocessor(
+        "Warming up: I am pregnent and bleeding, see "
+        "https://example.org/what-to-do-about-bleeding"
+    )
+
+
+def rebuild_text_preprocessor(app):
+    """
+    Rebuild the app's preprocessor from the current parameters, and fully
+    refresh the rules so that their evaluator uses it
+    """
+    app.parameters_generation = get_parameters().generation
+    text_preprocessor = get_text_preprocessor()
+    warm_up_preprocessor(text_preprocessor)
+    app.preprocess_text = text_preprocessor
+    app.preprocessor_version = get_preprocessor_version()
+
+    # An unknown DB version makes the next refresh a full one
+    with app.rule_refresh_lock:
+        app.rule_set = app.rule_set._replace(db_version=None)
+    refresh_rule_based_model(app, force=True)
+
+
+def reload_config(app):
+    """
+    Reload the config files modified since they were loaded, and have every
+    other worker reload them on its next request
+
+    Returns
+    -------
+    List[str]
+        Names of the files that were reloaded
+    """
+    reloaded = reload_yaml_configs()
+    if len(reloaded) > 0:
+        increment_config_generation()
+    reload_config_if_stale(app)
+    return reloaded
+
+
+def reload_config_if_stale(app):
+    """
+    Run before each request: reload the config files if any worker reloaded
+    them since this app last checked, and rebuild the app's preprocessor if
+    parameters.yml changed
+    """
+    generation = get_config_generation()
+    if generation != app.config_generation:
+        app.config_generation = generation
+        reload_yaml_configs()
+
+    if app.parameters_generation != get_parameters().generation:
+        rebuild_text_preprocessor(app)
+
+
+def get_preprocessor_version():
+    """
+    Return a short hash of the preprocessing parameters, which identifies
+    the output of `get_text_preprocessor`. Parameters that only affect
+    performance, like the spell-check cache size, are left out.
+    """
+    pp_params = get_parameters().get_dict("preprocessing")
+    pp_params.pop("spell_check_cache_size", None)
+    encoded = json.dumps(pp_params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def get_message_cache(config):
+    """
+    Return the cache of urgency results by inbound message text, or None if
+    it is disabled (`INBOUND_CACHE_SIZE` is 0).
+    """
+    if config["INBOUND_CACHE_SIZE"] <= 0:
+        return None
+
+    return LRUCache(
+        maxsize=config["INBOUND_CACHE_SIZE"],
+        ttl=config["INBOUND_CACHE_TTL"],
+        events_counter=message_cache_events,
+    )
+
+
+def get_inbound_writer(app):
+    """
+    Return the write-behind writer for Inbound records, or None if records
+    are written synchronously (`INBOUND_WRITE_MODE` is "sync").
+    """
+    write_mode = app.config["INBOUND_WRITE_MODE"]
+    if write_mode == "sync":
+        return None
+    elif write_mode != "write_behind":
+        raise ValueError(
+            f"INBOUND_WRITE_MODE must be 'sync' or 'write_behind', not {write_mode!r}"
+        )
+
+    return InboundWriter(
+        app,
+        batch_size=app.config["INBOUND_WRITE_BATCH_SIZE"],
+        flush_interval=app.config["INBOUND_WRITE_FLUSH_INTERVAL"],
+        queue_size=app.config["INBOUND_WRITE_QUEUE_SIZE"],
+        overflow_policy=app.config["INBOUND_WRITE_OVERFLOW"],
+    )
+
+
+def get_rule_store(config):
+    """
+    Return the store that shares rules between workers, or None if every
+    worker loads its own rules (`RULE_SHARED_DIR` is not set)
+    """
+    if not config["RULE_SHARED_DIR"]:
+        return None
+
+    return SharedRuleStore(config["RULE_SHARED_DIR"])
+
+
+def get_rule_listener(app):
+    """
+    Return the listener that refreshes rules when the `urgency_rules` table
+    changes, or None if rules are refreshed by polling (`RULE_REFRESH_MODE`
+    is "poll").
+
+    In "listen" mode, rules are loaded once here so that a preloaded app
+    starts every worker with the current rules.
+    """
+    refresh_mode = app.config["RULE_REFRESH_MODE"]
+    if refresh_mode == "poll":
+        return None
+    elif refresh_mode != "listen":
+        raise ValueError(
+            f"RULE_REFRESH_MODE must be 'poll' or 'listen', not {refresh_mode!r}"
+        )
+
+    refresh_rule_based_model(app)
+    return RuleChangeListener(app, refresh_func=refresh_rule_based_model)
+
+
 def refresh_rules(app):
     """
-    Queries DB for rules, and attaches to app.rules for urgency detection
+    Queries DB for rules and returns them, sorted by rule ID
     """
 
     # Need to push application context. Otherwise will raise:
@@ -128,31 +390,240 @@ def refresh_rules(app):
     # Either work inside a view function or push an application context.
     # See http://flask-sqlalchemy.pocoo.org/contexts/.
 
+    # Rule versions are only needed to store inbound messages compactly, and
+    # only exist in databases with scripts/urgency_rules_versioning.sql
+    versioned = app.config["INBOUND_STORAGE_FORMAT"] == "compact"
     with app.app_context():
-        rows = RulesModel.query.all()
+        query = RulesModel.query
+        if versioned:
+            query = query.options(undefer(RulesModel.urgency_rule_version))
+        rows = query.all()
     rows.sort(key=lambda x: x.urgency_rule_id)
 
-    rules = [
-        {
-            "rule_id": x.urgency_rule_id,
-            "title": x.urgency_rule_title,
-            "rule": KeywordRule(
-                include=[s.lower() for s in x.urgency_rule_tags_include],
-                exclude=[s.lower() for s in x.urgency_rule_tags_exclude],
-            ),
-        }
-        for x in rows
-    ]
-    app.rules = rules
+    rules = [rule_from_row(x, versioned) for x in rows]
     return rules
 
 
-def refresh_rule_based_model(app):
-    """Add new rules to RuleBasedUD  evaluator"""
-    rules_data = refresh_rules(app)
-    rules = [rule["rule"] for rule in rules_data]
-    app.evaluator = RuleBasedUD(model=rules, preprocessor=app.preprocess_text)
-    return len(rules)
+def rule_from_row(row, versioned=False):
+    """
+    Convert a `RulesModel` row into a rule dict. With `versioned`, the rule's
+    `urgency_rule_version` (which must be loaded) is added as `version`.
+    """
+    rule = {
+        "rule_id": row.urgency_rule_id,
+        "title": row.urgency_rule_title,
+        "rule": KeywordRule(
+            include=[s.lower() for s in row.urgency_rule_tags_include],
+            exclude=[s.lower() for s in row.urgency_rule_tags_exclude],
+        ),
+    }
+    if versioned:
+        rule["version"] = row.urgency_rule_version
+    return rule
+
+
+def get_rules_version(rules):
+    """
+    Return the latest version of `rules`, under which the version of each of
+    them can be found in `urgency_rules_history`. None if there are no rules
+    or if their versions are unknown.
+    """
+    versions = [rule.get("version") for rule in rules]
+    if len(versions) == 0 or None in versions:
+        return None
+    return max(versions)
+
+
+def get_rules_db_version(app):
+    """
+    Return the latest version of any rule change in the DB, or None if the DB
+    does not track rule versions (see `scripts/urgency_rules_versioning.sql`)
+    """
+    with app.app_context():
+        try:
+            return db.session.execute(
+                text(
+                    "SELECT COALESCE(GREATEST("
+                    "(SELECT max(urgency_rule_version) FROM urgency_rules), "
+                    "(SELECT max(urgency_rule_version) FROM urgency_rules_deleted)"
+                    "), 0)"
+                )
+            ).scalar()
+        except ProgrammingError:
+            db.session.rollback()
+            app.logger.warning(
+                "Urgency rule versions are not tracked in the DB, "
+                "falling back to full rule refreshes"
+            )
+            return None
+
+
+def get_rule_changes(app, since):
+    """
+    Queries DB for rules changed and deleted after version `since`.
+
+    Returns
+    -------
+    (List[Dict], Set[int]) or None
+        Changed rules, sorted by rule ID, and IDs of deleted rules. None if
+        the rules table was truncated, in which case rules need a full
+        refresh.
+    """
+    with app.app_context():
+        rows = (
+            RulesModel.query.options(undefer(RulesModel.urgency_rule_version))
+            .filter(RulesModel.urgency_rule_version > since)
+            .all()
+        )
+        tombstones = DeletedRulesModel.query.filter(
+            DeletedRulesModel.urgency_rule_version > since
+        ).all()
+
+    deleted_ids = {x.urgency_rule_id for x in tombstones}
+    if None in deleted_ids:
+        return None
+
+    rows.sort(key=lambda x: x.urgency_rule_id)
+    changed = [rule_from_row(x, versioned=True) for x in rows]
+    # A rule deleted and re-inserted with the same ID is still present
+    deleted_ids -= {rule["rule_id"] for rule in changed}
+    return changed, deleted_ids
+
+
+def refresh_rule_based_model(app, force=False, published_since=None):
+    """
+    Build a new RuleEvaluator from the rules in the DB and swap it in.
+
+    If rules are shared between workers (`RULE_SHARED_DIR`), see
+    `refresh_shared_rule_based_model` instead.
+
+    If `RULE_REFRESH_INCREMENTAL` is set, only rules changed since the last
+    refresh are fetched and patched into the current evaluator. Rule versions
+    come from a sequence, so a change committed after a change with a later
+    version can be missed by an incremental refresh; a full refresh every
+    `RULE_FULL_REFRESH_EVERY` refreshes bounds how long that lasts.
+
+    Parameters
+    ----------
+    app : Flask app
+    force : bool
+        Only used with shared rules: query the DB even if another worker
+        has published newer rules
+    published_since : float, optional
+        Only used with shared rules: Unix time from which rules published by
+        any worker are recent enough to be used without querying the DB
+    """
+    if app.rule_store is not None:
+        return refresh_shared_rule_based_model(
+            app, force=force, published_since=published_since
+        )
+
+    with app.rule_refresh_lock:
+        rule_set = app.rule_set
+        db_version = None
+        changes = None
+        if app.config["RULE_REFRESH_INCREMENTAL"]:
+            # Read the version before the rules, so that changes made while
+            # loading are picked up by the next refresh
+            db_version = get_rules_db_version(app)
+            if (
+                db_version is not None
+                and rule_set.db_version is not None
+                and app.n_incremental_rule_refreshes
+                < app.config["RULE_FULL_REFRESH_EVERY"]
+            ):
+                changes = get_rule_changes(app, rule_set.db_version)
+
+        if changes is None:
+            rules_data = refresh_rules(app)
+            evaluator = RuleEvaluator(
+                model=[rule["rule"] for rule in rules_data],
+                preprocessor=app.preprocess_text,
+                keys=[rule["rule_id"] for rule in rules_data],
+            )
+            app.n_incremental_rule_refreshes = 0
+        else:
+            changed, deleted_ids = changes
+            app.n_incremental_rule_refreshes += 1
+            if len(changed) == 0 and len(deleted_ids) == 0:
+                return len(rule_set.rules)
+
+            rules_by_id = {rule["rule_id"]: rule for rule in rule_set.rules}
+            for rule_id in deleted_ids:
+                rules_by_id.pop(rule_id, None)
+            rules_by_id.update((rule["rule_id"], rule) for rule in changed)
+            rules_data = [rules_by_id[rule_id] for rule_id in sorted(rules_by_id)]
+
+            evaluator = rule_set.evaluator.patched(
+                deleted_ids, {rule["rule_id"]: rule["rule"] for rule in changed}
+            )
+
+        # Swap rules and evaluator in with a single assignment, so that a
+        # request never sees rules from one refresh with the evaluator from
+        # another.
+        app.rule_set = RuleSet(
+            rules_data,
+            evaluator,
+            rule_set.version + 1,
+            db_version,
+            get_rules_version(rules_data),
+        )
+
+    # Cached results are keyed by rule set version, so they are never reused
+    # across rule sets. Clearing just frees the memory.
+    if app.message_cache is not None:
+        app.message_cache.clear()
+
+    return len(rules_data)
+
+
+def refresh_shared_rule_based_model(app, force=False, published_since=None):
+    """
+    Refresh rules through the shared rule store.
+
+    Workers take turns publishing: a worker only queries the DB if no other
+    worker has published rules it has not seen yet, or, with
+    `published_since`, if no rules were published since then, and otherwise
+    attaches to the published rules. Each worker queries the DB on its first
+    refresh, so that rules left in the store by a previous deployment are
+    not reused.
+    """
+    rule_store = app.rule_store
+    waited_from = rule_store.generation
+    with rule_store.lock():
+        generation = rule_store.generation
+        published_recently = (
+            published_since is not None and rule_store.published_utc >= published_since
+        )
+        published_by_other = generation != waited_from or (
+            not force
+            and 0 < app.shared_rule_generation
+            and (app.shared_rule_generation < generation or published_recently)
+        )
+        if not published_by_other:
+            rule_store.publish(refresh_rules(app))
+
+    return attach_shared_rules(app)
+
+
+def attach_shared_rules(app):
+    """
+    Swap in the latest rules published to the shared rule store, if they are
+    newer than the current rules
+    """
+    with app.rule_refresh_lock:
+        if app.rule_store.generation != app.shared_rule_generation:
+            generation, rules = app.rule_store.load()
+            evaluator = SharedRuleEvaluator(rules, preprocessor=app.preprocess_text)
+            app.rule_set = RuleSet(
+                rules, evaluator, app.rule_set.version + 1, None, None
+            )
+            app.shared_rule_generation = generation
+
+            if app.message_cache is not None:
+                app.message_cache.clear()
+
+        return len(app.rule_set.rules)
 
 
 def cached_rule_based_model_wrapper(app):
@@ -163,7 +634,10 @@ def cached_rule_based_model_wrapper(app):
         """
         Caches `refresh_faqs` results
         """
-        n_rules = refresh_rule_based_model(app)
+        # With shared rules, one worker per `RULE_REFRESH_FREQ` window queries
+        # the DB, and the others use the rules it published in that window
+        window_start = ttl_hash * app.config["RULE_REFRESH_FREQ"]
+        n_rules = refresh_rule_based_model(app, published_since=window_start)
         return n_rules
 
     return cached_rule_based_model
@@ -1,30 +1,72 @@
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
 from .database_sqlalchemy import db
 
 
 class Inbound(db.Model):
     """
     SQLAlchemy data model for Inbound API calls (with model and return metadata)
+
+    The table is partitioned by month of `inbound_utc` (see
+    scripts/inbounds_partitioning.sql), so its primary key in the database
+    is (`inbound_id`, `inbound_utc`). `inbound_id` alone is still unique.
+
+    In the compact storage format (`INBOUND_STORAGE_FORMAT=compact`),
+    `urgency_score` is the list of matched rule IDs, `returned_content` only
+    has the urgency score, and the matched rules are found from
+    `urgency_rules_history` at `urgency_rule_version`. See `stored_results`
+    in main/inbound.py.
     """
 
     __tablename__ = "inbounds_ud"
 
     inbound_id = db.Column(db.Integer(), primary_key=True)
     inbound_text = db.Column(db.String())
-    inbound_metadata = db.Column(db.JSON())
+    inbound_metadata = db.Column(JSONB())
     inbound_utc = db.Column(db.DateTime())
 
-    urgency_score = db.Column(db.JSON())
+    urgency_score = db.Column(JSONB())
 
-    returned_content = db.Column(db.JSON())
+    returned_content = db.Column(JSONB())
     returned_utc = db.Column(db.DateTime())
-    returned_feedback = db.Column(db.JSON())
+    returned_feedback = db.Column(JSONB())
     feedback_secret_key = db.Column(db.String())
+    # Added by scripts/urgency_rules_history.sql, and only set for messages
+    # stored in the compact format. Deferred so that inbounds can still be
+    # loaded from databases without it.
+    urgency_rule_version = db.deferred(db.Column(db.BigInteger()))
+
+    # IDs of the matched rules, as indexed by scripts/inbounds_jsonb.sql, for
+    # filters such as `Inbound.matched_rule_ids.contains([rule_id])`.
+    # Deferred so that inbounds can still be loaded from databases without it.
+    matched_rule_ids = db.column_property(
+        db.func.inbound_matched_rule_ids(urgency_score, type_=ARRAY(db.Integer())),
+        deferred=True,
+    )
 
     def __repr__(self):
         """repr string"""
         return "<Inbound %r>" % self.inbound_id
 
 
+class InboundTokens(db.Model):
+    """
+    SQLAlchemy data model for the preprocessed tokens of an inbound message,
+    added by scripts/inbound_tokens.sql. `preprocessor_version` identifies
+    the preprocessing parameters the tokens were computed with.
+    """
+
+    __tablename__ = "inbound_tokens"
+
+    inbound_id = db.Column(db.Integer(), primary_key=True)
+    preprocessor_version = db.Column(db.String())
+    inbound_tokens = db.Column(db.ARRAY(db.String()))
+
+    def __repr__(self):
+        """repr string"""
+        return "<InboundTokens %r>" % self.inbound_id
+
+
 class RulesModel(db.Model):
     """
     SQLAlchemy data model for rules
@@ -38,12 +80,79 @@ class RulesModel(db.Model):
     urgency_rule_title = db.Column(db.String())
     urgency_rule_tags_include = db.Column(db.ARRAY(db.String()))
     urgency_rule_tags_exclude = db.Column(db.ARRAY(db.String()))
+    # Added by scripts/urgency_rules_versioning.sql. Deferred so that rules
+    # can still be loaded from databases without it.
+    urgency_rule_version = db.deferred(db.Column(db.BigInteger()))
 
     def __repr__(self):
         """repr string"""
         return "<UrgencyRule %r>" % self.urgency_rule_id
 
 
+class DeletedRulesModel(db.Model):
+    """
+    SQLAlchemy data model for tombstones of deleted rules, used for
+    incremental rule refreshes. A NULL `urgency_rule_id` means the table was
+    truncated.
+    """
+
+    __tablename__ = "urgency_rules_deleted"
+
+    urgency_rule_deleted_id = db.Column(db.Integer, primary_key=True)
+    urgency_rule_id = db.Column(db.Integer)
+    urgency_rule_version = db.Column(db.BigInteger())
+    urgency_rule_deleted_utc = db.Column(db.DateTime())
+
+    def __repr__(self):
+        """repr string"""
+        return "<DeletedUrgencyRule %r>" % self.urgency_rule_id
+
+
+class RescoreRunModel(db.Model):
+    """
+    SQLAlchemy data model for a run of re-scoring past inbound messages with
+    the rules at `urgency_rule_version`, added by scripts/inbound_rescore.sql.
+    `last_inbound_id` is the last message re-scored, from which an unfinished
+    run resumes.
+    """
+
+    __tablename__ = "inbound_rescore_runs"
+
+    rescore_run_id = db.Column(db.Integer, primary_key=True)
+    urgency_rule_version = db.Column(db.BigInteger())
+    preprocessor_version = db.Column(db.String())
+    max_inbound_id = db.Column(db.Integer())
+    last_inbound_id = db.Column(db.Integer())
+    n_inbounds = db.Column(db.Integer())
+    n_newly_urgent = db.Column(db.Integer())
+    n_no_longer_urgent = db.Column(db.Integer())
+    started_utc = db.Column(db.DateTime())
+    updated_utc = db.Column(db.DateTime())
+    finished_utc = db.Column(db.DateTime())
+
+    def __repr__(self):
+        """repr string"""
+        return "<RescoreRun %r>" % self.rescore_run_id
+
+
+class RescoreRuleDiffModel(db.Model):
+    """
+    SQLAlchemy data model for the number of past inbound messages a rule
+    newly matches, or no longer matches, in a re-scoring run
+    """
+
+    __tablename__ = "inbound_rescore_rule_diffs"
+
+    rescore_run_id = db.Column(db.Integer, primary_key=True)
+    urgency_rule_id = db.Column(db.Integer, primary_key=True)
+    n_newly_matched = db.Column(db.Integer())
+    n_no_longer_matched = db.Column(db.Integer())
+
+    def __repr__(self):
+        """repr string"""
+        return "<RescoreRuleDiff %r %r>" % (self.rescore_run_id, self.urgency_rule_id)
+
+
 class TemporaryModel:
     """
     Custom class to use for temporary models. Used as a drop in for other
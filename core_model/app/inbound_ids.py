@@ -0,0 +1,83 @@
+"""
+Allocation of inbound_id values ahead of inserting Inbound records
+"""
+import os
+from collections import deque
+from threading import Lock
+
+from sqlalchemy import text
+
+from .database_sqlalchemy import db
+
+INBOUND_ID_SEQUENCE = "inbounds_ud_inbound_id_seq"
+
+
+class InboundIdAllocator:
+    """
+    Reserves `inbound_id` values from the `inbounds_ud` primary key sequence
+    in blocks, and hands them out locally.
+
+    Each process keeps its own block, so ids are unique across gunicorn
+    workers but are not ordered by insertion time, and unused ids in a block
+    are skipped when a worker exits. A block reserved before a fork is
+    discarded in the child so that workers never share ids.
+    """
+
+    def __init__(self, block_size, get_engine=None):
+        """
+        Parameters
+        ----------
+        block_size : int
+            Number of ids to reserve per round trip to the database
+        get_engine : Callable[[], sqlalchemy.engine.Engine], optional
+            Returns the engine to reserve ids with. Defaults to the app's
+            engine (which needs an application context).
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+
+        self.block_size = block_size
+        if get_engine is None:
+            get_engine = lambda: db.engine
+        self.get_engine = get_engine
+
+        self._ids = deque()
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def allocate(self, n_ids):
+        """
+        Return `n_ids` unused inbound ids
+
+        Parameters
+        ----------
+        n_ids : int
+
+        Returns
+        -------
+        List[int]
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._ids.clear()
+                self._pid = os.getpid()
+
+            shortfall = n_ids - len(self._ids)
+            if shortfall > 0:
+                self._ids.extend(self._reserve(max(shortfall, self.block_size)))
+
+            return [self._ids.popleft() for _ in range(n_ids)]
+
+    def _reserve(self, n_ids):
+        """
+        Reserve `n_ids` values from the sequence in a single query
+        """
+        with self.get_engine().connect() as connection:
+            result = connection.execute(
+                text(
+                    f"SELECT nextval('{INBOUND_ID_SEQUENCE}') "
+                    "FROM generate_series(1, :n)"
+                ),
+                n=n_ids,
+            )
+            return [row[0] for row in result]
@@ -0,0 +1,241 @@
+"""
+Monthly partitions of the inbounds_ud table, see
+scripts/inbounds_partitioning.sql
+"""
+import logging
+import re
+from collections import namedtuple
+from datetime import date, datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .database_sqlalchemy import db
+
+logger = logging.getLogger(__name__)
+
+RETENTION_MODES = ("detach", "archive", "drop")
+
+InboundPartition = namedtuple("InboundPartition", ["name", "start_utc", "end_utc"])
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def add_months(month, n_months):
+    """
+    Return the first day of the month `n_months` after the month of `month`
+    """
+    index = month.year * 12 + month.month - 1 + n_months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_inbound_partitions(engine, first_month, last_month):
+    """
+    Create the missing monthly partitions of inbounds_ud from `first_month`
+    to `last_month`, moving their messages out of the default partition
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+    first_month : datetime.date
+    last_month : datetime.date
+
+    Returns
+    -------
+    List[str]
+        Names of the partitions created
+    """
+    with engine.begin() as connection:
+        result = connection.execute(
+            text("SELECT create_inbound_partitions(:first_month, :last_month)"),
+            first_month=first_month,
+            last_month=last_month,
+        )
+        return [row[0] for row in result]
+
+
+def create_upcoming_inbound_partitions(engine, months_ahead):
+    """
+    Create the partitions of the current month and the next `months_ahead`
+    months, if missing. Returns the names of the partitions created.
+    """
+    this_month = datetime.utcnow().date().replace(day=1)
+    return create_inbound_partitions(
+        engine, this_month, add_months(this_month, months_ahead)
+    )
+
+
+def ensure_inbound_partitions(app):
+    """
+    Create upcoming partitions at app startup, if enabled
+    (`INBOUND_PARTITIONS_AHEAD` is positive). Off by default, since the DDL
+    takes strong locks on inbounds_ud; `flask create-inbound-partitions` run
+    as a scheduled job is preferred. Only logs a warning if they cannot be
+    created, since messages without a partition go to the default partition.
+    """
+    months_ahead = app.config["INBOUND_PARTITIONS_AHEAD"]
+    if months_ahead <= 0:
+        return
+
+    with app.app_context():
+        try:
+            created = create_upcoming_inbound_partitions(db.engine, months_ahead)
+        except SQLAlchemyError:
+            app.logger.warning(
+                "Could not create inbounds_ud partitions, see "
+                "scripts/inbounds_partitioning.sql",
+                exc_info=True,
+            )
+            return
+
+    if created:
+        app.logger.info("Created inbounds_ud partitions %s", ", ".join(created))
+
+
+def list_inbound_partitions(connection):
+    """
+    Return the monthly partitions of inbounds_ud, oldest first. The default
+    partition is left out.
+
+    Returns
+    -------
+    List[InboundPartition]
+    """
+    rows = connection.execute(
+        text(
+            "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits "
+            "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = 'inbounds_ud'::regclass"
+        )
+    )
+
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND.search(bound)
+        if match is None:
+            continue
+        start_utc, end_utc = (datetime.fromisoformat(value) for value in match.groups())
+        partitions.append(InboundPartition(name, start_utc, end_utc))
+    return sorted(partitions, key=lambda partition: partition.start_utc)
+
+
+def apply_inbound_retention(
+    engine, before_utc, mode="detach", archive_schema="inbounds_archive"
+):
+    """
+    Remove the partitions of inbounds_ud whose messages were all received
+    before `before_utc`, one transaction per partition. The saved tokens of
+    their messages are deleted.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+    before_utc : datetime.datetime
+    mode : str
+        "detach" keeps each partition as a standalone table, "archive" also
+        moves it to `archive_schema`, and "drop" drops it.
+    archive_schema : str
+        Schema to move partitions to in "archive" mode
+
+    Returns
+    -------
+    List[InboundPartition]
+        Partitions removed
+    """
+    if mode not in RETENTION_MODES:
+        raise ValueError(
+            f"mode must be one of {', '.join(RETENTION_MODES)}, not {mode!r}"
+        )
+
+    with engine.connect() as connection:
+        partitions = [
+            partition
+            for partition in list_inbound_partitions(connection)
+            if partition.end_utc <= before_utc
+        ]
+        has_tokens = connection.execute(
+            text("SELECT to_regclass('inbound_tokens') IS NOT NULL")
+        ).scalar()
+
+    for partition in partitions:
+        with engine.begin() as connection:
+            if has_tokens:
+                connection.execute(
+                    text(
+                        f'DELETE FROM inbound_tokens USING "{partition.name}" AS inbound '
+                        "WHERE inbound_tokens.inbound_id = inbound.inbound_id"
+                    )
+                )
+            connection.execute(
+                text(f'ALTER TABLE inbounds_ud DETACH PARTITION "{partition.name}"')
+            )
+            if mode == "archive":
+                connection.execute(
+                    text(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+                )
+                connection.execute(
+                    text(
+                        f'ALTER TABLE "{partition.name}" SET SCHEMA "{archive_schema}"'
+                    )
+                )
+            elif mode == "drop":
+                connection.execute(text(f'DROP TABLE "{partition.name}"'))
+        logger.info("Removed inbounds_ud partition %s (%s)", partition.name, mode)
+
+    return partitions
+
+
+@click.command("create-inbound-partitions")
+@click.option(
+    "--months-ahead",
+    default=3,
+    show_default=True,
+    help="Number of months after the current one",
+)
+@with_appcontext
+def create_inbound_partitions_command(months_ahead):
+    """
+    Create the partitions of inbounds_ud for the current and upcoming months.
+    """
+    created = create_upcoming_inbound_partitions(db.engine, months_ahead)
+    if created:
+        click.echo(f"Created partitions {', '.join(created)}")
+    else:
+        click.echo("All partitions already exist")
+
+
+@click.command("inbound-retention")
+@click.option(
+    "--months",
+    type=int,
+    required=True,
+    help="Number of months to keep, besides the current one",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(RETENTION_MODES),
+    default="detach",
+    show_default=True,
+    help="What to do with the partitions of older months",
+)
+@click.option("--archive-schema", default="inbounds_archive", show_default=True)
+@with_appcontext
+def inbound_retention_command(months, mode, archive_schema):
+    """
+    Detach, archive or drop the partitions of inbounds_ud older than
+    `--months` months.
+    """
+    this_month = datetime.utcnow().date().replace(day=1)
+    before_month = add_months(this_month, -months)
+    before_utc = datetime(before_month.year, before_month.month, 1)
+    partitions = apply_inbound_retention(db.engine, before_utc, mode, archive_schema)
+    if partitions:
+        click.echo(
+            f"Removed ({mode}) partitions "
+            f"{', '.join(partition.name for partition in partitions)}"
+        )
+    else:
+        click.echo(f"No partitions before {before_utc:%Y-%m}")
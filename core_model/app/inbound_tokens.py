@@ -0,0 +1,153 @@
+"""
+Storage of the preprocessed tokens of inbound messages
+"""
+from collections import namedtuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .data_models import Inbound, InboundTokens
+from .database_sqlalchemy import db
+
+# An inbound message with its tokens. `preprocessed` is True if the tokens
+# were computed rather than read from `inbound_tokens`.
+TokenizedInbound = namedtuple(
+    "TokenizedInbound",
+    ["inbound_id", "inbound_utc", "inbound_text", "tokens", "preprocessed"],
+)
+
+
+def save_inbound_tokens(connection, preprocessor_version, tokens_by_id):
+    """
+    Insert or replace the tokens of inbound messages
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection or sqlalchemy.orm.Session
+        Connection or session to write with, in its current transaction
+    preprocessor_version : str
+        See `get_preprocessor_version`
+    tokens_by_id : Dict[int, List[str]]
+        Tokens of each inbound message, by inbound id
+    """
+    if len(tokens_by_id) == 0:
+        return
+
+    table = InboundTokens.__table__
+    statement = insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.inbound_id],
+        set_={
+            "preprocessor_version": statement.excluded.preprocessor_version,
+            "inbound_tokens": statement.excluded.inbound_tokens,
+        },
+    )
+    connection.execute(
+        statement,
+        [
+            {
+                "inbound_id": inbound_id,
+                "preprocessor_version": preprocessor_version,
+                "inbound_tokens": list(tokens),
+            }
+            for inbound_id, tokens in tokens_by_id.items()
+        ],
+    )
+
+
+def tokenized_inbounds_query(preprocessor_version):
+    """
+    Return a query for the id, time and text of inbound messages, with their
+    saved tokens if they were computed with `preprocessor_version` (else
+    NULL)
+
+    Parameters
+    ----------
+    preprocessor_version : str
+        See `get_preprocessor_version`
+
+    Returns
+    -------
+    sqlalchemy.sql.Select
+    """
+    inbounds = Inbound.__table__
+    tokens = InboundTokens.__table__
+    return select(
+        inbounds.c.inbound_id,
+        inbounds.c.inbound_utc,
+        inbounds.c.inbound_text,
+        tokens.c.inbound_tokens,
+    ).select_from(
+        inbounds.outerjoin(
+            tokens,
+            and_(
+                tokens.c.inbound_id == inbounds.c.inbound_id,
+                tokens.c.preprocessor_version == preprocessor_version,
+            ),
+        )
+    )
+
+
+def iter_tokenized_inbounds(
+    preprocess, preprocessor_version, start_utc, end_utc, chunk_size
+):
+    """
+    Stream inbound messages received in `[start_utc, end_utc)` with their
+    tokens, in chunks.
+
+    Messages are read with a server-side cursor, so only one chunk is held in
+    memory at a time. Tokens saved with `preprocessor_version` are reused;
+    other messages are preprocessed and their tokens saved, one transaction
+    per chunk.
+
+    Parameters
+    ----------
+    preprocess : Callable[[str], List[str]]
+        Text preprocessor, e.g. `app.preprocess_text`
+    preprocessor_version : str
+        Version of `preprocess`, see `get_preprocessor_version`
+    start_utc : datetime.datetime
+    end_utc : datetime.datetime
+    chunk_size : int
+        Number of messages to fetch per round trip to the database
+
+    Yields
+    ------
+    List[TokenizedInbound]
+    """
+    inbounds = Inbound.__table__
+    query = tokenized_inbounds_query(preprocessor_version).where(
+        inbounds.c.inbound_utc >= start_utc,
+        inbounds.c.inbound_utc < end_utc,
+    )
+
+    with db.engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, max_row_buffer=chunk_size
+        ).execute(query)
+
+        for rows in result.partitions(chunk_size):
+            chunk = []
+            new_tokens = {}
+            for inbound_id, inbound_utc, inbound_text, saved_tokens in rows:
+                if saved_tokens is None:
+                    inbound_tokens = preprocess(inbound_text)
+                    new_tokens[inbound_id] = inbound_tokens
+                else:
+                    inbound_tokens = saved_tokens
+                chunk.append(
+                    TokenizedInbound(
+                        inbound_id,
+                        inbound_utc,
+                        inbound_text,
+                        inbound_tokens,
+                        saved_tokens is None,
+                    )
+                )
+
+            # Written on a separate connection, since this one is busy
+            # with the cursor
+            with db.engine.begin() as write_connection:
+                save_inbound_tokens(write_connection, preprocessor_version, new_tokens)
+
+            yield chunk
@@ -0,0 +1,200 @@
+"""
+Write-behind persistence of Inbound records
+"""
+import atexit
+import logging
+import os
+import time
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+
+from .data_models import Inbound
+from .database_sqlalchemy import db
+from .inbound_tokens import save_inbound_tokens
+from .prometheus_metrics import (
+    inbound_write_flush_seconds,
+    inbound_write_queue_depth,
+    inbound_write_records,
+)
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("sync", "block")
+
+
+class InboundWriter:
+    """
+    Queues Inbound records and inserts them in batches from a background
+    thread, so that requests don't wait for a database commit.
+
+    A batch is flushed when it reaches `batch_size` records or when
+    `flush_interval` seconds have passed since its first record was queued.
+    Each gunicorn worker starts its own writer thread on the first submitted
+    record, and `stop` flushes any queued records on shutdown.
+
+    Records must already have an `inbound_id`, since the database does not
+    generate it before the response is returned. Their preprocessed tokens,
+    if given, are written in the same transaction.
+    """
+
+    max_attempts = 3
+
+    def __init__(
+        self, app, batch_size, flush_interval, queue_size, overflow_policy="sync"
+    ):
+        """
+        Parameters
+        ----------
+        app : Flask app
+            App whose database the records are written to
+        batch_size : int
+            Maximum number of records per insert
+        flush_interval : float
+            Maximum seconds a record waits in the queue before being flushed
+        queue_size : int
+            Maximum number of queued records
+        overflow_policy : str
+            What to do when the queue is full: "sync" writes the record on
+            the calling thread, "block" waits for space in the queue.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow_policy must be one of {OVERFLOW_POLICIES}, "
+                f"not {overflow_policy!r}"
+            )
+
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = False
+        self._start_lock = Lock()
+
+    def submit(self, record, tokens=None):
+        """
+        Queue an Inbound record, as a dict of column values, for writing
+
+        Parameters
+        ----------
+        record : Dict
+        tokens : List[str], optional
+            Preprocessed tokens of the inbound message, to save in
+            `inbound_tokens`
+        """
+        self._ensure_started()
+
+        item = (record, tokens)
+        if self.overflow_policy == "block":
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except Full:
+                inbound_write_records.labels(outcome="overflow_sync").inc()
+                self._write([item])
+                return
+
+        inbound_write_queue_depth.set(self._queue.qsize())
+
+    def stop(self, timeout=None):
+        """
+        Flush queued records and stop the writer thread
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum seconds to wait for the writer thread to finish
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+
+        self._stopping = True
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        """
+        Start the writer thread if it is not running in this process.
+
+        Threads do not survive a fork, so a writer created in the preloaded
+        gunicorn master starts a new thread (and queue) in each worker.
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._queue = Queue(maxsize=self.queue_size)
+            self._stopping = False
+            self._thread = Thread(target=self._run, name="inbound-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        """
+        Writer thread loop: collect records into batches and write them
+        """
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except Empty:
+                if self._stopping:
+                    return
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if self._stopping:
+                    timeout = 0
+                else:
+                    timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=max(timeout, 0)))
+                except Empty:
+                    break
+
+            self._write(batch)
+            inbound_write_queue_depth.set(self._queue.qsize())
+
+    def _write(self, items):
+        """
+        Insert queued `(record, tokens)` items in a single transaction,
+        retrying on failure
+        """
+        records = [record for record, _ in items]
+        tokens_by_id = {
+            record["inbound_id"]: tokens
+            for record, tokens in items
+            if tokens is not None
+        }
+        for attempt in range(1, self.max_attempts + 1):
+            start = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as connection:
+                        connection.execute(Inbound.__table__.insert(), records)
+                        save_inbound_tokens(
+                            connection, self.app.preprocessor_version, tokens_by_id
+                        )
+            except Exception:
+                if attempt == self.max_attempts:
+                    logger.exception(
+                        "Failed to write %d inbound records after %d attempts",
+                        len(records),
+                        attempt,
+                    )
+                    inbound_write_records.labels(outcome="failed").inc(len(records))
+                    return
+                time.sleep(0.5 * attempt)
+            else:
+                inbound_write_flush_seconds.observe(time.perf_counter() - start)
+                inbound_write_records.labels(outcome="written").inc(len(records))
+                return
@@ -1,24 +1,31 @@
 ##############################################################################
 # INBOUND ENDPOINTS
 ##############################################################################
+import json
 import os
 from base64 import b64encode
 from datetime import datetime
 
 from flask import current_app, request
 from flask_restx import Resource
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy import text
 
+from .. import attach_shared_rules
 from ..data_models import Inbound
 from ..database_sqlalchemy import db
+from ..inbound_tokens import save_inbound_tokens
 from ..prometheus_metrics import metrics
 from ..src.utils import get_ttl_hash
 from .auth import auth
 from .swagger_components import (
     api,
+    inbound_check_batch_fields,
     inbound_check_fields,
+    inbound_feedback_batch_fields,
     inbound_feedback_fields,
+    response_check_batch_fields,
     response_check_fields,
+    response_feedback_batch_fields,
 )
 
 
@@ -59,10 +66,7 @@ class UrgencyCheck(Resource):
         See class docstring for details.
         """
         received_ts = datetime.utcnow()
-        if current_app.config["RULE_REFRESH_FREQ"] > 0:
-            current_app.cached_rule_refresh(
-                get_ttl_hash(current_app.config["RULE_REFRESH_FREQ"])
-            )
+        refresh_rules_if_stale()
 
         incoming = request.json
         if "metadata" in incoming:
@@ -71,23 +75,10 @@ class UrgencyCheck(Resource):
             incoming_metadata = None
 
         raw_text = incoming["text_to_match"]
-        if len(current_app.rules) == 0:
-            urgency_score = None
-            matched_rules = []
-        else:
-            urgency_values = current_app.evaluator.predict_scores(raw_text)
-            urgency_score = current_app.evaluator.predict(raw_text)
-
-            matched_rules = [
-                {
-                    "rule_id": x["rule_id"],
-                    "title": x["title"],
-                    "include": x["rule"].include,
-                    "exclude": x["rule"].exclude,
-                }
-                for x, urgency_value in zip(current_app.rules, urgency_values)
-                if urgency_value == 1.0
-            ]
+        rule_set = current_app.rule_set
+        urgency_score, matched_rules, tokens = check_urgency(raw_text, rule_set)
+        if not current_app.config["INBOUND_SAVE_TOKENS"]:
+            tokens = None
 
         processed_ts = datetime.utcnow()
         feedback_secret_key = b64encode(os.urandom(32)).decode("utf-8")
@@ -97,24 +88,302 @@ class UrgencyCheck(Resource):
         json_return["matched_urgency_rules"] = matched_rules
         json_return["feedback_secret_key"] = feedback_secret_key
 
-        new_inbound_query = Inbound(
+        new_inbound = dict(
             feedback_secret_key=feedback_secret_key,
             inbound_text=raw_text,
             inbound_metadata=incoming_metadata,
             inbound_utc=received_ts,
-            urgency_score=matched_rules,
-            returned_content=json_return,
             returned_utc=processed_ts,
+            **stored_results(json_return, rule_set.rules_version),
         )
 
-        db.session.add(new_inbound_query)
-        db.session.commit()
-
-        json_return["inbound_id"] = new_inbound_query.inbound_id
+        if current_app.inbound_writer is None:
+            new_inbound_query = Inbound(**new_inbound)
+            db.session.add(new_inbound_query)
+            if tokens is not None:
+                # Flush to get the inbound_id, and save the tokens in the
+                # same transaction
+                db.session.flush()
+                save_inbound_tokens(
+                    db.session,
+                    current_app.preprocessor_version,
+                    {new_inbound_query.inbound_id: tokens},
+                )
+            db.session.commit()
+            json_return["inbound_id"] = new_inbound_query.inbound_id
+        else:
+            new_inbound["inbound_id"] = current_app.inbound_id_allocator.allocate(1)[0]
+            current_app.inbound_writer.submit(new_inbound, tokens)
+            json_return["inbound_id"] = new_inbound["inbound_id"]
 
         return json_return
 
 
+@api.route("/inbound/check-batch")
+class UrgencyCheckBatch(Resource):
+    """
+    Handles a batch of inbound queries, returns urgency of each query
+
+    All inbound records are written with a single bulk insert and commit.
+
+    Parameters
+    ----------
+    request (request proxy; see https://flask.palletsprojects.com/en/1.1.x/reqcontext/)
+        The request should be sent as JSON with fields:
+        - messages (required, list of dicts, up to `INBOUND_BATCH_MAX_SIZE`)
+            Each dict has the same fields as a request to /inbound/check:
+            - text_to_match (required, string)
+            - metadata (optional, list/string/dict/etc.)
+
+    Returns
+    -------
+    JSON
+        Fields:
+        - results: list of dicts in the same order as `messages`, each with
+          the same fields as a response from /inbound/check
+    str, HTTP status
+        Missing or empty `messages`: "No messages", 400
+        `messages` not a list of dicts with a string `text_to_match`:
+            "Invalid messages", 400
+        More than `INBOUND_BATCH_MAX_SIZE` messages: "Too many messages", 413
+    """
+
+    @api.doc(
+        model=response_check_batch_fields,
+        body=inbound_check_batch_fields,
+        security="Bearer",
+    )
+    @metrics.do_not_track()
+    @metrics.summary(
+        "ud_inbound_batch_by_status_current",
+        "UD Inbound batch latencies current",
+        labels={"status": lambda r: r.status_code},
+    )
+    @metrics.counter(
+        "ud_inbound_batch_by_status",
+        "UD Inbound batch invocations counter",
+        labels={"status": lambda r: r.status_code},
+    )
+    @auth.login_required
+    def post(self):
+        """
+        See class docstring for details.
+        """
+        received_ts = datetime.utcnow()
+
+        incoming = request.json
+        messages = incoming.get("messages") if isinstance(incoming, dict) else None
+        if not messages:
+            return "No messages", 400
+        elif not isinstance(messages, list) or not all(
+            isinstance(message, dict) and isinstance(message.get("text_to_match"), str)
+            for message in messages
+        ):
+            return "Invalid messages", 400
+        elif len(messages) > current_app.config["INBOUND_BATCH_MAX_SIZE"]:
+            return "Too many messages", 413
+
+        refresh_rules_if_stale()
+        rule_set = current_app.rule_set
+
+        results = []
+        new_inbounds = []
+        new_tokens = []
+        for message in messages:
+            raw_text = message["text_to_match"]
+            urgency_score, matched_rules, tokens = check_urgency(raw_text, rule_set)
+            if current_app.config["INBOUND_SAVE_TOKENS"]:
+                new_tokens.append(tokens)
+            else:
+                new_tokens.append(None)
+
+            json_return = dict()
+            json_return["urgency_score"] = urgency_score
+            json_return["matched_urgency_rules"] = matched_rules
+            json_return["feedback_secret_key"] = b64encode(os.urandom(32)).decode(
+                "utf-8"
+            )
+            results.append(json_return)
+
+            new_inbounds.append(
+                dict(
+                    feedback_secret_key=json_return["feedback_secret_key"],
+                    inbound_text=raw_text,
+                    inbound_metadata=message.get("metadata"),
+                    inbound_utc=received_ts,
+                    **stored_results(json_return, rule_set.rules_version),
+                )
+            )
+
+        processed_ts = datetime.utcnow()
+        inbound_ids = current_app.inbound_id_allocator.allocate(len(new_inbounds))
+        for new_inbound, json_return, inbound_id in zip(
+            new_inbounds, results, inbound_ids
+        ):
+            new_inbound["inbound_id"] = inbound_id
+            new_inbound["returned_utc"] = processed_ts
+            json_return["inbound_id"] = inbound_id
+
+        if current_app.inbound_writer is None:
+            db.session.execute(Inbound.__table__.insert(), new_inbounds)
+            save_inbound_tokens(
+                db.session,
+                current_app.preprocessor_version,
+                {
+                    inbound_id: tokens
+                    for inbound_id, tokens in zip(inbound_ids, new_tokens)
+                    if tokens is not None
+                },
+            )
+            db.session.commit()
+        else:
+            for new_inbound, tokens in zip(new_inbounds, new_tokens):
+                current_app.inbound_writer.submit(new_inbound, tokens)
+
+        return {"results": results}
+
+
+def refresh_rules_if_stale():
+    """
+    Refresh the rules if `RULE_REFRESH_FREQ` seconds have passed since the
+    last refresh. Disabled if `RULE_REFRESH_FREQ` is 0, or if rules are
+    refreshed by the rule listener.
+
+    If rules are shared between workers, first attach to rules published by
+    another worker since the last request.
+    """
+    rule_store = current_app.rule_store
+    if (
+        rule_store is not None
+        and rule_store.generation != current_app.shared_rule_generation
+    ):
+        attach_shared_rules(current_app)
+
+    if current_app.rule_listener is not None:
+        return
+
+    if current_app.config["RULE_REFRESH_FREQ"] > 0:
+        current_app.cached_rule_refresh(
+            get_ttl_hash(current_app.config["RULE_REFRESH_FREQ"])
+        )
+
+
+def check_urgency(raw_text, rule_set=None):
+    """
+    Evaluate the current urgency rules against a raw message, using the
+    message result cache if it is enabled
+
+    Parameters
+    ----------
+    raw_text : str
+        Inbound message
+    rule_set : RuleSet, optional
+        Rules to evaluate. Defaults to the app's current rules.
+
+    Returns
+    -------
+    urgency_score : float or None
+        None if there are no rules
+    matched_rules : List[Dict]
+        Rule ID, title and keywords of each matched rule
+    tokens : List[str] or None
+        Preprocessed message. None if there are no rules, since the message
+        is not preprocessed then.
+    """
+    if rule_set is None:
+        rule_set = current_app.rule_set
+    if len(rule_set.rules) == 0:
+        return None, [], None
+
+    message_cache = current_app.message_cache
+    if message_cache is not None:
+        cache_key = (rule_set.version, normalize_message(raw_text))
+        cached_result = message_cache.get(cache_key)
+    else:
+        cached_result = None
+
+    if cached_result is None:
+        # Preprocess once and get per-rule and aggregate scores together
+        evaluation = rule_set.evaluator.evaluate(raw_text)
+        urgency_score = evaluation.urgency_score
+        matched_rule_indices = tuple(evaluation.matched_rule_indices)
+        tokens = evaluation.preprocessed_text
+
+        if message_cache is not None:
+            message_cache.put(cache_key, (urgency_score, matched_rule_indices, tokens))
+    else:
+        urgency_score, matched_rule_indices, tokens = cached_result
+
+    matched_rules = [
+        {
+            "rule_id": rule_set.rules[i]["rule_id"],
+            "title": rule_set.rules[i]["title"],
+            "include": rule_set.rules[i]["rule"].include,
+            "exclude": rule_set.rules[i]["rule"].exclude,
+        }
+        for i in matched_rule_indices
+    ]
+
+    return urgency_score, matched_rules, tokens
+
+
+def stored_results(json_return, rules_version):
+    """
+    Return the fields of an inbound record that hold the results of a check,
+    in the format set by `INBOUND_STORAGE_FORMAT`.
+
+    The "full" format stores the matched rules, with their title and
+    keywords, in `urgency_score` and the whole response in
+    `returned_content`. The "compact" format stores only the IDs of the
+    matched rules in `urgency_score`, the urgency score in
+    `returned_content`, and the version of the rules in
+    `urgency_rule_version`, from which the matched rules can be found in
+    `urgency_rules_history` (see scripts/urgency_rules_history.sql). In the
+    compact format, messages checked with rules of unknown version (e.g.
+    shared between workers) are stored in the full format.
+
+    Parameters
+    ----------
+    json_return : Dict
+        Response to the check, without `inbound_id`
+    rules_version : int or None
+        `rules_version` of the rule set the message was checked with
+
+    Returns
+    -------
+    Dict
+    """
+    if current_app.config["INBOUND_STORAGE_FORMAT"] == "full":
+        return dict(
+            urgency_score=json_return["matched_urgency_rules"],
+            returned_content=json_return.copy(),
+        )
+    elif rules_version is None:
+        return dict(
+            urgency_score=json_return["matched_urgency_rules"],
+            returned_content=json_return.copy(),
+            urgency_rule_version=None,
+        )
+
+    return dict(
+        urgency_score=[
+            rule["rule_id"] for rule in json_return["matched_urgency_rules"]
+        ],
+        returned_content={"urgency_score": json_return["urgency_score"]},
+        urgency_rule_version=rules_version,
+    )
+
+
+def normalize_message(raw_text):
+    """
+    Normalize case and whitespace of a message for use as a cache key.
+
+    Preprocessing lowercases and tokenizes messages, so messages that only
+    differ in case or whitespace give the same urgency results.
+    """
+    return " ".join(raw_text.lower().split())
+
+
 @api.route("/inbound/feedback")
 class InboundCheck(Resource):
     """
@@ -126,12 +395,14 @@ class InboundCheck(Resource):
         The request should be sent as JSON with fields:
         - "inbound_id" (required, used to match original inbound query)
         - "feedback_secret_key" (required, used to match original inbound query)
-        - "feedback"
+        - "feedback" (required)
 
     Returns
     -------
     str, HTTP status
         Successful: "Success", 200
+        Missing a required field: "Missing inbound_id, feedback_secret_key or
+            feedback", 400
         Did not match any previous inbound query: "No Matches", 404
         Matched previous inbound query, but feedback secret key incorrect:
             "Incorrect Feedback Secret Key", 403
@@ -155,26 +426,206 @@ class InboundCheck(Resource):
         See class docstring for details.
         """
         feedback_request = request.json
+        if not is_complete_feedback(feedback_request):
+            return FEEDBACK_MESSAGES[400], 400
+
+        status = append_feedback(
+            [
+                (
+                    feedback_request["inbound_id"],
+                    feedback_request["feedback_secret_key"],
+                    feedback_request["feedback"],
+                )
+            ]
+        )[0]
+        return FEEDBACK_MESSAGES[status], status
 
-        orig_inbound = Inbound.query.filter_by(
-            inbound_id=feedback_request["inbound_id"]
-        ).first()
 
-        if orig_inbound is None:
-            return "No Matches", 404
-        elif (
-            orig_inbound.feedback_secret_key != feedback_request["feedback_secret_key"]
-        ):
-            return "Incorrect Feedback Secret Key", 403
+@api.route("/inbound/feedback-batch")
+class InboundFeedbackBatch(Resource):
+    """
+    Handles a batch of inbound feedback
+
+    All feedback is appended with a single UPDATE and commit.
+
+    Parameters
+    ----------
+    request (request proxy; see https://flask.palletsprojects.com/en/1.1.x/reqcontext/)
+        The request should be sent as JSON with fields:
+        - feedback (required, list of dicts, up to `INBOUND_BATCH_MAX_SIZE`)
+            Each dict has the same fields as a request to /inbound/feedback:
+            - inbound_id (required)
+            - feedback_secret_key (required)
+            - feedback (required)
+
+    Returns
+    -------
+    JSON
+        Fields:
+        - results: list of dicts in the same order as `feedback`, each with
+          the `status` and `message` a request to /inbound/feedback would
+          have returned
+    str, HTTP status
+        Missing, empty or non-list `feedback`: "No feedback", 400
+        More than `INBOUND_BATCH_MAX_SIZE` items: "Too much feedback", 413
+    """
 
-        if orig_inbound.returned_feedback:
-            orig_inbound.returned_feedback.append(feedback_request["feedback"])
-            # Need to flag dirty, since modifying JSON object
-            # https://docs.sqlalchemy.org/en/14/orm/session_api.htm
-            flag_modified(orig_inbound, "returned_feedback")
+    @api.doc(
+        model=response_feedback_batch_fields,
+        body=inbound_feedback_batch_fields,
+        security="Bearer",
+    )
+    @metrics.do_not_track()
+    @metrics.summary(
+        "ud_feedback_batch_by_status_current",
+        "UD Feedback batch requests latencies current",
+        labels={"status": lambda r: r.status_code},
+    )
+    @metrics.counter(
+        "ud_feedback_batch_by_status",
+        "UD Feedback batch invocations counter",
+        labels={"status": lambda r: r.status_code},
+    )
+    @auth.login_required
+    def put(self):
+        """
+        See class docstring for details.
+        """
+        incoming = request.json
+        feedback = incoming.get("feedback") if isinstance(incoming, dict) else None
+        if not feedback or not isinstance(feedback, list):
+            return "No feedback", 400
+        elif len(feedback) > current_app.config["INBOUND_BATCH_MAX_SIZE"]:
+            return "Too much feedback", 413
+
+        # Incomplete items get a 400 and are left out of the update
+        complete = [is_complete_feedback(item) for item in feedback]
+        appended = iter(
+            append_feedback(
+                [
+                    (item["inbound_id"], item["feedback_secret_key"], item["feedback"])
+                    for item, is_complete in zip(feedback, complete)
+                    if is_complete
+                ]
+            )
+        )
+        statuses = [next(appended) if is_complete else 400 for is_complete in complete]
+        return {
+            "results": [
+                {"status": status, "message": FEEDBACK_MESSAGES[status]}
+                for status in statuses
+            ]
+        }
+
+
+FEEDBACK_FIELDS = ("inbound_id", "feedback_secret_key", "feedback")
+
+FEEDBACK_MESSAGES = {
+    200: "Success",
+    400: "Missing inbound_id, feedback_secret_key or feedback",
+    403: "Incorrect Feedback Secret Key",
+    404: "No Matches",
+}
+
+# Appends feedback to the inbounds whose id and secret key match, in one
+# statement, so concurrent feedback for the same inbound is not lost.
+# `:feedback` is a JSON array of {inbound_id, feedback_secret_key, feedback},
+# where `feedback` is an array of items to append. Missing or non-array
+# feedback is replaced.
+APPEND_FEEDBACK_SQL = """
+UPDATE inbounds_ud AS inbound
+SET returned_feedback = CASE
+        WHEN jsonb_typeof(inbound.returned_feedback::jsonb) = 'array'
+        THEN inbound.returned_feedback::jsonb || item.feedback
+        ELSE item.feedback
+    END
+FROM jsonb_to_recordset(CAST(:feedback AS jsonb))
+    AS item(inbound_id integer, feedback_secret_key text, feedback jsonb)
+WHERE inbound.inbound_id = item.inbound_id
+    AND inbound.feedback_secret_key = item.feedback_secret_key
+RETURNING inbound.inbound_id, inbound.feedback_secret_key
+"""
+
+
+def is_complete_feedback(item):
+    """
+    Return True if a feedback request or batch item has all the required
+    fields
+    """
+    return isinstance(item, dict) and all(field in item for field in FEEDBACK_FIELDS)
+
+
+def append_feedback(items):
+    """
+    Append feedback to inbound messages with a single conditional UPDATE,
+    which only changes messages whose feedback secret key matches.
+
+    The affected rows tell which items succeeded. For the others, a second
+    query checks whether the message exists, to tell an incorrect secret key
+    from an unknown message.
+
+    Parameters
+    ----------
+    items : List[Tuple[int, str, Any]]
+        Inbound ID, feedback secret key and feedback of each item
+
+    Returns
+    -------
+    List[int]
+        HTTP status of each item: 200 if the feedback was appended, 403 if the
+        secret key is incorrect, 404 if there is no such inbound message
+    """
+    # Feedback for the same message is appended in one row of the UPDATE,
+    # since a row can only be updated once per statement
+    grouped = {}
+    keys = []
+    for inbound_id, feedback_secret_key, feedback in items:
+        try:
+            key = (int(inbound_id), str(feedback_secret_key))
+        except (TypeError, ValueError):
+            key = None
         else:
-            orig_inbound.returned_feedback = [feedback_request["feedback"]]
+            grouped.setdefault(key, []).append(feedback)
+        keys.append(key)
 
-        db.session.add(orig_inbound)
-        db.session.commit()
-        return "Success", 200
+    if len(grouped) == 0:
+        return [404] * len(items)
+
+    updated = db.session.execute(
+        text(APPEND_FEEDBACK_SQL),
+        {
+            "feedback": json.dumps(
+                [
+                    {
+                        "inbound_id": inbound_id,
+                        "feedback_secret_key": feedback_secret_key,
+                        "feedback": feedback,
+                    }
+                    for (inbound_id, feedback_secret_key), feedback in grouped.items()
+                ]
+            )
+        },
+    ).fetchall()
+    db.session.commit()
+
+    updated = {tuple(row) for row in updated}
+    missed_ids = {key[0] for key in grouped if key not in updated}
+    existing_ids = set()
+    if missed_ids:
+        existing_ids = {
+            row[0]
+            for row in db.session.execute(
+                text("SELECT inbound_id FROM inbounds_ud WHERE inbound_id = ANY(:ids)"),
+                {"ids": list(missed_ids)},
+            )
+        }
+
+    statuses = []
+    for key in keys:
+        if key in updated:
+            statuses.append(200)
+        elif key is not None and key[0] in existing_ids:
+            statuses.append(403)
+        else:
+            statuses.append(404)
+    return statuses
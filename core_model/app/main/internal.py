@@ -4,7 +4,7 @@
 from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError
 
-from .. import refresh_rule_based_model
+from .. import refresh_rule_based_model, reload_config
 from ..database_sqlalchemy import db
 from ..prometheus_metrics import metrics
 from . import main
@@ -46,7 +46,7 @@ def refresh_rules_endpoint():
     Refresh rules from database
     Must be authenticated
     """
-    len_rules = refresh_rule_based_model(current_app)
+    len_rules = refresh_rule_based_model(current_app, force=True)
     if len_rules > 0:
 
         message = f"Successfully refreshed {len_rules} urgency rules"
@@ -55,3 +55,21 @@ def refresh_rules_endpoint():
         message = f"Successfully refreshed but could not find urgency rules " f"in DB"
 
     return message, 200
+
+
+@main.route("/internal/reload-config", methods=["GET"])
+@metrics.do_not_track()
+@auth.login_required
+def reload_config_endpoint():
+    """
+    Reload config files modified since they were last loaded, in every
+    worker. Reloading parameters.yml also rebuilds the text preprocessor.
+    Must be authenticated
+    """
+    reloaded = reload_config(current_app)
+    if len(reloaded) > 0:
+        message = f"Reloaded {', '.join(reloaded)}"
+    else:
+        message = "No config files changed"
+
+    return message, 200
@@ -65,6 +65,27 @@ response_dict = {
 
 response_check_fields = api.model("InboundCheckResponseModel", response_dict)
 
+inbound_check_batch_fields = api.model(
+    "InboundCheckBatchRequest",
+    {
+        "messages": fields.List(
+            fields.Nested(inbound_check_fields),
+            description="Messages to check, each as for /inbound/check",
+            required=True,
+        ),
+    },
+)
+
+response_check_batch_fields = api.model(
+    "InboundCheckBatchResponseModel",
+    {
+        "results": fields.List(
+            fields.Nested(response_check_fields),
+            description="One result per message, in the same order",
+        ),
+    },
+)
+
 inbound_feedback_fields = api.model(
     "InboundFeedbackRequest",
     {
@@ -81,3 +102,35 @@ inbound_feedback_fields = api.model(
         "feedback": fields.String(required=True, example="feedback test string"),
     },
 )
+
+inbound_feedback_batch_fields = api.model(
+    "InboundFeedbackBatchRequest",
+    {
+        "feedback": fields.List(
+            fields.Nested(inbound_feedback_fields),
+            description="Feedback to append, each as for /inbound/feedback",
+            required=True,
+        ),
+    },
+)
+
+feedback_result_fields = api.model(
+    "InboundFeedbackResult",
+    {
+        "status": fields.Integer(
+            description="HTTP status /inbound/feedback would have returned",
+            example=200,
+        ),
+        "message": fields.String(example="Success"),
+    },
+)
+
+response_feedback_batch_fields = api.model(
+    "InboundFeedbackBatchResponseModel",
+    {
+        "results": fields.List(
+            fields.Nested(feedback_result_fields),
+            description="One result per feedback item, in the same order",
+        ),
+    },
+)
@@ -2,18 +2,35 @@
 # MODEL TOOLS ENDPOINTS
 """
 import os
+import random
+from datetime import datetime, timezone
 from functools import wraps
 
 from faqt import KeywordRule
-from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
 from flask import abort, current_app, request
 
+from ..inbound_tokens import iter_tokenized_inbounds
 from ..prometheus_metrics import metrics
-from ..src.utils import load_parameters
+from ..src.rule_evaluation import RuleEvaluator
+from ..src.utils import get_parameters
 from . import main
 from .auth import auth
 
 
+def parse_utc(value):
+    """
+    Parse an ISO 8601 datetime into a naive UTC datetime, as stored in the
+    DB. Datetimes with an offset (or a "Z" suffix) are converted to UTC, and
+    those without are taken to be in UTC already.
+    """
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 def active_only_non_prod(func):
     """
     Decorator ensures route is only active in a non-prod environment
@@ -66,28 +83,15 @@ def check_new_rules():
     raw_text = incoming["queries_to_check"]
     preprocessed_text = [current_app.preprocess_text(x) for x in raw_text]
 
-    # Preprocess keywords -- we take the last element because this is the
-    # longest ngram keyword.
-    include_preprocessed = [
-        current_app.preprocess_text(x)[-1] for x in incoming["include_keywords"]
-    ]
-    exclude_preprocessed = [
-        current_app.preprocess_text(x)[-1] for x in incoming["exclude_keywords"]
-    ]
-
-    rule_to_check = [
-        KeywordRule(include=include_preprocessed, exclude=exclude_preprocessed)
-    ]
-    evaluator = RuleBasedUD(
-        model=rule_to_check, preprocessor=current_app.preprocess_text
+    rule_to_check = preprocess_rule(
+        incoming["include_keywords"], incoming["exclude_keywords"]
     )
-    urgency_values = [evaluator.predict_scores(x) for x in raw_text]
-
-    urgency_values = [x for sublist in urgency_values for x in sublist]
+    evaluator = get_token_evaluator([rule_to_check])
+    urgency_values = [evaluator.predict(tokens) for tokens in preprocessed_text]
 
     json_return = dict()
-    json_return["preprocessed_include_kws"] = include_preprocessed
-    json_return["preprocessed_exclude_kws"] = exclude_preprocessed
+    json_return["preprocessed_include_kws"] = rule_to_check.include
+    json_return["preprocessed_exclude_kws"] = rule_to_check.exclude
     json_return["preprocessed_queries"] = preprocessed_text
     json_return["urgency_scores"] = urgency_values
 
@@ -95,6 +99,221 @@ def check_new_rules():
     return json_return
 
 
+@main.route("/tools/check-new-rules-batch", methods=["POST"])
+@metrics.do_not_track()
+@auth.login_required
+@active_only_non_prod
+def check_new_rules_batch():
+    """
+    Checks several candidate rules against many queries at once.
+
+    Each query is preprocessed once, and all candidate rules are evaluated
+    against it together.
+
+    Parameters
+    ----------
+    request (request proxy; see https://flask.palletsprojects.com/en/1.1.x/reqcontext/)
+    The request should be sent as JSON with the following structure:
+
+        request = {
+            "rules": List[Dict] with "include_keywords" (List[str], minimum 1)
+                and "exclude_keywords" (List[str]) for each candidate rule
+            "queries_to_check": List[str] of length up to
+                `CHECK_RULES_MAX_QUERIES`
+            "return_preprocessed_queries": optional bool, default False
+        }
+
+    Returns
+    -------
+    JSON
+
+        response = {
+            "preprocessed_rules": List[Dict] with the preprocessed
+                "include_keywords" and "exclude_keywords" of each rule,
+            "matched_rule_indices": List[List[int]], the indices of the rules
+                matched by each query, in the order of "queries_to_check",
+            "rule_match_counts": List[int], the number of queries matched by
+                each rule,
+            "preprocessed_queries": List[List[str]], only if requested,
+        }
+
+    str, HTTP status
+        Missing or empty `rules` or `queries_to_check`: "No rules or queries", 400
+        More than `CHECK_RULES_MAX_QUERIES` queries: "Too many queries", 413
+    """
+    incoming = request.json
+
+    raw_rules = incoming.get("rules")
+    raw_text = incoming.get("queries_to_check")
+    if not raw_rules or not raw_text:
+        return "No rules or queries", 400
+    elif len(raw_text) > current_app.config["CHECK_RULES_MAX_QUERIES"]:
+        return "Too many queries", 413
+
+    rules_to_check = [
+        preprocess_rule(rule["include_keywords"], rule["exclude_keywords"])
+        for rule in raw_rules
+    ]
+    evaluator = get_token_evaluator(rules_to_check)
+
+    rule_match_counts = [0] * len(rules_to_check)
+    matched_rule_indices = []
+    preprocessed_text = []
+    for query in raw_text:
+        tokens = current_app.preprocess_text(query)
+        matched = evaluator.match(set(tokens))
+        for i in matched:
+            rule_match_counts[i] += 1
+        matched_rule_indices.append(matched)
+        preprocessed_text.append(tokens)
+
+    json_return = dict()
+    json_return["preprocessed_rules"] = [
+        {"include_keywords": rule.include, "exclude_keywords": rule.exclude}
+        for rule in rules_to_check
+    ]
+    json_return["matched_rule_indices"] = matched_rule_indices
+    json_return["rule_match_counts"] = rule_match_counts
+    if incoming.get("return_preprocessed_queries", False):
+        json_return["preprocessed_queries"] = preprocessed_text
+
+    return json_return
+
+
+@main.route("/tools/check-rules-history", methods=["POST"])
+@metrics.do_not_track()
+@auth.login_required
+@active_only_non_prod
+def check_rules_history():
+    """
+    Checks a candidate rule against the messages received in a date range.
+
+    Messages are streamed from the database in chunks of
+    `CHECK_RULES_HISTORY_CHUNK_SIZE`. Their preprocessed tokens are saved, so
+    that later checks over the same messages skip preprocessing.
+
+    Parameters
+    ----------
+    request (request proxy; see https://flask.palletsprojects.com/en/1.1.x/reqcontext/)
+    The request should be sent as JSON with the following structure:
+
+        request = {
+            "include_keywords": List[str], minimum 1
+            "exclude_keywords": List[str]
+            "start_utc": str, ISO 8601 datetime, inclusive. UTC unless it
+                has an offset.
+            "end_utc": optional str, ISO 8601 datetime, exclusive. UTC
+                unless it has an offset. Defaults to now.
+            "sample_size": optional int, default 10
+        }
+
+    Returns
+    -------
+    JSON
+
+        response = {
+            "preprocessed_include_kws": List[str],
+            "preprocessed_exclude_kws": List[str],
+            "n_checked": int, the number of messages in the date range,
+            "n_matched": int, the number of those matched by the rule,
+            "n_preprocessed": int, the number of messages that had no saved
+                tokens and were preprocessed,
+            "matched_sample": List[Dict] with the "inbound_id", "inbound_utc"
+                and "inbound_text" of up to "sample_size" random matched
+                messages,
+        }
+
+    str, HTTP status
+        Missing or invalid dates or sample size: "Invalid date range or sample size", 400
+    """
+    incoming = request.json
+
+    try:
+        start_utc = parse_utc(incoming["start_utc"])
+        end_utc = incoming.get("end_utc")
+        end_utc = datetime.utcnow() if end_utc is None else parse_utc(end_utc)
+        sample_size = int(incoming.get("sample_size", 10))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return "Invalid date range or sample size", 400
+    if start_utc >= end_utc or sample_size < 0:
+        return "Invalid date range or sample size", 400
+
+    rule_to_check = preprocess_rule(
+        incoming["include_keywords"], incoming["exclude_keywords"]
+    )
+    evaluator = get_token_evaluator([rule_to_check])
+
+    n_checked, n_matched, n_preprocessed = 0, 0, 0
+    matched_sample = []
+    for chunk in iter_tokenized_inbounds(
+        current_app.preprocess_text,
+        current_app.preprocessor_version,
+        start_utc,
+        end_utc,
+        current_app.config["CHECK_RULES_HISTORY_CHUNK_SIZE"],
+    ):
+        for inbound in chunk:
+            n_checked += 1
+            n_preprocessed += inbound.preprocessed
+            if not evaluator.match(set(inbound.tokens)):
+                continue
+
+            # Reservoir sampling, to keep a uniform sample of matches
+            n_matched += 1
+            if len(matched_sample) < sample_size:
+                matched_sample.append(inbound)
+            else:
+                i = random.randrange(n_matched)
+                if i < sample_size:
+                    matched_sample[i] = inbound
+
+    json_return = dict()
+    json_return["preprocessed_include_kws"] = rule_to_check.include
+    json_return["preprocessed_exclude_kws"] = rule_to_check.exclude
+    json_return["n_checked"] = n_checked
+    json_return["n_matched"] = n_matched
+    json_return["n_preprocessed"] = n_preprocessed
+    json_return["matched_sample"] = [
+        {
+            "inbound_id": inbound.inbound_id,
+            "inbound_utc": inbound.inbound_utc.isoformat(),
+            "inbound_text": inbound.inbound_text,
+        }
+        for inbound in sorted(matched_sample, key=lambda inbound: inbound.inbound_utc)
+    ]
+
+    return json_return
+
+
+def preprocess_rule(include_keywords, exclude_keywords):
+    """
+    Build a `KeywordRule` from raw keywords
+
+    Keywords are preprocessed like messages, taking the last token, which is
+    the longest n-gram of the keyword.
+
+    Parameters
+    ----------
+    include_keywords : List[str]
+    exclude_keywords : List[str]
+
+    Returns
+    -------
+    KeywordRule
+    """
+    return KeywordRule(
+        include=[current_app.preprocess_text(x)[-1] for x in include_keywords],
+        exclude=[current_app.preprocess_text(x)[-1] for x in exclude_keywords],
+    )
+
+
+def get_token_evaluator(rules):
+    """
+    Return a `RuleEvaluator` for already preprocessed queries
+    """
+    return RuleEvaluator(model=rules, preprocessor=lambda tokens: tokens)
+
+
 @main.route("/tools/validate-rule", methods=["POST"])
 @metrics.do_not_track()
 @auth.login_required
@@ -124,9 +343,8 @@ def validate_rules():
 
     req_json = request.json
 
-    ngram_specs = load_parameters("preprocessing")
-    ngram_min = ngram_specs["ngram_min"]
-    ngram_max = ngram_specs["ngram_max"]
+    ngram_min = get_parameters().get_int("preprocessing", "ngram_min")
+    ngram_max = get_parameters().get_int("preprocessing", "ngram_max")
 
     include_kw = req_json["include_keywords"]
     exclude_kw = req_json["exclude_keywords"]
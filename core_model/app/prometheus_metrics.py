@@ -1,3 +1,38 @@
+from prometheus_client import Counter, Gauge, Histogram
 from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
 
 metrics = GunicornInternalPrometheusMetrics.for_app_factory()
+
+spell_check_cache_events = Counter(
+    "ud_spell_check_cache_events",
+    "Spell-check cache hits, misses and evictions",
+    labelnames=["event"],
+    registry=metrics.registry,
+)
+
+message_cache_events = Counter(
+    "ud_message_cache_events",
+    "Inbound message result cache hits, misses and evictions",
+    labelnames=["event"],
+    registry=metrics.registry,
+)
+
+inbound_write_queue_depth = Gauge(
+    "ud_inbound_write_queue_depth",
+    "Inbound records queued for write-behind persistence",
+    multiprocess_mode="livesum",
+    registry=metrics.registry,
+)
+
+inbound_write_flush_seconds = Histogram(
+    "ud_inbound_write_flush_seconds",
+    "Latency of write-behind inbound batch inserts",
+    registry=metrics.registry,
+)
+
+inbound_write_records = Counter(
+    "ud_inbound_write_records",
+    "Write-behind inbound records by outcome",
+    labelnames=["outcome"],
+    registry=metrics.registry,
+)
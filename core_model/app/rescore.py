@@ -0,0 +1,374 @@
+"""
+Re-scoring of past inbound messages after the rules change
+"""
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from . import get_rules_db_version, get_text_preprocessor, refresh_rules
+from .data_models import Inbound, RescoreRuleDiffModel, RescoreRunModel
+from .inbound_tokens import save_inbound_tokens, tokenized_inbounds_query
+from .src.rule_evaluation import RuleEvaluator
+
+logger = logging.getLogger(__name__)
+
+# Preprocessor of each pool process, built once by `_init_preprocessor`
+_preprocessor = None
+
+
+def _init_preprocessor():
+    """
+    Build the preprocessor once per pool process
+    """
+    global _preprocessor
+    _preprocessor = get_text_preprocessor()
+
+
+def _preprocess(message):
+    """
+    Preprocess a message with the pool process's preprocessor
+    """
+    return _preprocessor(message)
+
+
+def stored_rule_ids(urgency_score):
+    """
+    Return the IDs of the rules an inbound message matched when it was
+    checked, from its stored `urgency_score` (the list of matched rules, or
+    of their IDs in the compact storage format)
+    """
+    if not isinstance(urgency_score, list):
+        return set()
+    return {
+        rule["rule_id"] if isinstance(rule, dict) else rule for rule in urgency_score
+    }
+
+
+class InboundRescorer:
+    """
+    Re-scores past inbound messages with the current rules, and records how
+    their results changed in `inbound_rescore_runs` and
+    `inbound_rescore_rule_diffs` (see scripts/inbound_rescore.sql).
+
+    Messages are re-scored in chunks, in order of `inbound_id`. Progress is
+    saved with each chunk, so a run that is interrupted resumes where it
+    stopped. A run covers the messages received before it started, and is
+    identified by the rule version and preprocessor version it scores with:
+    once finished, it is not repeated until the rules change.
+
+    Inbound ids are reserved in blocks by each worker, and in write-behind
+    mode messages are saved up to a flush interval after they are received,
+    so ids are not saved in order. A new run therefore waits `save_delay`
+    seconds for the messages received before it started to be saved before
+    reading the highest inbound id to re-score up to.
+
+    To leave database capacity for the live service, the rescorer uses a
+    single connection of its own, and after each chunk pauses so that it
+    spends at most `max_db_share` of its time in the database. Messages
+    without saved tokens are preprocessed across `n_processes` processes,
+    and their tokens saved.
+    """
+
+    def __init__(
+        self, app, chunk_size=1000, n_processes=1, max_db_share=0.25, save_delay=None
+    ):
+        """
+        Parameters
+        ----------
+        app : Flask app
+        chunk_size : int
+            Number of messages to re-score per database round trip
+        n_processes : int
+            Number of processes to preprocess messages with
+        max_db_share : float
+            Maximum share of time, between 0 and 1, spent in the database
+        save_delay : float, optional
+            Seconds to wait at the start of a new run for messages received
+            before it to be saved. Defaults to `INBOUND_WRITE_FLUSH_INTERVAL`.
+        """
+        if not 0 < max_db_share <= 1:
+            raise ValueError("max_db_share must be between 0 and 1")
+
+        self.app = app
+        self.chunk_size = chunk_size
+        self.n_processes = n_processes
+        self.max_db_share = max_db_share
+        if save_delay is None:
+            save_delay = app.config["INBOUND_WRITE_FLUSH_INTERVAL"]
+        self.save_delay = save_delay
+        self.engine = create_engine(
+            app.config["SQLALCHEMY_DATABASE_URI"], pool_size=1, max_overflow=0
+        )
+
+    def run(self):
+        """
+        Re-score all messages received before the run started, resuming an
+        unfinished run for the current rules if there is one
+
+        Returns
+        -------
+        int or None
+            ID of the run, or None if the messages were already re-scored
+            with the current rules
+        """
+        rule_version = get_rules_db_version(self.app)
+        if rule_version is None:
+            raise RuntimeError(
+                "Re-scoring needs rule versions, see "
+                "scripts/urgency_rules_versioning.sql"
+            )
+
+        rules = refresh_rules(self.app)
+        evaluator = RuleEvaluator(
+            model=[rule["rule"] for rule in rules],
+            preprocessor=lambda tokens: tokens,
+        )
+        run = self._get_or_start_run(rule_version)
+        if run["finished_utc"] is not None:
+            logger.info(
+                "Inbounds already re-scored with rule version %d in run %d",
+                rule_version,
+                run["rescore_run_id"],
+            )
+            return None
+
+        logger.info(
+            "Re-scoring inbounds %d to %d with rule version %d in run %d",
+            run["last_inbound_id"] + 1,
+            run["max_inbound_id"],
+            rule_version,
+            run["rescore_run_id"],
+        )
+
+        pool = None
+        if self.n_processes > 1:
+            pool = Pool(self.n_processes, initializer=_init_preprocessor)
+        try:
+            last_inbound_id = run["last_inbound_id"]
+            while last_inbound_id < run["max_inbound_id"]:
+                last_inbound_id = self._rescore_chunk(
+                    run, last_inbound_id, rules, evaluator, pool
+                )
+            self._finish_run(run["rescore_run_id"])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self.engine.dispose()
+
+        return run["rescore_run_id"]
+
+    def _get_or_start_run(self, rule_version):
+        """
+        Return the latest run for `rule_version` and the current
+        preprocessor as a dict of column values, or start a new one
+        """
+        runs = RescoreRunModel.__table__
+        with self.engine.begin() as connection:
+            run = (
+                connection.execute(
+                    select(runs)
+                    .where(
+                        runs.c.urgency_rule_version == rule_version,
+                        runs.c.preprocessor_version == self.app.preprocessor_version,
+                    )
+                    .order_by(runs.c.rescore_run_id.desc())
+                    .limit(1)
+                )
+                .mappings()
+                .first()
+            )
+            if run is not None:
+                return dict(run)
+
+        now = datetime.utcnow()
+        time.sleep(self.save_delay)
+        with self.engine.begin() as connection:
+            max_inbound_id = connection.execute(
+                select(func.coalesce(func.max(Inbound.__table__.c.inbound_id), 0))
+            ).scalar()
+            return dict(
+                connection.execute(
+                    runs.insert()
+                    .values(
+                        urgency_rule_version=rule_version,
+                        preprocessor_version=self.app.preprocessor_version,
+                        max_inbound_id=max_inbound_id,
+                        started_utc=now,
+                        updated_utc=now,
+                    )
+                    .returning(runs)
+                )
+                .mappings()
+                .one()
+            )
+
+    def _rescore_chunk(self, run, last_inbound_id, rules, evaluator, pool):
+        """
+        Re-score the next chunk of messages after `last_inbound_id`, save the
+        results and pause. Returns the last inbound id re-scored.
+        """
+        inbounds = Inbound.__table__
+        query = (
+            tokenized_inbounds_query(self.app.preprocessor_version)
+            .add_columns(inbounds.c.urgency_score)
+            .where(
+                inbounds.c.inbound_id > last_inbound_id,
+                inbounds.c.inbound_id <= run["max_inbound_id"],
+                inbounds.c.inbound_utc < run["started_utc"],
+            )
+            .order_by(inbounds.c.inbound_id)
+            .limit(self.chunk_size)
+        )
+
+        start = time.perf_counter()
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        db_seconds = time.perf_counter() - start
+
+        if len(rows) == 0:
+            # Messages after `last_inbound_id` were deleted
+            return run["max_inbound_id"]
+
+        unscored = [row for row in rows if row.inbound_tokens is None]
+        texts = [row.inbound_text for row in unscored]
+        if pool is None:
+            new_tokens = [self.app.preprocess_text(text) for text in texts]
+        else:
+            new_tokens = pool.map(_preprocess, texts)
+        tokens_by_id = {
+            row.inbound_id: tokens for row, tokens in zip(unscored, new_tokens)
+        }
+
+        n_newly_urgent, n_no_longer_urgent = 0, 0
+        newly_matched, no_longer_matched = Counter(), Counter()
+        for row in rows:
+            tokens = tokens_by_id.get(row.inbound_id, row.inbound_tokens)
+            new_rule_ids = {rules[i]["rule_id"] for i in evaluator.match(set(tokens))}
+            old_rule_ids = stored_rule_ids(row.urgency_score)
+
+            newly_matched.update(new_rule_ids - old_rule_ids)
+            no_longer_matched.update(old_rule_ids - new_rule_ids)
+            if new_rule_ids and not old_rule_ids:
+                n_newly_urgent += 1
+            elif old_rule_ids and not new_rule_ids:
+                n_no_longer_urgent += 1
+
+        last_inbound_id = rows[-1].inbound_id
+        start = time.perf_counter()
+        with self.engine.begin() as connection:
+            save_inbound_tokens(connection, self.app.preprocessor_version, tokens_by_id)
+            self._save_progress(
+                connection,
+                run["rescore_run_id"],
+                last_inbound_id,
+                len(rows),
+                n_newly_urgent,
+                n_no_longer_urgent,
+                newly_matched,
+                no_longer_matched,
+            )
+        db_seconds += time.perf_counter() - start
+
+        # Pause so that at most `max_db_share` of the time is spent in the DB
+        time.sleep(db_seconds * (1 - self.max_db_share) / self.max_db_share)
+        return last_inbound_id
+
+    def _save_progress(
+        self,
+        connection,
+        rescore_run_id,
+        last_inbound_id,
+        n_inbounds,
+        n_newly_urgent,
+        n_no_longer_urgent,
+        newly_matched,
+        no_longer_matched,
+    ):
+        """
+        Add the results of a chunk to the run's totals and per-rule diffs
+        """
+        runs = RescoreRunModel.__table__
+        connection.execute(
+            runs.update()
+            .where(runs.c.rescore_run_id == rescore_run_id)
+            .values(
+                last_inbound_id=last_inbound_id,
+                n_inbounds=runs.c.n_inbounds + n_inbounds,
+                n_newly_urgent=runs.c.n_newly_urgent + n_newly_urgent,
+                n_no_longer_urgent=runs.c.n_no_longer_urgent + n_no_longer_urgent,
+                updated_utc=datetime.utcnow(),
+            )
+        )
+
+        rule_ids = newly_matched.keys() | no_longer_matched.keys()
+        if len(rule_ids) == 0:
+            return
+
+        diffs = RescoreRuleDiffModel.__table__
+        statement = insert(diffs)
+        statement = statement.on_conflict_do_update(
+            index_elements=[diffs.c.rescore_run_id, diffs.c.urgency_rule_id],
+            set_={
+                "n_newly_matched": diffs.c.n_newly_matched
+                + statement.excluded.n_newly_matched,
+                "n_no_longer_matched": diffs.c.n_no_longer_matched
+                + statement.excluded.n_no_longer_matched,
+            },
+        )
+        connection.execute(
+            statement,
+            [
+                {
+                    "rescore_run_id": rescore_run_id,
+                    "urgency_rule_id": rule_id,
+                    "n_newly_matched": newly_matched[rule_id],
+                    "n_no_longer_matched": no_longer_matched[rule_id],
+                }
+                for rule_id in sorted(rule_ids)
+            ],
+        )
+
+    def _finish_run(self, rescore_run_id):
+        """
+        Mark a run as finished
+        """
+        runs = RescoreRunModel.__table__
+        now = datetime.utcnow()
+        with self.engine.begin() as connection:
+            connection.execute(
+                runs.update()
+                .where(runs.c.rescore_run_id == rescore_run_id)
+                .values(updated_utc=now, finished_utc=now)
+            )
+
+
+@click.command("rescore-inbounds")
+@click.option("--chunk-size", default=1000, show_default=True)
+@click.option("--processes", "n_processes", default=1, show_default=True)
+@click.option(
+    "--max-db-share",
+    default=0.25,
+    show_default=True,
+    help="Maximum share of time spent in the database",
+)
+@with_appcontext
+def rescore_inbounds_command(chunk_size, n_processes, max_db_share):
+    """
+    Re-score past inbound messages with the current rules, and save how
+    their results changed.
+    """
+    rescorer = InboundRescorer(current_app, chunk_size, n_processes, max_db_share)
+    rescore_run_id = rescorer.run()
+    if rescore_run_id is None:
+        click.echo("Inbounds already re-scored with the current rules")
+    else:
+        click.echo(f"Finished re-scoring run {rescore_run_id}")
@@ -0,0 +1,125 @@
+"""
+Push-based refresh of urgency rules using Postgres LISTEN/NOTIFY
+"""
+import logging
+import os
+import select
+import time
+from threading import Lock, Thread
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+RULES_CHANGED_CHANNEL = "urgency_rules_changed"
+
+
+class RuleChangeListener:
+    """
+    Refreshes urgency rules in a background thread whenever the
+    `urgency_rules` table changes.
+
+    A trigger on `urgency_rules` (see `scripts/urgency_rules_notify.sql`)
+    sends a NOTIFY on `RULES_CHANGED_CHANNEL` after every change. Each
+    gunicorn worker runs its own listener, which rebuilds the rule set off
+    the request path and swaps it in atomically. Rules are also refreshed
+    whenever the listener (re)connects, since notifications sent while it
+    was disconnected are lost.
+    """
+
+    def __init__(self, app, refresh_func, poll_interval=1.0, retry_interval=5.0):
+        """
+        Parameters
+        ----------
+        app : Flask app
+        refresh_func : Callable[[Flask], int]
+            Rebuilds the app's rule set, e.g. `refresh_rule_based_model`
+        poll_interval : float
+            Maximum seconds between checks for stop requests
+        retry_interval : float
+            Seconds to wait before reconnecting after a database error
+        """
+        self.app = app
+        self.refresh_func = refresh_func
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+        self._start_lock = Lock()
+
+    def start(self):
+        """
+        Start the listener thread if it is not running in this process
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = Thread(target=self._run, name="rule-listener", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the listener thread
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+
+        self._stopping = True
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        """
+        Listener thread loop: (re)connect, then refresh on each notification
+        """
+        while not self._stopping:
+            connection = None
+            try:
+                connection = self._connect()
+                self._refresh()
+                self._listen(connection)
+            except Exception:
+                logger.exception("Urgency rule listener failed, reconnecting")
+                time.sleep(self.retry_interval)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _connect(self):
+        """
+        Open a dedicated connection listening on `RULES_CHANGED_CHANNEL`
+        """
+        connection = psycopg2.connect(self.app.config["SQLALCHEMY_DATABASE_URI"])
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {RULES_CHANGED_CHANNEL};")
+        return connection
+
+    def _listen(self, connection):
+        """
+        Wait for notifications and refresh rules once per burst of them
+        """
+        while not self._stopping:
+            readable, _, _ = select.select([connection], [], [], self.poll_interval)
+            if not readable:
+                continue
+
+            connection.poll()
+            if connection.notifies:
+                connection.notifies.clear()
+                self._refresh()
+
+    def _refresh(self):
+        """
+        Rebuild the rule set
+        """
+        n_rules = self.refresh_func(self.app)
+        logger.info("Refreshed %d urgency rules after database change", n_rules)
@@ -0,0 +1,119 @@
+"""
+Sharing of urgency rules between gunicorn workers through memory-mapped files
+"""
+import fcntl
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+from .src.shared_rules import SharedRules, serialize_rules
+
+# Generation of the latest rules, and the time they were published
+STATE = struct.Struct("Qd")
+
+
+class SharedRuleStore:
+    """
+    Publishes serialized rules to a file that every worker maps read-only.
+
+    The directory should be on a memory-backed filesystem such as `/dev/shm`,
+    so that all workers share one copy of the rules in RAM. It holds:
+
+    - `rules.bin`: the latest rules, in the format of `serialize_rules`.
+      Replaced atomically on publish, so workers still using the previous
+      rules keep a valid mapping of the old file.
+    - `generation`: an 8-byte counter, mapped by every worker and incremented
+      after each publish, followed by the time of the publish. Workers
+      compare the counter with the generation they have attached to, which
+      costs no system call.
+    - `rules.lock`: serializes publishing across workers, so that only one
+      worker queries the database per refresh.
+    """
+
+    def __init__(self, directory):
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory shared by all workers. Created if it does not exist.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.rules_path = os.path.join(directory, "rules.bin")
+        self.lock_path = os.path.join(directory, "rules.lock")
+
+        fd = os.open(os.path.join(directory, "generation"), os.O_RDWR | os.O_CREAT)
+        try:
+            if os.fstat(fd).st_size < STATE.size:
+                os.ftruncate(fd, STATE.size)
+            self._state = mmap.mmap(fd, STATE.size)
+        finally:
+            os.close(fd)
+
+    @property
+    def generation(self):
+        """
+        Number of times rules have been published, 0 if never
+        """
+        return STATE.unpack_from(self._state)[0]
+
+    @property
+    def published_utc(self):
+        """
+        Unix time at which rules were last published, 0 if never
+        """
+        return STATE.unpack_from(self._state)[1]
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold an exclusive lock on publishing, across processes and threads
+        """
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def publish(self, rules):
+        """
+        Serialize and publish rules. Must be called while holding `lock`.
+
+        Parameters
+        ----------
+        rules : List[Dict]
+            Rules with `rule_id`, `title` and `rule`, as returned by
+            `refresh_rules`
+
+        Returns
+        -------
+        int
+            Generation of the published rules
+        """
+        temp_path = f"{self.rules_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(serialize_rules(rules))
+        os.replace(temp_path, self.rules_path)
+
+        generation = self.generation + 1
+        STATE.pack_into(self._state, 0, generation, time.time())
+        return generation
+
+    def load(self):
+        """
+        Map the latest published rules
+
+        Returns
+        -------
+        generation : int
+            Generation of the rules. May be lower than the real generation if
+            rules are published during the call, in which case the next
+            comparison with `generation` triggers another load.
+        rules : SharedRules
+        """
+        generation = self.generation
+        with open(self.rules_path, "rb") as rules_file:
+            buffer = mmap.mmap(rules_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return generation, SharedRules(buffer)
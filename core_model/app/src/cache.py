@@ -0,0 +1,161 @@
+"""
+In-memory caches used on the request path
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache, with optional
+    time-to-live for entries.
+
+    Hits, misses and evictions are counted on the instance and, if given,
+    on a Prometheus counter with an `event` label. Expired entries count as
+    misses.
+    """
+
+    def __init__(self, maxsize, ttl=None, events_counter=None):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of entries. The least recently used entry is
+            evicted when this is exceeded.
+        ttl : float, optional
+            Seconds after which an entry expires. Entries never expire if None.
+        events_counter : prometheus_client.Counter, optional
+            Counter with a single `event` label, incremented with
+            `event="hit"`, `"miss"` and `"eviction"`
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.events_counter = events_counter
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for `key`, or `default` if it is not cached
+        """
+        with self._lock:
+            value, expires_at = self._data.get(key, (_MISSING, None))
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                value = _MISSING
+
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+
+        if value is _MISSING:
+            self._record("miss")
+            return default
+        self._record("hit")
+        return value
+
+    def put(self, key, value):
+        """
+        Cache `value` under `key`, evicting the least recently used entry if
+        the cache is full
+        """
+        if self.ttl is None:
+            expires_at = None
+        else:
+            expires_at = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            evicted = len(self._data) > self.maxsize
+            if evicted:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+        if evicted:
+            self._record("eviction")
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        """Number of cached entries"""
+        return len(self._data)
+
+    def _record(self, event):
+        """
+        Increment the Prometheus counter for `event`, if there is one
+        """
+        if self.events_counter is not None:
+            self.events_counter.labels(event=event).inc()
+
+
+class CachedSpellChecker:
+    """
+    Memoizes the `spell` and `suggest` calls of a spell-checker.
+
+    Hunspell suggestions dominate preprocessing time, while the vocabulary of
+    inbound messages is very repetitive. Results are cached per raw token.
+    Custom spellings, corrections and priority words are applied by the
+    wrapped spell-checker before results are cached, so the cache must be
+    rebuilt together with the spell-checker whenever those change.
+    """
+
+    def __init__(self, spell_checker, cache):
+        """
+        Parameters
+        ----------
+        spell_checker : faqt.preprocessing.tokens.CustomHunspell
+        cache : LRUCache
+        """
+        self.spell_checker = spell_checker
+        self.cache = cache
+
+    def spell(self, word):
+        """
+        Return True if `word` is spelled correctly
+        """
+        return self._cached_call("spell", word)
+
+    def suggest(self, word):
+        """
+        Return spelling suggestions for `word`
+        """
+        return self._cached_call("suggest", word)
+
+    def _cached_call(self, method, word):
+        """
+        Return the result of `spell_checker.<method>(word)`, from the cache if
+        possible
+        """
+        key = (method, word)
+        result = self.cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = getattr(self.spell_checker, method)(word)
+            if method == "suggest":
+                # Store suggestions as a tuple so cached results are immutable
+                result = tuple(result)
+            self.cache.put(key, result)
+        return result
+
+    def __getattr__(self, name):
+        """
+        Delegate all other attributes to the wrapped spell-checker
+        """
+        return getattr(self.spell_checker, name)
@@ -0,0 +1,294 @@
+"""
+Single-pass evaluation of urgency rules
+"""
+from collections import defaultdict, namedtuple
+
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+
+RuleEvaluation = namedtuple(
+    "RuleEvaluation",
+    ["preprocessed_text", "matched_rule_indices", "urgency_scores", "urgency_score"],
+)
+
+# Snapshot of the current rules (as dicts with `rule_id`, `title` and `rule`),
+# the evaluator compiled from them, a version that increases on refresh, the
+# database rule version they were loaded at and the latest database version of
+# the rules themselves (None if unknown)
+RuleSet = namedtuple(
+    "RuleSet", ["rules", "evaluator", "version", "db_version", "rules_version"]
+)
+
+
+class KeywordRuleIndex:
+    """
+    Inverted index over a list of `KeywordRule`s.
+
+    Maps each include/exclude keyword to the keys of the rules that use it,
+    so that evaluating a message only touches rules sharing at least one
+    token with it (plus rules with no include keywords, which are candidates
+    for every message). Matching is identical to checking every rule in turn.
+
+    An index can be patched with added, changed or removed rules without
+    recompiling the rules that did not change.
+    """
+
+    def __init__(self, rules, keys=None):
+        """
+        Parameters
+        ----------
+        rules : List[KeywordRule]
+        keys : List[Hashable], optional
+            Unique key for each rule, e.g. the rule ID. Defaults to the
+            position of each rule in `rules`.
+        """
+        if keys is None:
+            keys = range(len(rules))
+
+        include_index = defaultdict(list)
+        exclude_index = defaultdict(list)
+        unconditional = set()
+        self.rule_keywords = {}
+        self.n_includes = {}
+
+        for key, rule in zip(keys, rules):
+            include, exclude = self._add_rule_keywords(key, rule)
+            for keyword in include:
+                include_index[keyword].append(key)
+            for keyword in exclude:
+                exclude_index[keyword].append(key)
+            if len(include) == 0:
+                unconditional.add(key)
+
+        self.include_index = {k: tuple(v) for k, v in include_index.items()}
+        self.exclude_index = {k: tuple(v) for k, v in exclude_index.items()}
+        self.unconditional = frozenset(unconditional)
+
+    def _add_rule_keywords(self, key, rule):
+        """
+        Record the keywords and include count of `rule` under `key`
+        """
+        include = frozenset(rule.include)
+        exclude = frozenset(rule.exclude)
+        self.rule_keywords[key] = (include, exclude)
+        self.n_includes[key] = len(include)
+        return include, exclude
+
+    def patched(self, removed_keys, added_rules):
+        """
+        Return a new index with rules removed, added or replaced.
+
+        Only the keyword entries of changed rules are rebuilt; this index is
+        not modified, so it can keep serving requests during the patch.
+
+        Parameters
+        ----------
+        removed_keys : Iterable[Hashable]
+            Keys of rules to remove
+        added_rules : Dict[Hashable, KeywordRule]
+            Rules to add, replacing any existing rule with the same key
+
+        Returns
+        -------
+        KeywordRuleIndex
+        """
+        index = KeywordRuleIndex([])
+        index.include_index = dict(self.include_index)
+        index.exclude_index = dict(self.exclude_index)
+        index.rule_keywords = dict(self.rule_keywords)
+        index.n_includes = dict(self.n_includes)
+        unconditional = set(self.unconditional)
+
+        stale_keys = set(removed_keys) | set(added_rules)
+        for key in stale_keys & set(self.rule_keywords):
+            include, exclude = index.rule_keywords.pop(key)
+            del index.n_includes[key]
+            unconditional.discard(key)
+            _remove_from_postings(index.include_index, include, key)
+            _remove_from_postings(index.exclude_index, exclude, key)
+
+        for key, rule in added_rules.items():
+            include, exclude = index._add_rule_keywords(key, rule)
+            _add_to_postings(index.include_index, include, key)
+            _add_to_postings(index.exclude_index, exclude, key)
+            if len(include) == 0:
+                unconditional.add(key)
+
+        index.unconditional = frozenset(unconditional)
+        return index
+
+    def match(self, tokens):
+        """
+        Return the keys of the rules matched by `tokens`.
+
+        Parameters
+        ----------
+        tokens : Set[str]
+            Preprocessed message tokens
+
+        Returns
+        -------
+        List[Hashable]
+        """
+        include_counts = defaultdict(int)
+        for token in tokens:
+            for key in self.include_index.get(token, ()):
+                include_counts[key] += 1
+
+        candidates = [
+            key
+            for key, count in include_counts.items()
+            if count == self.n_includes[key]
+        ]
+        candidates.extend(self.unconditional)
+        if len(candidates) == 0:
+            return []
+
+        excluded = set()
+        for token in tokens:
+            excluded.update(self.exclude_index.get(token, ()))
+
+        return [key for key in candidates if key not in excluded]
+
+
+def _remove_from_postings(postings, keywords, key):
+    """
+    Remove `key` from the posting list of each keyword, in place
+    """
+    for keyword in keywords:
+        remaining = tuple(k for k in postings[keyword] if k != key)
+        if len(remaining) > 0:
+            postings[keyword] = remaining
+        else:
+            del postings[keyword]
+
+
+def _add_to_postings(postings, keywords, key):
+    """
+    Add `key` to the posting list of each keyword, in place
+    """
+    for keyword in keywords:
+        postings[keyword] = postings.get(keyword, ()) + (key,)
+
+
+class RuleEvaluator(RuleBasedUD):
+    """
+    `RuleBasedUD` that preprocesses each message only once.
+
+    `RuleBasedUD.predict_scores` and `RuleBasedUD.predict` each run the full
+    preprocessing pipeline, so calling both for the same message doubles the
+    cost of spell-checking and stemming. `evaluate` returns the preprocessed
+    tokens, the per-rule scores and the aggregate urgency score together.
+
+    Rules are compiled into a `KeywordRuleIndex` when the evaluator is built,
+    so the cost of a message scales with the rules sharing its tokens rather
+    than with the total number of rules.
+    """
+
+    def __init__(self, model, preprocessor, keys=None, index=None):
+        """
+        Parameters
+        ----------
+        model : List[KeywordRule]
+            Rules to evaluate, in the order the scores are returned
+        preprocessor : Callable[[str], List[str]]
+            Function that converts a raw message into a list of tokens
+        keys : List[Hashable], optional
+            Unique, sortable key for each rule, e.g. the rule ID. Needed to
+            patch the evaluator. Defaults to the position of each rule.
+        index : KeywordRuleIndex, optional
+            Index already compiled from `model` and `keys`
+        """
+        super(RuleEvaluator, self).__init__(model=model, preprocessor=preprocessor)
+        self.rules = list(model)
+        self.preprocessor = preprocessor
+
+        if keys is None:
+            keys = range(len(self.rules))
+        self.keys = list(keys)
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+
+        if index is None:
+            index = KeywordRuleIndex(self.rules, self.keys)
+        self.index = index
+
+    def patched(self, removed_keys, added_rules):
+        """
+        Return a new evaluator with rules removed, added or replaced, keeping
+        rules ordered by key and reusing the compiled index of unchanged rules.
+
+        Parameters
+        ----------
+        removed_keys : Iterable[Hashable]
+            Keys of rules to remove
+        added_rules : Dict[Hashable, KeywordRule]
+            Rules to add, replacing any existing rule with the same key
+
+        Returns
+        -------
+        RuleEvaluator
+        """
+        rules_by_key = dict(zip(self.keys, self.rules))
+        for key in removed_keys:
+            rules_by_key.pop(key, None)
+        rules_by_key.update(added_rules)
+        keys = sorted(rules_by_key)
+
+        return RuleEvaluator(
+            model=[rules_by_key[key] for key in keys],
+            preprocessor=self.preprocessor,
+            keys=keys,
+            index=self.index.patched(removed_keys, added_rules),
+        )
+
+    def evaluate(self, message):
+        """
+        Preprocess `message` and evaluate every rule against it.
+
+        Returns
+        -------
+        RuleEvaluation
+            preprocessed_text : List[str]
+                Tokens produced by the preprocessor
+            matched_rule_indices : List[int]
+                Positions of the matched rules, in ascending order
+            urgency_scores : List[float]
+                1.0 for each rule that matched, 0.0 otherwise
+            urgency_score : float or None
+                Maximum of `urgency_scores`, or None if there are no rules
+        """
+        preprocessed_text = self.preprocessor(message)
+        matched_rule_indices = self.match(set(preprocessed_text))
+
+        urgency_scores = [0.0] * len(self.rules)
+        for position in matched_rule_indices:
+            urgency_scores[position] = 1.0
+
+        if len(self.rules) == 0:
+            urgency_score = None
+        elif len(matched_rule_indices) > 0:
+            urgency_score = 1.0
+        else:
+            urgency_score = 0.0
+
+        return RuleEvaluation(
+            preprocessed_text, matched_rule_indices, urgency_scores, urgency_score
+        )
+
+    def match(self, tokens):
+        """
+        Return the positions of the rules matched by `tokens`, in ascending
+        order
+        """
+        return sorted(self.positions[key] for key in self.index.match(tokens))
+
+    def predict_scores(self, message):
+        """
+        Return the per-rule scores for a raw message
+        """
+        return self.evaluate(message).urgency_scores
+
+    def predict(self, message):
+        """
+        Return the aggregate urgency score for a raw message
+        """
+        return self.evaluate(message).urgency_score
@@ -0,0 +1,254 @@
+"""
+Compact, read-only serialization of urgency rules that can be evaluated
+directly from a memory-mapped buffer
+"""
+import json
+import struct
+from array import array
+from collections import defaultdict
+from collections.abc import Sequence
+
+from faqt import KeywordRule
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+
+from .rule_evaluation import RuleEvaluator
+
+MAGIC = b"UDRS"
+FORMAT_VERSION = 1
+
+# Sections of the serialized rule set, in the order they are stored, with
+# their array typecodes. Offset arrays have one more entry than the items
+# they index, so item i spans offsets[i]:offsets[i + 1].
+SECTIONS = [
+    ("rule_ids", "q"),
+    ("n_includes", "I"),
+    ("unconditional", "I"),
+    ("keyword_offsets", "I"),
+    ("keywords", "B"),
+    ("include_offsets", "I"),
+    ("include_positions", "I"),
+    ("exclude_offsets", "I"),
+    ("exclude_positions", "I"),
+    ("rule_data_offsets", "I"),
+    ("rule_data", "B"),
+]
+
+HEADER = struct.Struct("<4sII" + "QQ" * len(SECTIONS))
+
+
+def serialize_rules(rules):
+    """
+    Serialize rules into the format read by `SharedRules`
+
+    Parameters
+    ----------
+    rules : List[Dict]
+        Rules with `rule_id`, `title` and `rule` (a `KeywordRule`), in the
+        order they are evaluated
+
+    Returns
+    -------
+    bytes
+    """
+    include_postings = defaultdict(list)
+    exclude_postings = defaultdict(list)
+    sections = {name: array(typecode) for name, typecode in SECTIONS}
+    rule_data = bytearray()
+    sections["rule_data_offsets"].append(0)
+
+    for position, rule in enumerate(rules):
+        include = set(rule["rule"].include)
+        exclude = set(rule["rule"].exclude)
+        for keyword in include:
+            include_postings[keyword.encode("utf-8")].append(position)
+        for keyword in exclude:
+            exclude_postings[keyword.encode("utf-8")].append(position)
+        if len(include) == 0:
+            sections["unconditional"].append(position)
+
+        sections["rule_ids"].append(rule["rule_id"])
+        sections["n_includes"].append(len(include))
+        rule_data += json.dumps(
+            [rule["title"], rule["rule"].include, rule["rule"].exclude]
+        ).encode("utf-8")
+        sections["rule_data_offsets"].append(len(rule_data))
+
+    # Keywords are sorted by their UTF-8 encoding so they can be looked up
+    # with a binary search over the raw bytes
+    keywords = sorted(set(include_postings) | set(exclude_postings))
+    keyword_blob = bytearray()
+    for name in ["keyword_offsets", "include_offsets", "exclude_offsets"]:
+        sections[name].append(0)
+    for keyword in keywords:
+        keyword_blob += keyword
+        sections["keyword_offsets"].append(len(keyword_blob))
+        sections["include_positions"].extend(include_postings.get(keyword, []))
+        sections["include_offsets"].append(len(sections["include_positions"]))
+        sections["exclude_positions"].extend(exclude_postings.get(keyword, []))
+        sections["exclude_offsets"].append(len(sections["exclude_positions"]))
+    sections["keywords"].frombytes(bytes(keyword_blob))
+    sections["rule_data"].frombytes(bytes(rule_data))
+
+    body = bytearray()
+    locations = []
+    for name, _ in SECTIONS:
+        # Align every section to 8 bytes
+        body += b"\0" * (-(HEADER.size + len(body)) % 8)
+        data = sections[name].tobytes()
+        locations.extend([HEADER.size + len(body), len(data)])
+        body += data
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(rules), *locations)
+    return header + bytes(body)
+
+
+class SharedRules(Sequence):
+    """
+    Rules serialized by `serialize_rules`, read in place from a buffer such
+    as a read-only `mmap`.
+
+    Nothing is copied out of the buffer up front, so any number of processes
+    can map the same file and share one copy of the rules in memory. Rules
+    are decoded into dicts (like those returned by `refresh_rules`) only when
+    accessed by position, e.g. to describe the rules a message matched.
+    """
+
+    def __init__(self, buffer):
+        """
+        Parameters
+        ----------
+        buffer : buffer
+            Serialized rules, e.g. a read-only `mmap`. Must stay open as long
+            as the rules are in use.
+        """
+        magic, format_version, n_rules, *locations = HEADER.unpack_from(buffer)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError("Buffer does not contain serialized urgency rules")
+
+        self.buffer = buffer
+        self.n_rules = n_rules
+        view = memoryview(buffer)
+        for i, (name, typecode) in enumerate(SECTIONS):
+            start, length = locations[2 * i], locations[2 * i + 1]
+            setattr(self, name, view[start : start + length].cast(typecode))
+
+        self.n_keywords = len(self.keyword_offsets) - 1
+
+    def __len__(self):
+        """
+        Number of rules
+        """
+        return self.n_rules
+
+    def __getitem__(self, position):
+        """
+        Decode the rule at `position` into a dict with `rule_id`, `title` and
+        `rule`
+        """
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(self.n_rules))]
+        if position < 0:
+            position += self.n_rules
+        if not 0 <= position < self.n_rules:
+            raise IndexError("rule position out of range")
+
+        start = self.rule_data_offsets[position]
+        end = self.rule_data_offsets[position + 1]
+        title, include, exclude = json.loads(bytes(self.rule_data[start:end]))
+        return {
+            "rule_id": self.rule_ids[position],
+            "title": title,
+            "rule": KeywordRule(include=include, exclude=exclude),
+        }
+
+    def find_keyword(self, keyword):
+        """
+        Return the index of `keyword` in the sorted keywords, or None
+        """
+        target = keyword.encode("utf-8")
+        low, high = 0, self.n_keywords
+        while low < high:
+            middle = (low + high) // 2
+            candidate = bytes(
+                self.keywords[
+                    self.keyword_offsets[middle] : self.keyword_offsets[middle + 1]
+                ]
+            )
+            if candidate < target:
+                low = middle + 1
+            elif candidate > target:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def match(self, tokens):
+        """
+        Return the positions of the rules matched by `tokens`, in ascending
+        order. Gives the same results as `KeywordRuleIndex.match`.
+
+        Parameters
+        ----------
+        tokens : Set[str]
+            Preprocessed message tokens
+
+        Returns
+        -------
+        List[int]
+        """
+        include_counts = defaultdict(int)
+        excluded = set()
+        for token in tokens:
+            k = self.find_keyword(token)
+            if k is None:
+                continue
+            include_start = self.include_offsets[k]
+            include_end = self.include_offsets[k + 1]
+            for position in self.include_positions[include_start:include_end]:
+                include_counts[position] += 1
+            exclude_start = self.exclude_offsets[k]
+            exclude_end = self.exclude_offsets[k + 1]
+            excluded.update(self.exclude_positions[exclude_start:exclude_end])
+
+        candidates = [
+            position
+            for position, count in include_counts.items()
+            if count == self.n_includes[position]
+        ]
+        candidates.extend(self.unconditional)
+
+        return sorted(position for position in candidates if position not in excluded)
+
+
+class SharedRuleEvaluator(RuleBasedUD):
+    """
+    `RuleBasedUD` that matches rules in place in a `SharedRules` buffer,
+    without compiling them into per-process objects.
+
+    Evaluates messages like `RuleEvaluator`, but has no keys or compiled
+    index, so it cannot be patched: rules are refreshed by publishing a new
+    buffer.
+    """
+
+    def __init__(self, rules, preprocessor):
+        """
+        Parameters
+        ----------
+        rules : SharedRules
+        preprocessor : Callable[[str], List[str]]
+            Function that converts a raw message into a list of tokens
+        """
+        super().__init__(model=rules, preprocessor=preprocessor)
+        self.rules = rules
+        self.preprocessor = preprocessor
+
+    evaluate = RuleEvaluator.evaluate
+    predict_scores = RuleEvaluator.predict_scores
+    predict = RuleEvaluator.predict
+
+    def match(self, tokens):
+        """
+        Return the positions of the rules matched by `tokens`, in ascending
+        order
+        """
+        return self.rules.match(tokens)
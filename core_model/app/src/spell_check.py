@@ -0,0 +1,56 @@
+"""
+Spell-checkers that can be shared between request threads
+"""
+from threading import local
+
+
+class ThreadLocalSpellChecker:
+    """
+    Gives each thread its own spell-checker instance.
+
+    Hunspell handles are not safe to use from several threads at once, so a
+    threaded gunicorn worker cannot share a single `CustomHunspell`. Each
+    thread builds its own instance with `factory` the first time it checks
+    a word. The instance built in the thread that creates this wrapper is
+    reused by that thread, so a preloaded single-threaded worker keeps
+    sharing the dictionaries loaded before the fork.
+    """
+
+    def __init__(self, factory):
+        """
+        Parameters
+        ----------
+        factory : Callable[[], faqt.preprocessing.tokens.CustomHunspell]
+            Builds a new spell-checker
+        """
+        self.factory = factory
+        self._local = local()
+        self._local.spell_checker = factory()
+
+    @property
+    def spell_checker(self):
+        """
+        Spell-checker of the current thread
+        """
+        spell_checker = getattr(self._local, "spell_checker", None)
+        if spell_checker is None:
+            spell_checker = self._local.spell_checker = self.factory()
+        return spell_checker
+
+    def spell(self, word):
+        """
+        Return True if `word` is spelled correctly
+        """
+        return self.spell_checker.spell(word)
+
+    def suggest(self, word):
+        """
+        Return spelling suggestions for `word`
+        """
+        return self.spell_checker.suggest(word)
+
+    def __getattr__(self, name):
+        """
+        Delegate all other attributes to the current thread's spell-checker
+        """
+        return getattr(self.spell_checker, name)
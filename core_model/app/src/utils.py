@@ -1,12 +1,15 @@
 """
 General utility functions
 """
+import mmap
 import os
+import struct
 import time
 from collections import UserDict
+from copy import deepcopy
 from pathlib import Path
+from threading import Lock
 
-import pandas as pd
 import yaml
 
 
@@ -22,9 +25,144 @@ def load_yaml_data(folder, filename):
     return yaml_dict
 
 
-def load_yaml_config(filename, config_subfolder=None):
+class YamlConfig:
     """
-    Load generic yaml files from config and return dictionary
+    A YAML config file, parsed once and memoized.
+
+    Reading values never touches the filesystem. `reload` parses the file
+    again only if it was modified since it was last parsed, and then calls
+    the hooks added with `add_reload_hook`.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : pathlib.Path
+        """
+        self.path = path
+        self._lock = Lock()
+        self._hooks = []
+        self._data, self._stat = self._parse()
+        # Number of times the file was parsed again with changes
+        self.generation = 0
+
+    def _parse(self):
+        """
+        Parse the file and return its data and the (mtime, size) it was
+        parsed at
+        """
+        stat = os.stat(self.path)
+        with open(self.path) as file:
+            data = yaml.full_load(file)
+        return data, (stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def data(self):
+        """
+        A copy of the parsed file, which callers may modify
+        """
+        return deepcopy(self._data)
+
+    def get(self, *keys):
+        """
+        Return the value at `keys`, e.g. `get("preprocessing", "ngram_min")`.
+        Lists and dicts are copied, so callers may modify them.
+        """
+        value = self._data
+        for key in keys:
+            value = value[key]
+        if isinstance(value, (list, dict)):
+            return deepcopy(value)
+        return value
+
+    def _get_typed(self, keys, value_type):
+        """
+        Return the value at `keys`, or raise TypeError if it is not of
+        `value_type`
+        """
+        value = self.get(*keys)
+        # bool is a subclass of int, but not a valid int config value
+        if not isinstance(value, value_type) or (
+            value_type is not bool and isinstance(value, bool)
+        ):
+            raise TypeError(
+                f"{self.path.name}: {'.'.join(map(str, keys))} is "
+                f"{type(value).__name__}, not {value_type.__name__}"
+            )
+        return value
+
+    def get_int(self, *keys):
+        """
+        Return the int value at `keys`
+        """
+        return self._get_typed(keys, int)
+
+    def get_float(self, *keys):
+        """
+        Return the value at `keys` as a float. Ints are accepted.
+        """
+        return float(self._get_typed(keys, (int, float)))
+
+    def get_str(self, *keys):
+        """
+        Return the str value at `keys`
+        """
+        return self._get_typed(keys, str)
+
+    def get_bool(self, *keys):
+        """
+        Return the bool value at `keys`
+        """
+        return self._get_typed(keys, bool)
+
+    def get_list(self, *keys):
+        """
+        Return a copy of the list value at `keys`
+        """
+        return self._get_typed(keys, list)
+
+    def get_dict(self, *keys):
+        """
+        Return a copy of the dict value at `keys`
+        """
+        return self._get_typed(keys, dict)
+
+    def add_reload_hook(self, hook):
+        """
+        Call `hook()` after the file is reloaded with changes
+        """
+        self._hooks.append(hook)
+
+    def reload(self, force=False):
+        """
+        Parse the file again if it was modified since it was last parsed (or
+        if `force`), and call the reload hooks if it was
+
+        Returns
+        -------
+        bool
+            True if the file was parsed again
+        """
+        with self._lock:
+            stat = os.stat(self.path)
+            if not force and (stat.st_mtime_ns, stat.st_size) == self._stat:
+                return False
+            self._data, self._stat = self._parse()
+            self.generation += 1
+
+        for hook in self._hooks:
+            hook()
+        return True
+
+
+_yaml_configs = {}
+_yaml_configs_lock = Lock()
+
+
+def get_yaml_config(filename, config_subfolder=None):
+    """
+    Return the memoized `YamlConfig` for a file in config
     """
     if config_subfolder:
         full_path = Path(__file__).parents[1] / "config/{}/{}".format(
@@ -33,10 +171,65 @@ def load_yaml_config(filename, config_subfolder=None):
     else:
         full_path = Path(__file__).parents[1] / "config/{}".format(filename)
 
-    with open(full_path) as file:
-        yaml_dict = yaml.full_load(file)
+    with _yaml_configs_lock:
+        config = _yaml_configs.get(full_path)
+        if config is None:
+            config = _yaml_configs[full_path] = YamlConfig(full_path)
+    return config
 
-    return yaml_dict
+
+def reload_yaml_configs(force=False):
+    """
+    Reload every memoized config file that was modified since it was parsed
+    (or all of them if `force`), see `YamlConfig.reload`
+
+    Returns
+    -------
+    List[str]
+        Names of the files that were reloaded
+    """
+    with _yaml_configs_lock:
+        configs = list(_yaml_configs.values())
+    return [config.path.name for config in configs if config.reload(force)]
+
+
+CONFIG_GENERATION = struct.Struct("Q")
+
+# Number of explicit config reloads, in anonymous shared memory created at
+# import. When gunicorn preloads the app, the master and all of its workers
+# map the same counter, so a reload in one worker is seen by all of them.
+_config_generation = mmap.mmap(-1, CONFIG_GENERATION.size)
+
+
+def get_config_generation():
+    """
+    Return the number of explicit config reloads by any worker
+    """
+    return CONFIG_GENERATION.unpack_from(_config_generation)[0]
+
+
+def increment_config_generation():
+    """
+    Tell every worker to reload its config files. Returns the new generation.
+    """
+    generation = get_config_generation() + 1
+    CONFIG_GENERATION.pack_into(_config_generation, 0, generation)
+    return generation
+
+
+def load_yaml_config(filename, config_subfolder=None):
+    """
+    Load generic yaml files from config and return dictionary. Files are
+    parsed once, see `get_yaml_config`.
+    """
+    return get_yaml_config(filename, config_subfolder).data
+
+
+def get_parameters():
+    """
+    Return the memoized `YamlConfig` of parameters.yml
+    """
+    return get_yaml_config("parameters.yml")
 
 
 def load_data_sources(key=None):
@@ -55,12 +248,10 @@ def load_parameters(key=None):
     """
     Load parameters
     """
-    params = load_yaml_config("parameters.yml")
-
-    if key is not None:
-        params = params[key]
+    if key is None:
+        return get_parameters().data
 
-    return params
+    return get_parameters().get(key)
 
 
 def load_databases(env):
@@ -88,6 +279,9 @@ def load_generic_dataset(data_source_name):
     """
     Load any dataset using the data_sources.yml name
     """
+    # Imported here since pandas is slow to import and the app doesn't need it
+    import pandas as pd
+
     data_sources = load_data_sources()
     my_data_source_info = data_sources[data_source_name]
 
@@ -152,6 +346,15 @@ class DefaultEnvDict(UserDict):
             raise KeyError(f"{key} not found in dict or environment variables")
         return value
 
+    def get(self, key, default=None):
+        """
+        Return value for `key` from dict or env variables, else `default`.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
 
 def get_ttl_hash(seconds=3600):
     """Return the same value within `seconds` time period"""
@@ -1,11 +1,48 @@
 """
 Gunicorn config file
 """
+import gc
+
 from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
 
 
+def when_ready(server):
+    """
+    Freeze the objects of the preloaded app, including the spell-checker
+    dictionaries, before workers are forked. Frozen objects are ignored by
+    the garbage collector, so workers don't write to (and copy) the memory
+    pages they share with the master.
+    """
+    gc.freeze()
+
+
 def child_exit(server, worker):
     """
     Required for prometheus for Gunicorn
     """
     GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
+
+
+def post_worker_init(worker):
+    """
+    Start listening for urgency rule changes in each worker
+    """
+    rule_listener = getattr(worker.wsgi, "rule_listener", None)
+    if rule_listener is not None:
+        rule_listener.start()
+
+
+def worker_exit(server, worker):
+    """
+    Stop the rule listener and flush inbound records queued for write-behind
+    persistence before the worker exits
+    """
+    app = getattr(worker, "wsgi", None)
+
+    rule_listener = getattr(app, "rule_listener", None)
+    if rule_listener is not None:
+        rule_listener.stop(timeout=5)
+
+    inbound_writer = getattr(app, "inbound_writer", None)
+    if inbound_writer is not None:
+        inbound_writer.stop(timeout=30)
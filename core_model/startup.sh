@@ -18,7 +18,12 @@ else
 fi
 
 # Note: timeout is high here to allow for loading the large pre-trained model
-# Note: we run with 2n+1 workers, preloading application (to share the large model in RAM)
-# Note: application is not thread-safe, so must be single-threaded
+# Note: we run with 2n+1 workers by default, preloading application (to share the large model in RAM)
+# Note: set GUNICORN_THREADS above 1 to run threaded (gthread) workers, which keep
+# serving requests while other threads wait on Postgres. Each thread loads its own
+# Hunspell dictionaries on its first request.
 exec su-exec container_user \
-    gunicorn --timeout 300 --workers=$((2 * $(getconf _NPROCESSORS_ONLN) + 1)) --preload flask_app:app -b 0.0.0.0:$PORT
\ No newline at end of file
+    gunicorn --timeout 300 \
+    --workers=${GUNICORN_WORKERS:-$((2 * $(getconf _NPROCESSORS_ONLN) + 1))} \
+    --threads=${GUNICORN_THREADS:-1} \
+    --preload flask_app:app -b 0.0.0.0:$PORT
\ No newline at end of file
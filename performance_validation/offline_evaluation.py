@@ -0,0 +1,452 @@
+"""
+Offline evaluation of urgency rules against a labelled validation set.
+
+Scores messages without the app: the rules CSV and the validation CSV are
+loaded directly, every message is preprocessed once (optionally across a
+process pool) and all messages are matched against all rules at once as a
+sparse message x rule matrix.
+
+With `--tokens-from-db`, the tokens the app saved for inbound messages with
+the same text (see `INBOUND_SAVE_TOKENS`) are reused if they were computed
+with the current preprocessing parameters. The database is configured with
+the same PG_* environment variables as the app.
+
+Run from the root of the repository:
+
+    python -m performance_validation.offline_evaluation rules.csv validation.csv \\
+        --query-col message --true-col urgent --n-processes 4
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from faqt import KeywordRule
+from scipy import sparse
+from sklearn.metrics import (
+    accuracy_score,
+    confusion_matrix,
+    f1_score,
+    precision_score,
+    recall_score,
+)
+from sqlalchemy import create_engine, text
+
+from core_model.app import (
+    get_config_data,
+    get_preprocessor_version,
+    get_text_preprocessor,
+)
+
+# Preprocessor of each pool process, built once by `_init_preprocessor`
+_preprocessor = None
+
+
+def load_rules(rules_df):
+    """
+    Convert a rules CSV, with `Include Tags` and `Exclude Tags` columns
+    holding lists of keywords, into `KeywordRule`s. Keywords are lowercased
+    as when rules are loaded from the database.
+
+    Parameters
+    ----------
+    rules_df : pandas.DataFrame
+
+    Returns
+    -------
+    List[KeywordRule]
+    """
+    return [
+        KeywordRule(
+            include=[s.lower() for s in ast.literal_eval(row["Include Tags"])],
+            exclude=[s.lower() for s in ast.literal_eval(row["Exclude Tags"])],
+        )
+        for _, row in rules_df.iterrows()
+    ]
+
+
+def _init_preprocessor():
+    """
+    Build the preprocessor once per pool process
+    """
+    global _preprocessor
+    _preprocessor = get_text_preprocessor()
+
+
+def _preprocess(message):
+    """
+    Preprocess a message with the pool process's preprocessor
+    """
+    return _preprocessor(message)
+
+
+def preprocess_messages(messages, n_processes=1):
+    """
+    Preprocess every message once with the app's preprocessor
+
+    Parameters
+    ----------
+    messages : List[str]
+    n_processes : int
+        Number of processes to preprocess with. Each builds its own
+        preprocessor, so this only pays off for large validation sets.
+
+    Returns
+    -------
+    List[List[str]]
+    """
+    if n_processes <= 1:
+        preprocessor = get_text_preprocessor()
+        return [preprocessor(message) for message in messages]
+
+    with Pool(n_processes, initializer=_init_preprocessor) as pool:
+        chunksize = max(len(messages) // (4 * n_processes), 1)
+        return pool.map(_preprocess, messages, chunksize=chunksize)
+
+
+def preprocess_messages_cached(messages, cache_path, n_processes=1):
+    """
+    Preprocess messages, reusing the tokens saved at `cache_path` if they
+    were computed from the same messages and preprocessing parameters
+
+    Parameters
+    ----------
+    messages : List[str]
+    cache_path : str
+        JSON file to load tokens from or save them to
+    n_processes : int
+        Number of processes to preprocess with on a cache miss
+
+    Returns
+    -------
+    List[List[str]]
+    """
+    digest = hashlib.sha256()
+    digest.update(get_preprocessor_version().encode())
+    for message in messages:
+        digest.update(message.encode("utf-8") + b"\0")
+    key = digest.hexdigest()
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as file:
+            cached = json.load(file)
+        if cached["key"] == key:
+            return cached["token_lists"]
+
+    token_lists = preprocess_messages(messages, n_processes)
+    with open(cache_path, "w") as file:
+        json.dump({"key": key, "token_lists": token_lists}, file)
+    return token_lists
+
+
+def load_saved_tokens(messages, engine):
+    """
+    Load the tokens saved by the app for inbound messages with the same text
+    as `messages`, if they were computed with the current preprocessor
+
+    Parameters
+    ----------
+    messages : List[str]
+    engine : sqlalchemy.engine.Engine
+
+    Returns
+    -------
+    Dict[str, List[str]]
+        Tokens by message text, for the messages found
+    """
+    query = text(
+        "SELECT DISTINCT ON (i.inbound_text) i.inbound_text, t.inbound_tokens "
+        "FROM inbounds_ud i "
+        "JOIN inbound_tokens t ON t.inbound_id = i.inbound_id "
+        "WHERE t.preprocessor_version = :version "
+        "AND i.inbound_text = ANY(:messages)"
+    )
+    with engine.connect() as connection:
+        rows = connection.execute(
+            query,
+            version=get_preprocessor_version(),
+            messages=list(set(messages)),
+        )
+        return {inbound_text: tokens for inbound_text, tokens in rows}
+
+
+def preprocess_messages_saved(messages, engine, n_processes=1):
+    """
+    Preprocess messages, reusing the tokens saved by the app where possible,
+    see `load_saved_tokens`
+
+    Parameters
+    ----------
+    messages : List[str]
+    engine : sqlalchemy.engine.Engine
+    n_processes : int
+        Number of processes to preprocess the remaining messages with
+
+    Returns
+    -------
+    List[List[str]]
+    """
+    saved = load_saved_tokens(messages, engine)
+    missing = sorted(set(messages) - saved.keys())
+    saved.update(zip(missing, preprocess_messages(missing, n_processes)))
+    return [saved[message] for message in messages]
+
+
+def get_token_lists(messages, n_processes=1, token_cache=None, engine=None):
+    """
+    Preprocess messages, reusing tokens saved in the database (if `engine` is
+    given) or else in a cache file (if `token_cache` is given)
+
+    Parameters
+    ----------
+    messages : List[str]
+    n_processes : int
+        Number of processes to preprocess messages with
+    token_cache : str, optional
+        JSON file to cache preprocessed messages in, see
+        `preprocess_messages_cached`
+    engine : sqlalchemy.engine.Engine, optional
+        Database with the tokens saved by the app, see
+        `preprocess_messages_saved`
+
+    Returns
+    -------
+    List[List[str]]
+    """
+    if engine is not None:
+        return preprocess_messages_saved(messages, engine, n_processes)
+    elif token_cache is not None:
+        return preprocess_messages_cached(messages, token_cache, n_processes)
+    else:
+        return preprocess_messages(messages, n_processes)
+
+
+def get_db_engine():
+    """
+    Return an engine for the app's database, configured from PG_* environment
+    variables
+    """
+    return create_engine(get_config_data({})["SQLALCHEMY_DATABASE_URI"])
+
+
+def match_matrix(token_lists, rules):
+    """
+    Match every message against every rule.
+
+    Messages and rule keywords are encoded as sparse incidence matrices over
+    the message vocabulary, so the include keywords of each rule found in
+    each message are counted with one sparse matrix product (and likewise
+    for exclude keywords). A rule matches a message if all of its include
+    keywords and none of its exclude keywords are found, as in
+    `faqt.evaluate_keyword_rule`.
+
+    Parameters
+    ----------
+    token_lists : List[List[str]]
+        Preprocessed messages
+    rules : List[KeywordRule]
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Boolean matrix of shape (number of messages, number of rules)
+    """
+    n_messages, n_rules = len(token_lists), len(rules)
+
+    vocabulary = {}
+    message_rows, token_cols = [], []
+    for i, tokens in enumerate(token_lists):
+        for token in set(tokens):
+            message_rows.append(i)
+            token_cols.append(vocabulary.setdefault(token, len(vocabulary)))
+    messages = sparse.csr_matrix(
+        (np.ones(len(message_rows), dtype=np.int32), (message_rows, token_cols)),
+        shape=(n_messages, len(vocabulary)),
+    )
+
+    def keyword_matrix(keywords_per_rule):
+        # Keywords missing from every message are left out, which cannot
+        # create matches since include counts are compared to the full
+        # number of include keywords
+        rows, cols = [], []
+        for j, keywords in enumerate(keywords_per_rule):
+            for keyword in set(keywords):
+                if keyword in vocabulary:
+                    rows.append(vocabulary[keyword])
+                    cols.append(j)
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(vocabulary), n_rules),
+        )
+
+    n_includes = np.array([len(set(rule.include)) for rule in rules], dtype=np.int32)
+    include_counts = (messages @ keyword_matrix([r.include for r in rules])).tocoo()
+    all_included = include_counts.data == n_includes[include_counts.col]
+    matched = sparse.csr_matrix(
+        (
+            np.ones(all_included.sum(), dtype=bool),
+            (include_counts.row[all_included], include_counts.col[all_included]),
+        ),
+        shape=(n_messages, n_rules),
+    )
+
+    # Rules without include keywords are candidates for every message
+    unconditional = np.flatnonzero(n_includes == 0)
+    if len(unconditional) > 0:
+        matched = matched + sparse.csr_matrix(
+            (
+                np.ones(n_messages * len(unconditional), dtype=bool),
+                (
+                    np.repeat(np.arange(n_messages), len(unconditional)),
+                    np.tile(unconditional, n_messages),
+                ),
+            ),
+            shape=(n_messages, n_rules),
+        )
+
+    excluded = (messages @ keyword_matrix([r.exclude for r in rules])) > 0
+    matched = matched - matched.multiply(excluded)
+    matched.eliminate_zeros()
+    return matched.astype(bool).tocsr()
+
+
+def urgency_scores(matches):
+    """
+    Aggregate urgency score of each message: 1.0 if it matched any rule
+
+    Parameters
+    ----------
+    matches : scipy.sparse.csr_matrix
+        Output of `match_matrix`
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    return (matches.getnnz(axis=1) > 0).astype(float)
+
+
+def compute_metrics(true_val, predicted):
+    """
+    Classification metrics of predicted urgency against the labels
+
+    Returns
+    -------
+    Dict
+        `confusion`, `precision`, `recall`, `accuracy` and `f1`
+    """
+    return {
+        "confusion": confusion_matrix(y_true=true_val, y_pred=predicted),
+        "precision": precision_score(
+            y_true=true_val, y_pred=predicted, zero_division=0
+        ),
+        "recall": recall_score(y_true=true_val, y_pred=predicted, zero_division=0),
+        "accuracy": accuracy_score(y_true=true_val, y_pred=predicted),
+        "f1": f1_score(y_true=true_val, y_pred=predicted, zero_division=0),
+    }
+
+
+def prepare_validation_data(validation_df, query_col, true_col):
+    """
+    Drop rows without a label or with an empty message, and return the
+    messages and their labels
+
+    Parameters
+    ----------
+    validation_df : pandas.DataFrame
+        Messages in `query_col`, labelled "Yes" or "No" in `true_col`
+    query_col : str
+    true_col : str
+
+    Returns
+    -------
+    messages : List[str]
+    true_val : numpy.ndarray
+        1 for urgent messages, 0 otherwise
+    """
+    validation_df = validation_df.loc[
+        (validation_df[true_col].notnull()) & (validation_df[query_col] != "")
+    ]
+    messages = [str(message) for message in validation_df[query_col]]
+    true_val = (validation_df[true_col] != "No").astype(int).to_numpy()
+    return messages, true_val
+
+
+def evaluate_offline(
+    validation_df,
+    rules_df,
+    query_col,
+    true_col,
+    n_processes=1,
+    token_cache=None,
+    engine=None,
+):
+    """
+    Score the validation set with the rules and compute metrics
+
+    Parameters
+    ----------
+    validation_df : pandas.DataFrame
+        See `prepare_validation_data`
+    rules_df : pandas.DataFrame
+        Rules, see `load_rules`
+    query_col : str
+    true_col : str
+    n_processes : int
+        Number of processes to preprocess messages with
+    token_cache : str, optional
+        JSON file to cache preprocessed messages in, see
+        `preprocess_messages_cached`
+    engine : sqlalchemy.engine.Engine, optional
+        Database to reuse the tokens saved by the app from, see
+        `preprocess_messages_saved`
+
+    Returns
+    -------
+    Dict
+        Metrics, see `compute_metrics`
+    """
+    messages, true_val = prepare_validation_data(validation_df, query_col, true_col)
+    token_lists = get_token_lists(messages, n_processes, token_cache, engine)
+
+    predicted = urgency_scores(match_matrix(token_lists, load_rules(rules_df)))
+    return compute_metrics(true_val, predicted)
+
+
+def main():
+    """
+    Parse arguments, run the evaluation and print metrics
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("rules", help="Rules CSV")
+    parser.add_argument("validation", help="Labelled validation CSV")
+    parser.add_argument("--query-col", required=True)
+    parser.add_argument("--true-col", required=True)
+    parser.add_argument("--n-processes", type=int, default=1)
+    parser.add_argument("--token-cache", help="Optional JSON file to cache tokens in")
+    parser.add_argument(
+        "--tokens-from-db",
+        action="store_true",
+        help="Reuse the tokens saved by the app in the database",
+    )
+    args = parser.parse_args()
+
+    metrics = evaluate_offline(
+        pd.read_csv(args.validation),
+        pd.read_csv(args.rules),
+        args.query_col,
+        args.true_col,
+        args.n_processes,
+        args.token_cache,
+        get_db_engine() if args.tokens_from_db else None,
+    )
+    for name, value in metrics.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Per-rule contribution report on a labelled validation set.
+
+For every rule, reports the true and false positives it matches, how many of
+those no other rule matches, and the precision and recall of the rule set
+with that rule left out. Preprocessed tokens are cached (see `--token-cache`
+and `--tokens-from-db`) and all rules are scored from one sparse message x rule matrix, so the report
+can be re-run quickly while editing the rules CSV.
+
+Run from the root of the repository:
+
+    python -m performance_validation.rule_contributions rules.csv validation.csv \\
+        --query-col message --true-col urgent --token-cache tokens.json \\
+        --output contributions.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+from performance_validation.offline_evaluation import (
+    get_db_engine,
+    get_token_lists,
+    load_rules,
+    match_matrix,
+    prepare_validation_data,
+)
+
+
+def safe_divide(numerator, denominator):
+    """
+    Element-wise division, with 0 where the denominator is 0
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape),
+        where=denominator != 0,
+    )
+
+
+def rule_contributions(matches, true_val):
+    """
+    Compute the contribution of each rule from a message x rule match matrix
+
+    A message is predicted urgent if any rule matches it, so dropping a rule
+    only changes the prediction for messages matched by that rule alone.
+
+    Parameters
+    ----------
+    matches : scipy.sparse.csr_matrix
+        Output of `match_matrix`
+    true_val : numpy.ndarray
+        1 for urgent messages, 0 otherwise
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per rule, in the order of the matrix columns
+    """
+    true_val = np.asarray(true_val).astype(bool)
+    n_matches = np.asarray(matches.getnnz(axis=1))
+    predicted = n_matches > 0
+    only_match = n_matches == 1
+
+    true_positives = np.sum(predicted & true_val)
+    false_positives = np.sum(predicted & ~true_val)
+    n_positives = np.sum(true_val)
+
+    # Column sums of the match matrix over different sets of messages
+    matches_t = matches.T.astype(np.int64)
+    rule_tp = matches_t @ true_val.astype(np.int64)
+    rule_fp = matches_t @ (~true_val).astype(np.int64)
+    unique_tp = matches_t @ (only_match & true_val).astype(np.int64)
+    unique_fp = matches_t @ (only_match & ~true_val).astype(np.int64)
+
+    without_tp = true_positives - unique_tp
+    without_fp = false_positives - unique_fp
+    precision = safe_divide(true_positives, true_positives + false_positives)
+    recall = safe_divide(true_positives, n_positives)
+    precision_without = safe_divide(without_tp, without_tp + without_fp)
+    recall_without = safe_divide(without_tp, n_positives)
+
+    return pd.DataFrame(
+        {
+            "true_positives": rule_tp,
+            "false_positives": rule_fp,
+            "rule_precision": safe_divide(rule_tp, rule_tp + rule_fp),
+            "unique_true_positives": unique_tp,
+            "unique_false_positives": unique_fp,
+            "precision_without_rule": precision_without,
+            "recall_without_rule": recall_without,
+            "precision_change_without_rule": precision_without - precision,
+            "recall_change_without_rule": recall_without - recall,
+        }
+    )
+
+
+def contribution_report(
+    validation_df,
+    rules_df,
+    query_col,
+    true_col,
+    n_processes=1,
+    token_cache=None,
+    engine=None,
+):
+    """
+    Build the per-rule contribution report for a rules CSV
+
+    Parameters
+    ----------
+    validation_df : pandas.DataFrame
+        See `prepare_validation_data`
+    rules_df : pandas.DataFrame
+        Rules, with a `Title` column, see `load_rules`
+    query_col : str
+    true_col : str
+    n_processes : int
+        Number of processes to preprocess messages with
+    token_cache : str, optional
+        JSON file to cache preprocessed messages in
+    engine : sqlalchemy.engine.Engine, optional
+        Database to reuse the tokens saved by the app from
+
+    Returns
+    -------
+    pandas.DataFrame
+        Rule titles and contributions, see `rule_contributions`
+    """
+    messages, true_val = prepare_validation_data(validation_df, query_col, true_col)
+    token_lists = get_token_lists(messages, n_processes, token_cache, engine)
+
+    matches = match_matrix(token_lists, load_rules(rules_df))
+    report = rule_contributions(matches, true_val)
+    report.insert(0, "title", rules_df["Title"].to_numpy())
+    return report
+
+
+def main():
+    """
+    Parse arguments, build the report and print or save it
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("rules", help="Rules CSV")
+    parser.add_argument("validation", help="Labelled validation CSV")
+    parser.add_argument("--query-col", required=True)
+    parser.add_argument("--true-col", required=True)
+    parser.add_argument("--n-processes", type=int, default=1)
+    parser.add_argument("--token-cache", help="Optional JSON file to cache tokens in")
+    parser.add_argument(
+        "--tokens-from-db",
+        action="store_true",
+        help="Reuse the tokens saved by the app in the database",
+    )
+    parser.add_argument("--output", help="Optional path to write the report CSV to")
+    args = parser.parse_args()
+
+    report = contribution_report(
+        pd.read_csv(args.validation),
+        pd.read_csv(args.rules),
+        args.query_col,
+        args.true_col,
+        args.n_processes,
+        args.token_cache,
+        get_db_engine() if args.tokens_from_db else None,
+    )
+    report = report.sort_values("recall_change_without_rule")
+
+    if args.output:
+        report.to_csv(args.output, index=False)
+    else:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(report.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
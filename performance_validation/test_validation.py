@@ -5,13 +5,7 @@ import boto3
 import pandas as pd
 import pytest
 from nltk.corpus import stopwords
-from sklearn.metrics import (
-    accuracy_score,
-    confusion_matrix,
-    f1_score,
-    precision_score,
-    recall_score,
-)
+from performance_validation.offline_evaluation import compute_metrics, evaluate_offline
 from sqlalchemy import text
 
 from core_model.app.database_sqlalchemy import db
@@ -176,7 +170,7 @@ class TestPerformance:
                 "DELETE FROM urgency_rules "
                 "WHERE urgency_rule_author='Validation author'"
             )
-            t2 = text("DELETE FROM inbounds_ud")
+            t2 = text("TRUNCATE inbounds_ud")
 
             with db_connection.begin():
                 db_connection.execute(t)
@@ -212,19 +206,35 @@ class TestPerformance:
         true_val.replace({0: 1, 1: 0}, inplace=True)
         assert predicted.shape == true_val.shape
 
-        confusion = confusion_matrix(y_true=true_val, y_pred=predicted)
-        precision = precision_score(y_true=true_val, y_pred=predicted, zero_division=0)
-        recall = recall_score(y_true=true_val, y_pred=predicted, zero_division=0)
-        accuracy = accuracy_score(y_true=true_val, y_pred=predicted)
-        f1 = f1_score(y_true=true_val, y_pred=predicted, zero_division=0)
+        return self.report_metrics(compute_metrics(true_val, predicted), test_params)
 
+    def test_ud_performance_offline(self, test_params):
+        """
+        Test the performance of UD with the offline evaluator, which scores
+        all messages at once without the app or the DB.
+        """
+        metrics = evaluate_offline(
+            self.get_data_to_validate(test_params),
+            self.get_rules_data(test_params),
+            test_params["QUERY_COL"],
+            test_params["TRUE_URGENCY"],
+            n_processes=os.cpu_count(),
+        )
+        return self.report_metrics(metrics, test_params)
+
+    def report_metrics(self, metrics, test_params):
+        """
+        Print the metrics, and send an alert if recall is below the threshold
+        when running in GitHub Actions.
+        """
+        recall = metrics["recall"]
         alert = generate_message(
             round(recall, 2),
             test_params["THRESHOLD_CRITERIA"],
-            round(precision, 2),
-            round(accuracy, 2),
-            round(f1, 2),
-            confusion,
+            round(metrics["precision"], 2),
+            round(metrics["accuracy"], 2),
+            round(metrics["f1"], 2),
+            metrics["confusion"],
             test_params,
         )
         if (recall < test_params["THRESHOLD_CRITERIA"]) & (
@@ -1,3 +1,29 @@
 DROP TABLE IF EXISTS urgency_rules;
 
+DROP TABLE IF EXISTS urgency_rules_deleted;
+
+DROP FUNCTION IF EXISTS notify_urgency_rules_changed();
+
+DROP FUNCTION IF EXISTS set_urgency_rule_version();
+
+DROP FUNCTION IF EXISTS record_urgency_rule_deletion();
+
+DROP TABLE IF EXISTS urgency_rules_history;
+
+DROP FUNCTION IF EXISTS record_urgency_rule_history();
+
+DROP SEQUENCE IF EXISTS urgency_rules_version_seq;
+
 DROP TABLE IF EXISTS inbounds_ud;
+
+DROP FUNCTION IF EXISTS inbound_matched_rules(jsonb, bigint);
+
+DROP FUNCTION IF EXISTS inbound_matched_rule_ids(jsonb);
+
+DROP FUNCTION IF EXISTS create_inbound_partitions(date, date);
+
+DROP TABLE IF EXISTS inbound_tokens;
+
+DROP TABLE IF EXISTS inbound_rescore_rule_diffs;
+
+DROP TABLE IF EXISTS inbound_rescore_runs;
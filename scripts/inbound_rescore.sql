@@ -0,0 +1,28 @@
+-- Progress and results of re-scoring past inbound messages with a new rule
+-- set (see `flask rescore-inbounds`). Safe to re-run on an existing database.
+CREATE TABLE IF NOT EXISTS inbound_rescore_runs (
+	rescore_run_id serial NOT NULL,
+	urgency_rule_version bigint NOT NULL,
+	preprocessor_version text NOT NULL,
+	max_inbound_id integer NOT NULL,
+	last_inbound_id integer NOT NULL DEFAULT 0,
+	n_inbounds integer NOT NULL DEFAULT 0,
+	n_newly_urgent integer NOT NULL DEFAULT 0,
+	n_no_longer_urgent integer NOT NULL DEFAULT 0,
+	started_utc timestamp without time zone NOT NULL,
+	updated_utc timestamp without time zone NOT NULL,
+	finished_utc timestamp without time zone,
+	PRIMARY KEY (rescore_run_id)
+);
+
+CREATE INDEX IF NOT EXISTS inbound_rescore_runs_version_idx
+	ON inbound_rescore_runs (urgency_rule_version, preprocessor_version);
+
+CREATE TABLE IF NOT EXISTS inbound_rescore_rule_diffs (
+	rescore_run_id integer NOT NULL
+		REFERENCES inbound_rescore_runs (rescore_run_id) ON DELETE CASCADE,
+	urgency_rule_id integer NOT NULL,
+	n_newly_matched integer NOT NULL DEFAULT 0,
+	n_no_longer_matched integer NOT NULL DEFAULT 0,
+	PRIMARY KEY (rescore_run_id, urgency_rule_id)
+);
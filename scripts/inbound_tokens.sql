@@ -0,0 +1,10 @@
+-- Preprocessed tokens of inbound messages, keyed by a hash of the
+-- preprocessing parameters they were computed with, so that tools can match
+-- rules against past messages without preprocessing them again.
+-- Safe to re-run on an existing database.
+CREATE TABLE IF NOT EXISTS inbound_tokens (
+	inbound_id integer NOT NULL,
+	preprocessor_version text NOT NULL,
+	inbound_tokens text[] NOT NULL,
+	PRIMARY KEY (inbound_id)
+);
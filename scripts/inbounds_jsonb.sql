@@ -0,0 +1,63 @@
+-- Store the JSON columns of inbounds_ud as jsonb, and index the table for
+-- analytics queries on time ranges, matched rules and metadata fields.
+-- Safe to re-run on an existing database.
+--
+-- Converting an existing json column rewrites the table and holds an
+-- exclusive lock on it until done, so on a large table run this script
+-- during a maintenance window. Columns that are already jsonb are skipped.
+DO $$
+DECLARE
+	json_column text;
+BEGIN
+	FOR json_column IN
+		SELECT column_name FROM information_schema.columns
+		WHERE table_schema = current_schema()
+			AND table_name = 'inbounds_ud'
+			AND column_name IN (
+				'inbound_metadata', 'urgency_score', 'returned_content', 'returned_feedback'
+			)
+			AND data_type = 'json'
+	LOOP
+		EXECUTE format(
+			'ALTER TABLE inbounds_ud ALTER COLUMN %I TYPE jsonb USING %I::jsonb',
+			json_column,
+			json_column
+		);
+	END LOOP;
+END;
+$$;
+
+-- IDs of the rules an inbound message matched, from its `urgency_score`
+-- (the list of matched rules, or of their IDs in the compact storage
+-- format). Query with the same expression to use the index below, e.g.
+-- `inbound_matched_rule_ids(urgency_score) @> ARRAY[3]`.
+CREATE OR REPLACE FUNCTION inbound_matched_rule_ids(urgency_score jsonb)
+RETURNS integer[] AS $$
+	SELECT COALESCE(
+		array_agg(
+			CASE WHEN jsonb_typeof(matched_rule) = 'number'
+				THEN matched_rule::text::integer
+				ELSE (matched_rule ->> 'rule_id')::integer
+			END
+			ORDER BY position
+		),
+		'{}'
+	)
+	FROM jsonb_array_elements(
+		CASE WHEN jsonb_typeof(urgency_score) = 'array' THEN urgency_score ELSE '[]' END
+	) WITH ORDINALITY AS matched (matched_rule, position)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Rows are inserted in time order, so a BRIN index on the receipt time is a
+-- tiny fraction of the size of a B-tree and still skips most of the table
+-- for time range queries
+CREATE INDEX IF NOT EXISTS inbounds_ud_inbound_utc_brin_idx
+	ON inbounds_ud USING brin (inbound_utc);
+
+CREATE INDEX IF NOT EXISTS inbounds_ud_matched_rule_ids_idx
+	ON inbounds_ud USING gin (inbound_matched_rule_ids(urgency_score));
+
+-- Containment queries on metadata fields, e.g.
+-- `inbound_metadata @> '{"channel": "sms"}'`
+CREATE INDEX IF NOT EXISTS inbounds_ud_inbound_metadata_idx
+	ON inbounds_ud USING gin (inbound_metadata jsonb_path_ops);
@@ -0,0 +1,99 @@
+-- Partition inbounds_ud by month of inbound_utc, so that old months can be
+-- detached, archived or dropped as a whole (see `flask inbound-retention`)
+-- rather than deleted row by row. Safe to re-run on an existing database.
+--
+-- Messages for months without a partition go to inbounds_ud_default, and
+-- are moved to their month's partition when it is created. Run
+-- `flask create-inbound-partitions` as a scheduled job to create the
+-- partitions of upcoming months (or set `INBOUND_PARTITIONS_AHEAD` to create
+-- them at app startup).
+--
+-- An existing unpartitioned inbounds_ud is converted by copying its rows
+-- into monthly partitions, which locks the table until done, so on a large
+-- table run this script during a maintenance window. The conversion drops
+-- the table's indexes: run scripts/inbounds_jsonb.sql afterwards to create
+-- them on every partition.
+
+-- Create the monthly partitions of inbounds_ud from `first_month` to
+-- `last_month`, moving their rows out of the default partition. Returns the
+-- names of the partitions created.
+CREATE OR REPLACE FUNCTION create_inbound_partitions(first_month date, last_month date)
+RETURNS SETOF text AS $$
+DECLARE
+	month_start date := date_trunc('month', first_month)::date;
+	month_end date;
+	partition_name text;
+BEGIN
+	-- Serialize with other callers, e.g. app instances starting together
+	PERFORM pg_advisory_xact_lock(hashtext('create_inbound_partitions'));
+
+	WHILE month_start <= last_month LOOP
+		month_end := (month_start + interval '1 month')::date;
+		partition_name := 'inbounds_ud_' || to_char(month_start, 'YYYY_MM');
+
+		IF to_regclass(partition_name) IS NULL THEN
+			EXECUTE format(
+				'CREATE TABLE %I (LIKE inbounds_ud INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+				partition_name
+			);
+			-- Block inserts into the default partition until the new partition
+			-- is attached, so that no row for its month lands there after the
+			-- move and makes the attach fail
+			LOCK TABLE inbounds_ud_default IN SHARE ROW EXCLUSIVE MODE;
+			EXECUTE format(
+				'WITH moved AS ('
+				'DELETE FROM inbounds_ud_default '
+				'WHERE inbound_utc >= %L AND inbound_utc < %L RETURNING *'
+				') INSERT INTO %I SELECT * FROM moved',
+				month_start,
+				month_end,
+				partition_name
+			);
+			EXECUTE format(
+				'ALTER TABLE inbounds_ud ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+				partition_name,
+				month_start,
+				month_end
+			);
+			RETURN NEXT partition_name;
+		END IF;
+
+		month_start := month_end;
+	END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Convert an unpartitioned inbounds_ud, keeping its inbound_id sequence
+DO $$
+DECLARE
+	first_month date;
+BEGIN
+	IF (SELECT relkind FROM pg_class WHERE oid = 'inbounds_ud'::regclass) = 'r' THEN
+		ALTER SEQUENCE inbounds_ud_inbound_id_seq OWNED BY NONE;
+		ALTER TABLE inbounds_ud RENAME TO inbounds_ud_unpartitioned;
+		ALTER TABLE inbounds_ud_unpartitioned
+			RENAME CONSTRAINT inbounds_ud_pkey TO inbounds_ud_unpartitioned_pkey;
+
+		CREATE TABLE inbounds_ud (
+			LIKE inbounds_ud_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+			PRIMARY KEY (inbound_id, inbound_utc)
+		) PARTITION BY RANGE (inbound_utc);
+		ALTER SEQUENCE inbounds_ud_inbound_id_seq OWNED BY inbounds_ud.inbound_id;
+		CREATE TABLE inbounds_ud_default PARTITION OF inbounds_ud DEFAULT;
+
+		SELECT min(inbound_utc) INTO first_month FROM inbounds_ud_unpartitioned;
+		PERFORM create_inbound_partitions(
+			COALESCE(first_month, now() at time zone 'utc')::date,
+			(now() at time zone 'utc')::date
+		);
+		INSERT INTO inbounds_ud SELECT * FROM inbounds_ud_unpartitioned;
+		DROP TABLE inbounds_ud_unpartitioned;
+	END IF;
+END;
+$$;
+
+-- Partitions for the current and next three months
+SELECT create_inbound_partitions(
+	(now() at time zone 'utc')::date,
+	(now() at time zone 'utc' + interval '3 months')::date
+);
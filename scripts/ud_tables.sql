@@ -12,11 +12,14 @@ CREATE TABLE inbounds_ud (
 	inbound_id serial NOT NULL,
 	feedback_secret_key text NOT NULL,
 	inbound_text text NOT NULL,
-	inbound_metadata json,
+	inbound_metadata jsonb,
 	inbound_utc timestamp without time zone NOT NULL,
-	urgency_score json NOT NULL,
-	returned_content json NOT NULL,
+	urgency_score jsonb NOT NULL,
+	returned_content jsonb NOT NULL,
 	returned_utc timestamp without time zone NOT NULL,
-	returned_feedback json,
-	PRIMARY KEY (inbound_id)
-);
+	returned_feedback jsonb,
+	PRIMARY KEY (inbound_id, inbound_utc)
+) PARTITION BY RANGE (inbound_utc);
+
+-- Monthly partitions are created by scripts/inbounds_partitioning.sql
+CREATE TABLE inbounds_ud_default PARTITION OF inbounds_ud DEFAULT;
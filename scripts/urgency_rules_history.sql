@@ -0,0 +1,100 @@
+-- Keep every version of every urgency rule, so that inbound messages can be
+-- stored with only the IDs of the rules they matched and the version of the
+-- rules they were checked with (`INBOUND_STORAGE_FORMAT=compact`).
+-- Run after scripts/urgency_rules_versioning.sql and
+-- scripts/inbounds_jsonb.sql. Safe to re-run on an existing database.
+CREATE TABLE IF NOT EXISTS urgency_rules_history (
+	urgency_rule_id integer NOT NULL,
+	urgency_rule_version bigint NOT NULL,
+	urgency_rule_added_utc timestamp without time zone NOT NULL,
+	urgency_rule_author text NOT NULL,
+	urgency_rule_title text NOT NULL,
+	urgency_rule_tags_include text [] NOT NULL,
+	urgency_rule_tags_exclude text [] NOT NULL,
+	PRIMARY KEY (urgency_rule_id, urgency_rule_version)
+);
+
+CREATE OR REPLACE FUNCTION record_urgency_rule_history() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO urgency_rules_history (
+		urgency_rule_id,
+		urgency_rule_version,
+		urgency_rule_added_utc,
+		urgency_rule_author,
+		urgency_rule_title,
+		urgency_rule_tags_include,
+		urgency_rule_tags_exclude
+	) VALUES (
+		NEW.urgency_rule_id,
+		NEW.urgency_rule_version,
+		NEW.urgency_rule_added_utc,
+		NEW.urgency_rule_author,
+		NEW.urgency_rule_title,
+		NEW.urgency_rule_tags_include,
+		NEW.urgency_rule_tags_exclude
+	) ON CONFLICT DO NOTHING;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS urgency_rules_record_history ON urgency_rules;
+CREATE TRIGGER urgency_rules_record_history
+	AFTER INSERT OR UPDATE ON urgency_rules
+	FOR EACH ROW EXECUTE FUNCTION record_urgency_rule_history();
+
+-- Current versions of rules added before this script
+INSERT INTO urgency_rules_history (
+	urgency_rule_id,
+	urgency_rule_version,
+	urgency_rule_added_utc,
+	urgency_rule_author,
+	urgency_rule_title,
+	urgency_rule_tags_include,
+	urgency_rule_tags_exclude
+)
+SELECT
+	urgency_rule_id,
+	urgency_rule_version,
+	urgency_rule_added_utc,
+	urgency_rule_author,
+	urgency_rule_title,
+	urgency_rule_tags_include,
+	urgency_rule_tags_exclude
+FROM urgency_rules
+ON CONFLICT DO NOTHING;
+
+-- Version of the rules a message was checked with, if it is stored in the
+-- compact format. NULL for messages stored in the full format.
+ALTER TABLE inbounds_ud ADD COLUMN IF NOT EXISTS urgency_rule_version bigint;
+
+-- Matched rules of an inbound message, with their ID, title and keywords as
+-- returned by /inbound/check, in either storage format. E.g.
+-- `SELECT inbound_matched_rules(urgency_score, urgency_rule_version) FROM inbounds_ud`
+CREATE OR REPLACE FUNCTION inbound_matched_rules(
+	stored_urgency_score jsonb,
+	rule_set_version bigint
+) RETURNS jsonb AS $$
+	SELECT CASE WHEN rule_set_version IS NULL THEN stored_urgency_score ELSE (
+		SELECT COALESCE(
+			jsonb_agg(
+				jsonb_build_object(
+					'rule_id', rule_version.urgency_rule_id,
+					'title', rule_version.urgency_rule_title,
+					'include', to_jsonb(lower(rule_version.urgency_rule_tags_include::text)::text []),
+					'exclude', to_jsonb(lower(rule_version.urgency_rule_tags_exclude::text)::text [])
+				)
+				ORDER BY matched.position
+			),
+			'[]'
+		)
+		FROM unnest(inbound_matched_rule_ids(stored_urgency_score))
+			WITH ORDINALITY AS matched (rule_id, position)
+		CROSS JOIN LATERAL (
+			SELECT * FROM urgency_rules_history
+			WHERE urgency_rules_history.urgency_rule_id = matched.rule_id
+				AND urgency_rules_history.urgency_rule_version <= rule_set_version
+			ORDER BY urgency_rules_history.urgency_rule_version DESC
+			LIMIT 1
+		) AS rule_version
+	) END
+$$ LANGUAGE sql STABLE;
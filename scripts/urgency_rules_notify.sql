@@ -0,0 +1,13 @@
+-- Notify listening app workers whenever urgency rules change.
+-- Safe to re-run on an existing database.
+CREATE OR REPLACE FUNCTION notify_urgency_rules_changed() RETURNS trigger AS $$
+BEGIN
+	PERFORM pg_notify('urgency_rules_changed', '');
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS urgency_rules_changed ON urgency_rules;
+CREATE TRIGGER urgency_rules_changed
+	AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON urgency_rules
+	FOR EACH STATEMENT EXECUTE FUNCTION notify_urgency_rules_changed();
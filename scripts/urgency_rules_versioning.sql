@@ -0,0 +1,58 @@
+-- Track a version for every change to urgency rules, and keep tombstones of
+-- deleted rules, so that app workers can refresh only the rules that changed.
+-- Safe to re-run on an existing database.
+CREATE SEQUENCE IF NOT EXISTS urgency_rules_version_seq;
+
+ALTER TABLE urgency_rules
+	ADD COLUMN IF NOT EXISTS urgency_rule_version bigint NOT NULL
+	DEFAULT nextval('urgency_rules_version_seq');
+
+CREATE INDEX IF NOT EXISTS urgency_rules_version_idx
+	ON urgency_rules (urgency_rule_version);
+
+CREATE TABLE IF NOT EXISTS urgency_rules_deleted (
+	urgency_rule_deleted_id serial NOT NULL,
+	urgency_rule_id integer,
+	urgency_rule_version bigint NOT NULL DEFAULT nextval('urgency_rules_version_seq'),
+	urgency_rule_deleted_utc timestamp without time zone NOT NULL DEFAULT (now() at time zone 'utc'),
+	PRIMARY KEY (urgency_rule_deleted_id)
+);
+
+CREATE INDEX IF NOT EXISTS urgency_rules_deleted_version_idx
+	ON urgency_rules_deleted (urgency_rule_version);
+
+-- Give updated rules a new version
+CREATE OR REPLACE FUNCTION set_urgency_rule_version() RETURNS trigger AS $$
+BEGIN
+	NEW.urgency_rule_version := nextval('urgency_rules_version_seq');
+	RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS urgency_rules_set_version ON urgency_rules;
+CREATE TRIGGER urgency_rules_set_version
+	BEFORE UPDATE ON urgency_rules
+	FOR EACH ROW EXECUTE FUNCTION set_urgency_rule_version();
+
+-- Record deleted rules. TRUNCATE is recorded with a NULL rule ID, which makes
+-- workers fall back to a full refresh.
+CREATE OR REPLACE FUNCTION record_urgency_rule_deletion() RETURNS trigger AS $$
+BEGIN
+	IF TG_OP = 'TRUNCATE' THEN
+		INSERT INTO urgency_rules_deleted (urgency_rule_id) VALUES (NULL);
+	ELSE
+		INSERT INTO urgency_rules_deleted (urgency_rule_id) VALUES (OLD.urgency_rule_id);
+	END IF;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS urgency_rules_record_deletion ON urgency_rules;
+CREATE TRIGGER urgency_rules_record_deletion
+	AFTER DELETE ON urgency_rules
+	FOR EACH ROW EXECUTE FUNCTION record_urgency_rule_deletion();
+
+DROP TRIGGER IF EXISTS urgency_rules_record_truncation ON urgency_rules;
+CREATE TRIGGER urgency_rules_record_truncation
+	AFTER TRUNCATE ON urgency_rules
+	FOR EACH STATEMENT EXECUTE FUNCTION record_urgency_rule_deletion();
@@ -0,0 +1,66 @@
+import pytest
+
+from core_model.app.src.cache import CachedSpellChecker, LRUCache
+
+
+class FakeSpellChecker:
+    def __init__(self):
+        self.n_calls = 0
+        self.custom_spell_correct_map = {"virginia": "vagina"}
+
+    def spell(self, word):
+        self.n_calls += 1
+        return word not in self.custom_spell_correct_map
+
+    def suggest(self, word):
+        self.n_calls += 1
+        return [self.custom_spell_correct_map.get(word, word)]
+
+
+class TestLRUCache:
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+        assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+    def test_expired_entries_are_misses(self, monkeypatch):
+        now = 1000.0
+        monkeypatch.setattr("core_model.app.src.cache.time.monotonic", lambda: now)
+        cache = LRUCache(maxsize=2, ttl=10)
+        cache.put("a", 1)
+
+        now += 5
+        assert cache.get("a") == 1
+        now += 10
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_invalid_maxsize(self):
+        with pytest.raises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class TestCachedSpellChecker:
+    def test_repeated_tokens_are_cached(self):
+        spell_checker = FakeSpellChecker()
+        cached = CachedSpellChecker(spell_checker, LRUCache(maxsize=10))
+
+        for _ in range(3):
+            assert cached.spell("virginia") is False
+            assert cached.suggest("virginia") == ("vagina",)
+
+        assert spell_checker.n_calls == 2
+        assert cached.cache.hits == 4
+
+    def test_other_attributes_are_delegated(self):
+        cached = CachedSpellChecker(FakeSpellChecker(), LRUCache(maxsize=10))
+
+        assert cached.custom_spell_correct_map == {"virginia": "vagina"}
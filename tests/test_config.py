@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+
+import pytest
+
+from core_model.app import create_app, rebuild_text_preprocessor
+from core_model.app.database_sqlalchemy import db
+from core_model.app.src.utils import YamlConfig, get_parameters, reload_yaml_configs
+
+headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+
+
+class TestYamlConfig:
+    @pytest.fixture
+    def config_path(self, tmp_path):
+        path = tmp_path / "parameters.yml"
+        path.write_text(
+            "preprocessing:\n"
+            "  ngram_max: 2\n"
+            "  enabled: true\n"
+            "  words: [hike, swim]\n"
+        )
+        return path
+
+    def update(self, path, text):
+        path.write_text(text)
+        # Make sure the change is seen even on filesystems with coarse mtimes
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_typed_accessors(self, config_path):
+        config = YamlConfig(config_path)
+
+        assert config.get_int("preprocessing", "ngram_max") == 2
+        assert config.get_float("preprocessing", "ngram_max") == 2.0
+        assert config.get_bool("preprocessing", "enabled") is True
+        assert config.get_list("preprocessing", "words") == ["hike", "swim"]
+        with pytest.raises(TypeError):
+            config.get_int("preprocessing", "enabled")
+        with pytest.raises(TypeError):
+            config.get_str("preprocessing", "words")
+
+    def test_values_are_copied(self, config_path):
+        config = YamlConfig(config_path)
+        config.get_list("preprocessing", "words").append("run")
+        config.data["preprocessing"].clear()
+
+        assert config.get_list("preprocessing", "words") == ["hike", "swim"]
+
+    def test_file_is_only_read_on_reload(self, config_path):
+        config = YamlConfig(config_path)
+        hook_calls = []
+        config.add_reload_hook(lambda: hook_calls.append(True))
+
+        assert config.reload() is False
+        self.update(config_path, "preprocessing:\n  ngram_max: 3\n")
+        assert config.get_int("preprocessing", "ngram_max") == 2
+        assert hook_calls == []
+
+        assert config.reload() is True
+        assert config.get_int("preprocessing", "ngram_max") == 3
+        assert hook_calls == [True]
+
+        assert config.reload(force=True) is True
+        assert hook_calls == [True, True]
+
+
+class TestPreprocessorReload:
+    def test_rebuild_text_preprocessor(self, test_params):
+        app = create_app(test_params)
+        app.config["RULE_REFRESH_FREQ"] = 0
+        preprocess_text = app.preprocess_text
+
+        rebuild_text_preprocessor(app)
+
+        assert app.preprocess_text is not preprocess_text
+        assert app.rule_set.evaluator.preprocessor is app.preprocess_text
+
+    def test_reload_config_endpoint(self, client):
+        response = client.get("/internal/reload-config", headers=headers)
+
+        assert response.status_code == 200
+        assert response.data == b"No config files changed"
+
+
+def check_after_reload(app, ready, reloaded, result):
+    """
+    Run in a forked worker: send a request once the parent has reloaded the
+    config, and report whether the preprocessor was rebuilt
+    """
+    with app.app_context():
+        db.engine.dispose()
+    preprocess_text = app.preprocess_text
+    ready.set()
+    reloaded.wait(30)
+    app.test_client().get("/healthcheck")
+    result.put(app.preprocess_text is not preprocess_text)
+
+
+class TestConfigReloadAcrossWorkers:
+    @pytest.fixture
+    def touch_parameters(self):
+        path = get_parameters().path
+        stat = os.stat(path)
+
+        def touch():
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        yield touch
+
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        reload_yaml_configs()
+
+    @pytest.fixture
+    def worker_apps(self, test_params):
+        apps = [create_app(test_params) for _ in range(2)]
+        for app in apps:
+            app.config["RULE_REFRESH_FREQ"] = 0
+        return apps
+
+    def test_reload_reaches_other_apps(self, worker_apps, touch_parameters):
+        app, other_app = worker_apps
+        preprocess_text = other_app.preprocess_text
+
+        touch_parameters()
+        response = app.test_client().get("/internal/reload-config", headers=headers)
+        assert response.data == b"Reloaded parameters.yml"
+        assert other_app.preprocess_text is preprocess_text
+
+        other_app.test_client().get("/healthcheck")
+        assert other_app.preprocess_text is not preprocess_text
+
+    def test_reload_reaches_forked_workers(self, worker_apps, touch_parameters):
+        # The forked worker has its own copy of the parsed config files, like
+        # a gunicorn worker forked from a preloaded master
+        app = worker_apps[0]
+        context = multiprocessing.get_context("fork")
+        ready, reloaded, result = context.Event(), context.Event(), context.Queue()
+        worker = context.Process(
+            target=check_after_reload, args=(app, ready, reloaded, result)
+        )
+        worker.start()
+        try:
+            assert ready.wait(30)
+            touch_parameters()
+            app.test_client().get("/internal/reload-config", headers=headers)
+            reloaded.set()
+
+            assert result.get(timeout=60) is True
+        finally:
+            worker.join(30)
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+from benchmarks.import_time import parse_import_times, slowest_packages
+
+IMPORT_TIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 |     json.decoder
+import time:       300 |        400 |   json
+import time:        50 |         50 |   yaml
+import time:       200 |        650 | core_model.app
+"""
+
+
+class TestImportTime:
+    def test_parse_import_times(self):
+        imports = parse_import_times(IMPORT_TIME_OUTPUT)
+
+        assert [entry["module"] for entry in imports] == [
+            "json.decoder",
+            "json",
+            "yaml",
+            "core_model.app",
+        ]
+        assert [entry["depth"] for entry in imports] == [2, 1, 1, 0]
+        assert imports[1]["cumulative_seconds"] == 400e-6
+
+    def test_slowest_packages(self):
+        imports = parse_import_times(IMPORT_TIME_OUTPUT)
+
+        assert slowest_packages(imports, 1) == [("json", 400e-6)]
+
+    def test_app_does_not_import_pandas(self):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, core_model.app; print('pandas' in sys.modules)",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "False"
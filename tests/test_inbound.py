@@ -1,11 +1,13 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
 import pytest
 from sqlalchemy import text
 
 from core_model import app
-from core_model.app import refresh_rule_based_model
+from core_model.app import create_app, refresh_rule_based_model
+from core_model.app.data_models import Inbound
 
 insert_rule = (
     "INSERT INTO urgency_rules ("
@@ -101,6 +103,368 @@ class TestInboundMessage:
         assert len(json_data["matched_urgency_rules"]) == 0
 
 
+class TestConcurrentInbound:
+    def test_concurrent_requests_match_serial_results(self, test_params, ud_rule_data):
+        app = create_app(test_params)
+        messages = [
+            "I love going hiking or rock climbing in the lake",
+            "I love rocking a melody on my guitar by the lake after a hike",
+            "I like to hike rocks by the lake",
+            "I love the melody of the guitar",
+        ] * 10
+
+        def matched_titles(message):
+            with app.test_client() as thread_client:
+                response = thread_client.post(
+                    "/inbound/check", json={"text_to_match": message}, headers=headers
+                )
+            assert response.status_code == 200
+            return {x["title"] for x in response.get_json()["matched_urgency_rules"]}
+
+        serial_results = [matched_titles(message) for message in messages]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            concurrent_results = list(executor.map(matched_titles, messages))
+
+        assert concurrent_results == serial_results
+
+
+class TestInboundBatch:
+    def test_batch_returns_results_in_order(self, client, ud_rule_data):
+        request_data = {
+            "messages": [
+                {"text_to_match": "I love going hiking or rock climbing in the lake"},
+                {
+                    "text_to_match": "I like to hike rocks by the lake",
+                    "metadata": {"phone_number": "+12125551234"},
+                },
+                {"text_to_match": "I love the melody of the guitar"},
+            ]
+        }
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        results = response.get_json()["results"]
+
+        matched_rule_titles = [
+            {x["title"] for x in result["matched_urgency_rules"]} for result in results
+        ]
+        assert matched_rule_titles == [{"hiking"}, {"hiking", "no_love"}, set()]
+        assert [result["urgency_score"] for result in results] == [1.0, 1.0, 0.0]
+
+        inbound_ids = [result["inbound_id"] for result in results]
+        assert len(set(inbound_ids)) == 3
+        assert all("feedback_secret_key" in result for result in results)
+
+    def test_batch_inbounds_are_stored(self, client, ud_rule_data, db_engine):
+        request_data = {
+            "messages": [
+                {"text_to_match": "I like to hike rocks by the lake"},
+                {"text_to_match": "I love the melody of the guitar"},
+            ]
+        }
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        results = response.get_json()["results"]
+
+        with db_engine.connect() as db_connection:
+            rows = db_connection.execute(
+                text(
+                    "SELECT inbound_id, feedback_secret_key FROM inbounds_ud "
+                    "WHERE inbound_id IN :ids"
+                ),
+                ids=tuple(result["inbound_id"] for result in results),
+            ).fetchall()
+
+        assert {tuple(row) for row in rows} == {
+            (result["inbound_id"], result["feedback_secret_key"]) for result in results
+        }
+
+    def test_batch_without_messages_fails(self, client):
+        response = client.post(
+            "/inbound/check-batch", json={"messages": []}, headers=headers
+        )
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "request_data",
+        [
+            ["hello"],
+            {"messages": "hello"},
+            {"messages": {"text_to_match": "hello"}},
+            {"messages": ["hello"]},
+            {"messages": [{"text_to_match": "hello"}, {"metadata": {}}]},
+            {"messages": [{"text_to_match": 1}]},
+        ],
+    )
+    def test_batch_with_invalid_messages_fails(self, client, request_data):
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        assert response.status_code == 400
+
+    def test_batch_over_max_size_fails(self, client):
+        max_size = client.application.config["INBOUND_BATCH_MAX_SIZE"]
+        request_data = {
+            "messages": [{"text_to_match": "hello"} for _ in range(max_size + 1)]
+        }
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        assert response.status_code == 413
+
+
+class TestInboundStorage:
+    def test_inbounds_are_filtered_by_matched_rule(self, client, ud_rule_data):
+        request_data = {
+            "messages": [
+                {"text_to_match": "I like to hike rocks by the lake"},
+                {"text_to_match": "I love the melody of the guitar"},
+            ]
+        }
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        results = response.get_json()["results"]
+        inbound_ids = [result["inbound_id"] for result in results]
+        hiking_rule_id = next(
+            rule["rule_id"]
+            for rule in results[0]["matched_urgency_rules"]
+            if rule["title"] == "hiking"
+        )
+
+        with client.application.app_context():
+            matched_ids = {
+                inbound.inbound_id
+                for inbound in Inbound.query.filter(
+                    Inbound.inbound_id.in_(inbound_ids),
+                    Inbound.matched_rule_ids.contains([hiking_rule_id]),
+                )
+            }
+            stored_rule_ids = Inbound.query.get(inbound_ids[0]).matched_rule_ids
+
+        assert matched_ids == {inbound_ids[0]}
+        assert sorted(stored_rule_ids) == sorted(
+            rule["rule_id"] for rule in results[0]["matched_urgency_rules"]
+        )
+
+    def test_json_columns_are_jsonb(self, db_engine):
+        with db_engine.connect() as db_connection:
+            column_types = dict(
+                db_connection.execute(
+                    text(
+                        "SELECT column_name, data_type "
+                        "FROM information_schema.columns "
+                        "WHERE table_name = 'inbounds_ud' AND column_name IN ("
+                        "'inbound_metadata', 'urgency_score', "
+                        "'returned_content', 'returned_feedback')"
+                    )
+                ).fetchall()
+            )
+
+        assert set(column_types.values()) == {"jsonb"}
+
+
+class TestInboundCompactStorage:
+    @pytest.fixture(params=["sync", "write_behind"])
+    def compact_app(self, request, test_params, ud_rule_data):
+        compact_app = create_app(
+            {
+                **test_params,
+                "INBOUND_STORAGE_FORMAT": "compact",
+                "INBOUND_WRITE_MODE": request.param,
+                "INBOUND_WRITE_FLUSH_INTERVAL": 0.1,
+            }
+        )
+        compact_app.config["RULE_REFRESH_FREQ"] = 0
+        refresh_rule_based_model(compact_app)
+        yield compact_app
+
+        if compact_app.inbound_writer is not None:
+            compact_app.inbound_writer.stop()
+
+    def check_messages(self, app, messages):
+        client = app.test_client()
+        single = client.post(
+            "/inbound/check", json={"text_to_match": messages[0]}, headers=headers
+        ).get_json()
+        batch = client.post(
+            "/inbound/check-batch",
+            json={"messages": [{"text_to_match": m} for m in messages[1:]]},
+            headers=headers,
+        ).get_json()["results"]
+        if app.inbound_writer is not None:
+            app.inbound_writer.stop()
+        return [single] + batch
+
+    def stored_inbounds(self, db_engine, inbound_ids):
+        with db_engine.connect() as db_connection:
+            rows = db_connection.execute(
+                text(
+                    "SELECT inbound_id, urgency_score, returned_content, "
+                    "urgency_rule_version, "
+                    "inbound_matched_rules(urgency_score, urgency_rule_version) "
+                    "FROM inbounds_ud WHERE inbound_id IN :ids"
+                ),
+                ids=tuple(inbound_ids),
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def test_matched_rule_ids_are_stored(self, compact_app, db_engine):
+        results = self.check_messages(
+            compact_app,
+            ["I like to hike rocks by the lake", "I love the guitar", "hello"],
+        )
+
+        stored = self.stored_inbounds(db_engine, [r["inbound_id"] for r in results])
+
+        for result in results:
+            urgency_score, returned_content, rule_version, matched_rules = stored[
+                result["inbound_id"]
+            ]
+            assert urgency_score == [
+                rule["rule_id"] for rule in result["matched_urgency_rules"]
+            ]
+            assert returned_content == {"urgency_score": result["urgency_score"]}
+            assert rule_version == compact_app.rule_set.rules_version
+            assert matched_rules == result["matched_urgency_rules"]
+
+    def test_matched_rules_keep_their_version(self, compact_app, db_engine):
+        results = self.check_messages(
+            compact_app, ["I like to hike rocks by the lake", "I love the guitar"]
+        )
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text(
+                    "UPDATE urgency_rules SET urgency_rule_title = 'renamed' "
+                    "WHERE urgency_rule_author = 'Pytest author'"
+                )
+            )
+
+        stored = self.stored_inbounds(db_engine, [r["inbound_id"] for r in results])
+
+        for result in results:
+            assert stored[result["inbound_id"]][3] == result["matched_urgency_rules"]
+
+    def test_full_format_is_stored_by_default(self, client, ud_rule_data, db_engine):
+        result = client.post(
+            "/inbound/check",
+            json={"text_to_match": "I like to hike rocks by the lake"},
+            headers=headers,
+        ).get_json()
+
+        stored = self.stored_inbounds(db_engine, [result["inbound_id"]])
+
+        urgency_score, returned_content, rule_version, matched_rules = stored[
+            result["inbound_id"]
+        ]
+        assert urgency_score == result["matched_urgency_rules"]
+        assert rule_version is None
+        assert matched_rules == urgency_score
+
+
+class TestInboundTokens:
+    @pytest.fixture(params=["sync", "write_behind"])
+    def tokens_app(self, request, test_params, ud_rule_data, db_engine):
+        tokens_app = create_app(
+            {
+                **test_params,
+                "INBOUND_SAVE_TOKENS": "true",
+                "INBOUND_WRITE_MODE": request.param,
+                "INBOUND_WRITE_FLUSH_INTERVAL": 0.1,
+            }
+        )
+        tokens_app.config["RULE_REFRESH_FREQ"] = 0
+        refresh_rule_based_model(tokens_app)
+        yield tokens_app
+
+        with db_engine.connect() as db_connection:
+            db_connection.execute(text("DELETE FROM inbound_tokens"))
+
+    def saved_tokens(self, db_engine, inbound_ids):
+        with db_engine.connect() as db_connection:
+            rows = db_connection.execute(
+                text(
+                    "SELECT inbound_id, preprocessor_version, inbound_tokens "
+                    "FROM inbound_tokens WHERE inbound_id IN :ids"
+                ),
+                ids=tuple(inbound_ids),
+            ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def test_tokens_are_saved(self, tokens_app, db_engine):
+        client = tokens_app.test_client()
+        messages = ["I like to hike rocks by the lake", "I love the guitar"]
+
+        single = client.post(
+            "/inbound/check", json={"text_to_match": messages[0]}, headers=headers
+        ).get_json()
+        batch = client.post(
+            "/inbound/check-batch",
+            json={"messages": [{"text_to_match": m} for m in messages]},
+            headers=headers,
+        ).get_json()["results"]
+        if tokens_app.inbound_writer is not None:
+            tokens_app.inbound_writer.stop()
+
+        inbound_ids = [single["inbound_id"]] + [r["inbound_id"] for r in batch]
+        expected = [tokens_app.preprocess_text(m) for m in messages[:1] + messages]
+        saved = self.saved_tokens(db_engine, inbound_ids)
+
+        assert [saved[inbound_id] for inbound_id in inbound_ids] == [
+            (tokens_app.preprocessor_version, tokens) for tokens in expected
+        ]
+
+    def test_tokens_are_not_saved_by_default(self, client, ud_rule_data, db_engine):
+        response = client.post(
+            "/inbound/check", json={"text_to_match": "I love hiking"}, headers=headers
+        )
+
+        assert self.saved_tokens(db_engine, [response.get_json()["inbound_id"]]) == {}
+
+
+class TestInboundMessageCache:
+    @pytest.fixture(scope="class")
+    def client_with_cache(self, test_params):
+        cache_app = create_app({**test_params, "INBOUND_CACHE_SIZE": 100})
+        cache_app.config["RULE_REFRESH_FREQ"] = 0
+        with cache_app.test_client() as client:
+            yield client
+
+    def test_repeated_message_uses_cache(self, client_with_cache, ud_rule_data):
+        client_with_cache.get("/internal/refresh-rules", headers=headers)
+        message_cache = client_with_cache.application.message_cache
+
+        first = client_with_cache.post(
+            "/inbound/check",
+            json={"text_to_match": "I like to hike rocks by the lake"},
+            headers=headers,
+        ).get_json()
+        second = client_with_cache.post(
+            "/inbound/check",
+            json={"text_to_match": "I like to hike  ROCKS by the lake"},
+            headers=headers,
+        ).get_json()
+
+        assert message_cache.hits == 1
+        assert second["matched_urgency_rules"] == first["matched_urgency_rules"]
+        assert second["urgency_score"] == first["urgency_score"]
+        assert second["inbound_id"] != first["inbound_id"]
+        assert second["feedback_secret_key"] != first["feedback_secret_key"]
+
+    def test_refresh_invalidates_cache(self, client_with_cache, ud_rule_data):
+        client_with_cache.get("/internal/refresh-rules", headers=headers)
+        message_cache = client_with_cache.application.message_cache
+        request_data = {"text_to_match": "I love the melody of the guitar"}
+
+        client_with_cache.post("/inbound/check", json=request_data, headers=headers)
+        client_with_cache.get("/internal/refresh-rules", headers=headers)
+        hits_before = message_cache.hits
+        client_with_cache.post("/inbound/check", json=request_data, headers=headers)
+
+        assert message_cache.hits == hits_before
+
+
 @pytest.mark.slow
 class TestInboundFeedback:
     headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
@@ -169,6 +533,127 @@ class TestInboundFeedback:
         assert response.status_code == 200
         assert response.data == b"Success"
 
+    def test_inbound_feedback_missing_feedback(
+        self, inbounds, inbound_id, client, db_engine
+    ):
+        before = self.get_feedback(db_engine, inbound_id)
+        request_data = {"inbound_id": inbound_id, "feedback_secret_key": "abc123"}
+
+        response = client.put("/inbound/feedback", json=request_data, headers=headers)
+
+        assert response.status_code == 400
+        assert self.get_feedback(db_engine, inbound_id) == before
+
+    def get_feedback(self, db_engine, inbound_id):
+        with db_engine.connect() as db_connection:
+            return db_connection.execute(
+                text(
+                    "SELECT returned_feedback FROM inbounds_ud "
+                    "WHERE inbound_id = :inbound_id"
+                ),
+                inbound_id=inbound_id,
+            ).scalar()
+
+    def test_inbound_feedback_concurrent_appends(
+        self, inbounds, inbound_id, client, db_engine
+    ):
+        before = self.get_feedback(db_engine, inbound_id) or []
+
+        def send_feedback(i):
+            request_data = {
+                "inbound_id": inbound_id,
+                "feedback_secret_key": "abc123",
+                "feedback": {"concurrent": i},
+            }
+            return client.put(
+                "/inbound/feedback", json=request_data, headers=headers
+            ).status_code
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            statuses = list(executor.map(send_feedback, range(10)))
+
+        assert statuses == [200] * 10
+        after = self.get_feedback(db_engine, inbound_id)
+        assert after[: len(before)] == before
+        assert sorted(item["concurrent"] for item in after[len(before) :]) == list(
+            range(10)
+        )
+
+    def test_inbound_feedback_batch(self, inbounds, inbound_id, client, db_engine):
+        before = self.get_feedback(db_engine, inbound_id) or []
+        request_data = {
+            "feedback": [
+                {
+                    "inbound_id": inbound_id,
+                    "feedback_secret_key": "abc123",
+                    "feedback": "a",
+                },
+                {"inbound_id": 0, "feedback_secret_key": "abc123", "feedback": "b"},
+                {
+                    "inbound_id": inbound_id,
+                    "feedback_secret_key": "wrong",
+                    "feedback": "c",
+                },
+                {
+                    "inbound_id": inbound_id,
+                    "feedback_secret_key": "abc123",
+                    "feedback": "d",
+                },
+            ]
+        }
+
+        response = client.put(
+            "/inbound/feedback-batch", json=request_data, headers=headers
+        )
+
+        assert response.status_code == 200
+        assert [result["status"] for result in response.json["results"]] == [
+            200,
+            404,
+            403,
+            200,
+        ]
+        assert response.json["results"][2]["message"] == "Incorrect Feedback Secret Key"
+        assert self.get_feedback(db_engine, inbound_id) == before + ["a", "d"]
+
+    def test_inbound_feedback_batch_incomplete_items(
+        self, inbounds, inbound_id, client, db_engine
+    ):
+        before = self.get_feedback(db_engine, inbound_id) or []
+        request_data = {
+            "feedback": [
+                {"inbound_id": inbound_id, "feedback_secret_key": "abc123"},
+                "not an item",
+                {
+                    "inbound_id": inbound_id,
+                    "feedback_secret_key": "abc123",
+                    "feedback": "e",
+                },
+            ]
+        }
+
+        response = client.put(
+            "/inbound/feedback-batch", json=request_data, headers=headers
+        )
+
+        assert response.status_code == 200
+        assert [result["status"] for result in response.json["results"]] == [
+            400,
+            400,
+            200,
+        ]
+        assert self.get_feedback(db_engine, inbound_id) == before + ["e"]
+
+    @pytest.mark.parametrize(
+        "request_data,status_code",
+        [({}, 400), ({"feedback": []}, 400), ({"feedback": "a"}, 400), ([], 400)],
+    )
+    def test_inbound_feedback_batch_empty(self, client, request_data, status_code):
+        response = client.put(
+            "/inbound/feedback-batch", json=request_data, headers=headers
+        )
+        assert response.status_code == status_code
+
 
 class TestInboundCachedRefreshes:
     @pytest.mark.parametrize(
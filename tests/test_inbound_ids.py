@@ -0,0 +1,71 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import sqlalchemy
+
+from core_model.app import get_config_data
+from core_model.app.inbound_ids import InboundIdAllocator
+
+
+def allocate_in_worker(args):
+    """Simulate a gunicorn worker with its own engine and allocator"""
+    uri, block_size, n_requests = args
+    engine = sqlalchemy.create_engine(uri)
+    allocator = InboundIdAllocator(block_size, get_engine=lambda: engine)
+
+    def request(i):
+        return allocator.allocate(1 + i % 3)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        ids = [x for batch in executor.map(request, range(n_requests)) for x in batch]
+
+    engine.dispose()
+    return ids
+
+
+class TestInboundIdAllocator:
+    @pytest.fixture(scope="class")
+    def uri(self, test_params):
+        return get_config_data(test_params)["SQLALCHEMY_DATABASE_URI"]
+
+    def test_ids_unique_across_concurrent_workers(self, uri):
+        n_workers = 8
+        n_requests = 200
+        block_size = 7
+
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(n_workers) as pool:
+            worker_ids = pool.map(
+                allocate_in_worker, [(uri, block_size, n_requests)] * n_workers
+            )
+
+        all_ids = [x for ids in worker_ids for x in ids]
+        expected_per_worker = sum(1 + i % 3 for i in range(n_requests))
+        assert all(len(ids) == expected_per_worker for ids in worker_ids)
+        assert len(set(all_ids)) == len(all_ids)
+
+    def test_ids_reserved_in_blocks(self, db_engine):
+        allocator = InboundIdAllocator(10, get_engine=lambda: db_engine)
+        reserved = []
+        allocator._reserve = lambda n: reserved.append(n) or list(range(n))
+
+        allocator.allocate(3)
+        allocator.allocate(7)
+        allocator.allocate(12)
+
+        assert reserved == [10, 12]
+
+    def test_block_discarded_after_fork(self, db_engine):
+        allocator = InboundIdAllocator(10, get_engine=lambda: db_engine)
+        allocator.allocate(1)
+        allocator._pid = -1
+
+        first_id = allocator.allocate(1)[0]
+
+        assert len(allocator._ids) == 9
+        assert first_id not in allocator._ids
+
+    def test_invalid_block_size(self):
+        with pytest.raises(ValueError):
+            InboundIdAllocator(0)
@@ -0,0 +1,171 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import text
+
+from core_model.app import create_app, inbound_partitions
+from core_model.app.inbound_partitions import (
+    add_months,
+    apply_inbound_retention,
+    create_inbound_partitions,
+    list_inbound_partitions,
+)
+
+insert_inbound = (
+    "INSERT INTO inbounds_ud (feedback_secret_key, inbound_text, inbound_utc, "
+    "urgency_score, returned_content, returned_utc) "
+    "VALUES ('abc123', 'old message', :utc, '[]', '{}', :utc) "
+    "RETURNING inbound_id"
+)
+insert_tokens = (
+    "INSERT INTO inbound_tokens (inbound_id, preprocessor_version, inbound_tokens) "
+    "VALUES (:inbound_id, 'test', '{old, messag}')"
+)
+
+
+@pytest.mark.parametrize(
+    "month, n_months, expected",
+    [
+        (date(2023, 5, 17), 0, date(2023, 5, 1)),
+        (date(2023, 11, 1), 3, date(2024, 2, 1)),
+        (date(2023, 1, 31), -1, date(2022, 12, 1)),
+        (date(2023, 5, 1), -17, date(2021, 12, 1)),
+    ],
+)
+def test_add_months(month, n_months, expected):
+    assert add_months(month, n_months) == expected
+
+
+class TestInboundPartitions:
+    @pytest.fixture
+    def old_inbound_id(self, db_engine):
+        with db_engine.begin() as db_connection:
+            inbound_id = db_connection.execute(
+                text(insert_inbound), utc=datetime(2001, 3, 10)
+            ).scalar()
+            db_connection.execute(text(insert_tokens), inbound_id=inbound_id)
+
+        yield inbound_id
+
+        with db_engine.begin() as db_connection:
+            db_connection.execute(
+                text("DELETE FROM inbound_tokens WHERE inbound_id = :inbound_id"),
+                inbound_id=inbound_id,
+            )
+            db_connection.execute(
+                text("DELETE FROM inbounds_ud WHERE inbound_id = :inbound_id"),
+                inbound_id=inbound_id,
+            )
+            for table in ["inbounds_ud_2001_03", "test_archive.inbounds_ud_2001_03"]:
+                db_connection.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            db_connection.execute(text("DROP SCHEMA IF EXISTS test_archive"))
+
+    def get_partition_of(self, db_engine, inbound_id):
+        with db_engine.connect() as db_connection:
+            return db_connection.execute(
+                text(
+                    "SELECT tableoid::regclass::text FROM inbounds_ud "
+                    "WHERE inbound_id = :inbound_id"
+                ),
+                inbound_id=inbound_id,
+            ).scalar()
+
+    def test_partitions_are_not_created_at_startup_by_default(
+        self, test_params, monkeypatch
+    ):
+        calls = []
+        monkeypatch.setattr(
+            inbound_partitions,
+            "create_upcoming_inbound_partitions",
+            lambda *args: calls.append(args),
+        )
+
+        create_app(test_params)
+
+        assert calls == []
+
+    def test_upcoming_partitions_are_created_at_startup(self, test_params, db_engine):
+        app = create_app({**test_params, "INBOUND_PARTITIONS_AHEAD": 5})
+        this_month = datetime.utcnow().date().replace(day=1)
+        expected_months = {
+            datetime.combine(add_months(this_month, i), datetime.min.time())
+            for i in range(app.config["INBOUND_PARTITIONS_AHEAD"] + 1)
+        }
+
+        with db_engine.connect() as db_connection:
+            partitions = list_inbound_partitions(db_connection)
+
+        assert expected_months <= {partition.start_utc for partition in partitions}
+
+    def test_new_partition_takes_rows_from_default(self, db_engine, old_inbound_id):
+        assert self.get_partition_of(db_engine, old_inbound_id) == "inbounds_ud_default"
+
+        created = create_inbound_partitions(
+            db_engine, date(2001, 3, 1), date(2001, 3, 1)
+        )
+
+        assert created == ["inbounds_ud_2001_03"]
+        assert self.get_partition_of(db_engine, old_inbound_id) == "inbounds_ud_2001_03"
+        assert (
+            create_inbound_partitions(db_engine, date(2001, 3, 1), date(2001, 3, 1))
+            == []
+        )
+
+    def test_new_partition_blocks_default_inserts_until_attached(
+        self, db_engine, old_inbound_id
+    ):
+        with db_engine.begin() as db_connection:
+            db_connection.execute(
+                text("SELECT create_inbound_partitions('2001-03-01', '2001-03-01')")
+            )
+            lock_modes = {
+                row[0]
+                for row in db_connection.execute(
+                    text(
+                        "SELECT mode FROM pg_locks "
+                        "WHERE relation = 'inbounds_ud_default'::regclass "
+                        "AND pid = pg_backend_pid()"
+                    )
+                )
+            }
+
+        assert "ShareRowExclusiveLock" in lock_modes
+
+    @pytest.mark.parametrize(
+        "mode, remaining_table",
+        [
+            ("detach", "inbounds_ud_2001_03"),
+            ("archive", "test_archive.inbounds_ud_2001_03"),
+            ("drop", None),
+        ],
+    )
+    def test_retention_removes_old_partitions(
+        self, db_engine, old_inbound_id, mode, remaining_table
+    ):
+        create_inbound_partitions(db_engine, date(2001, 3, 1), date(2001, 3, 1))
+
+        removed = apply_inbound_retention(
+            db_engine, datetime(2001, 4, 1), mode, archive_schema="test_archive"
+        )
+
+        assert [partition.name for partition in removed] == ["inbounds_ud_2001_03"]
+        assert self.get_partition_of(db_engine, old_inbound_id) is None
+        with db_engine.connect() as db_connection:
+            n_tokens = db_connection.execute(
+                text("SELECT count(*) FROM inbound_tokens WHERE inbound_id = :id"),
+                id=old_inbound_id,
+            ).scalar()
+            table = db_connection.execute(
+                text("SELECT to_regclass(:table)::text"),
+                table=remaining_table or "inbounds_ud_2001_03",
+            ).scalar()
+        assert n_tokens == 0
+        assert table == remaining_table
+
+    def test_retention_keeps_newer_partitions(self, db_engine, old_inbound_id):
+        create_inbound_partitions(db_engine, date(2001, 3, 1), date(2001, 3, 1))
+
+        removed = apply_inbound_retention(db_engine, datetime(2001, 3, 31), "drop")
+
+        assert removed == []
+        assert self.get_partition_of(db_engine, old_inbound_id) == "inbounds_ud_2001_03"
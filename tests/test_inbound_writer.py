@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from sqlalchemy import text
+
+from core_model.app import create_app, refresh_rule_based_model
+
+headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+
+
+class TestInboundWriteBehind:
+    @pytest.fixture(scope="class")
+    def write_behind_app(self, test_params):
+        app = create_app(
+            {
+                **test_params,
+                "INBOUND_WRITE_MODE": "write_behind",
+                "INBOUND_WRITE_FLUSH_INTERVAL": 0.1,
+            }
+        )
+        app.config["RULE_REFRESH_FREQ"] = 0
+        refresh_rule_based_model(app)
+        return app
+
+    @pytest.fixture
+    def stored_inbounds(self, db_engine):
+        def _stored_inbounds(inbound_ids):
+            with db_engine.connect() as db_connection:
+                rows = db_connection.execute(
+                    text(
+                        "SELECT inbound_id, feedback_secret_key FROM inbounds_ud "
+                        "WHERE inbound_id IN :ids"
+                    ),
+                    ids=tuple(inbound_ids),
+                ).fetchall()
+            return {tuple(row) for row in rows}
+
+        yield _stored_inbounds
+        with db_engine.connect() as db_connection:
+            db_connection.execute(text("DELETE FROM inbounds_ud"))
+
+    def test_inbound_check_is_written_behind(self, write_behind_app, stored_inbounds):
+        client = write_behind_app.test_client()
+        response = client.post(
+            "/inbound/check", json={"text_to_match": "hello"}, headers=headers
+        )
+        json_data = response.get_json()
+
+        write_behind_app.inbound_writer.stop()
+
+        assert stored_inbounds([json_data["inbound_id"]]) == {
+            (json_data["inbound_id"], json_data["feedback_secret_key"])
+        }
+
+    def test_batch_is_written_behind(self, write_behind_app, stored_inbounds):
+        client = write_behind_app.test_client()
+        request_data = {
+            "messages": [{"text_to_match": "hello %d" % i} for i in range(250)]
+        }
+        response = client.post(
+            "/inbound/check-batch", json=request_data, headers=headers
+        )
+        results = response.get_json()["results"]
+
+        write_behind_app.inbound_writer.stop()
+
+        assert stored_inbounds([result["inbound_id"] for result in results]) == {
+            (result["inbound_id"], result["feedback_secret_key"]) for result in results
+        }
+
+    def test_invalid_write_mode(self, test_params):
+        with pytest.raises(ValueError):
+            create_app({**test_params, "INBOUND_WRITE_MODE": "eventually"})
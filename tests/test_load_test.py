@@ -0,0 +1,51 @@
+import os
+import socket
+
+from benchmarks.load_test import (
+    CHECK_PATH,
+    FEEDBACK_PATH,
+    FlaskClient,
+    HttpClient,
+    check_thresholds,
+    percentile,
+    replay,
+)
+
+
+class TestLoadTest:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile(values, 0) == 1
+        assert percentile([], 50) is None
+
+    def test_replay_in_process(self, app_no_refresh):
+        client = FlaskClient(app_no_refresh, os.getenv("UD_INBOUND_CHECK_TOKEN"))
+        corpus = [
+            {"text_to_match": "I love to hike", "feedback": {"helpful": True}},
+            {"text_to_match": "I love to swim", "metadata": {"user": 1}},
+        ]
+
+        results = replay(client, corpus, n_requests=6, concurrency=2, rate=100)
+
+        assert results[CHECK_PATH]["requests"] == 6
+        assert results[FEEDBACK_PATH]["requests"] == 3
+        assert results[CHECK_PATH]["error_rate"] == 0
+        assert results[FEEDBACK_PATH]["error_rate"] == 0
+        assert check_thresholds(results, max_error_rate=0) == []
+        assert len(check_thresholds(results, max_p95_ms=0)) == 2
+
+    def test_unreachable_service_counts_as_errors(self):
+        with socket.socket() as unused:
+            unused.bind(("127.0.0.1", 0))
+            port = unused.getsockname()[1]
+        client = HttpClient(f"http://127.0.0.1:{port}", "token", timeout=1)
+        corpus = [{"text_to_match": "I love to hike", "feedback": {"helpful": True}}]
+
+        results = replay(client, corpus, n_requests=4, concurrency=2)
+
+        assert results[CHECK_PATH]["requests"] == 4
+        assert results[CHECK_PATH]["error_rate"] == 1
+        assert len(check_thresholds(results, max_error_rate=0.5)) == 1
@@ -0,0 +1,155 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from faqt import KeywordRule
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+from performance_validation import offline_evaluation
+from performance_validation.offline_evaluation import (
+    evaluate_offline,
+    load_rules,
+    match_matrix,
+    preprocess_messages_cached,
+    preprocess_messages_saved,
+    urgency_scores,
+)
+from performance_validation.rule_contributions import rule_contributions
+from sqlalchemy import text
+
+from core_model.app import get_preprocessor_version
+
+
+class TestOfflineEvaluation:
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matrix_matches_rule_based_ud(self, seed):
+        rng = random.Random(seed)
+        vocabulary = ["word%d" % i for i in range(40)]
+        # Some rule keywords never appear in messages
+        rule_vocabulary = vocabulary + ["unseen%d" % i for i in range(5)]
+        rules = [
+            KeywordRule(
+                include=rng.sample(rule_vocabulary, rng.randint(0, 3)),
+                exclude=rng.sample(rule_vocabulary, rng.randint(0, 2)),
+            )
+            for _ in range(100)
+        ]
+        token_lists = [rng.sample(vocabulary, rng.randint(0, 12)) for _ in range(200)]
+
+        matches = match_matrix(token_lists, rules)
+
+        reference = RuleBasedUD(model=rules, preprocessor=lambda tokens: tokens)
+        expected = [reference.predict_scores(tokens) for tokens in token_lists]
+        assert matches.toarray().astype(float).tolist() == expected
+        assert urgency_scores(matches).tolist() == [max(s) for s in expected]
+
+    def test_evaluate_offline(self):
+        rules_df = pd.DataFrame(
+            {
+                "Title": ["bleeding", "pain"],
+                "Include Tags": ["['Bleed']", "['pain', 'stomach']"],
+                "Exclude Tags": ["[]", "['not']"],
+            }
+        )
+        validation_df = pd.DataFrame(
+            {
+                "message": [
+                    "I am bleeding a lot",
+                    "My stomach pain is bad",
+                    "When is my clinic visit",
+                    "",
+                    "My stomach is fine",
+                ],
+                "urgent": ["Yes", "Yes", "No", "Yes", "Yes"],
+            }
+        )
+
+        assert load_rules(rules_df)[0].include == ["bleed"]
+
+        metrics = evaluate_offline(validation_df, rules_df, "message", "urgent")
+
+        assert metrics["confusion"].tolist() == [[1, 0], [1, 2]]
+        assert metrics["precision"] == 1.0
+        assert metrics["recall"] == pytest.approx(2 / 3)
+
+    def test_token_cache(self, tmp_path, monkeypatch):
+        cache_path = str(tmp_path / "tokens.json")
+        messages = ["I am bleeding", "When is my visit"]
+        expected = offline_evaluation.preprocess_messages(messages)
+
+        assert preprocess_messages_cached(messages, cache_path) == expected
+
+        monkeypatch.setattr(
+            offline_evaluation, "preprocess_messages", lambda *args: pytest.fail()
+        )
+        assert preprocess_messages_cached(messages, cache_path) == expected
+
+    def test_saved_tokens(self, db_engine, monkeypatch):
+        with db_engine.connect() as db_connection:
+            inbound_id = db_connection.execute(
+                text(
+                    "INSERT INTO inbounds_ud (feedback_secret_key, inbound_text, "
+                    "inbound_utc, urgency_score, returned_content, returned_utc) "
+                    "VALUES ('abc123', 'I am bleeding', '2001-01-01', '0.0', '{}', "
+                    "'2001-01-01') RETURNING inbound_id"
+                )
+            ).scalar()
+            db_connection.execute(
+                text("INSERT INTO inbound_tokens VALUES (:id, :version, '{saved}')"),
+                id=inbound_id,
+                version=get_preprocessor_version(),
+            )
+
+        messages = ["I am bleeding", "When is my visit", "I am bleeding"]
+        try:
+            token_lists = preprocess_messages_saved(messages, db_engine)
+        finally:
+            with db_engine.connect() as db_connection:
+                db_connection.execute(
+                    text("DELETE FROM inbound_tokens WHERE inbound_id = :id"),
+                    id=inbound_id,
+                )
+                db_connection.execute(
+                    text("DELETE FROM inbounds_ud WHERE inbound_id = :id"),
+                    id=inbound_id,
+                )
+
+        assert token_lists[0] == ["saved"]
+        assert (
+            token_lists[1] == offline_evaluation.preprocess_messages(messages[1:2])[0]
+        )
+        assert token_lists[2] == ["saved"]
+
+
+class TestRuleContributions:
+    def test_leave_one_out_matches_rescoring(self):
+        rng = random.Random(0)
+        vocabulary = ["word%d" % i for i in range(30)]
+        rules = [
+            KeywordRule(
+                include=rng.sample(vocabulary, rng.randint(1, 2)),
+                exclude=rng.sample(vocabulary, rng.randint(0, 1)),
+            )
+            for _ in range(20)
+        ]
+        token_lists = [rng.sample(vocabulary, rng.randint(0, 10)) for _ in range(300)]
+        true_val = np.array([rng.random() < 0.4 for _ in token_lists], dtype=int)
+
+        report = rule_contributions(match_matrix(token_lists, rules), true_val)
+
+        for j in range(len(rules)):
+            predicted = urgency_scores(
+                match_matrix(token_lists, rules[:j] + rules[j + 1 :])
+            )
+            tp = np.sum((predicted == 1) & (true_val == 1))
+            fp = np.sum((predicted == 1) & (true_val == 0))
+            assert report["recall_without_rule"][j] == pytest.approx(
+                tp / true_val.sum()
+            )
+            assert report["precision_without_rule"][j] == pytest.approx(
+                tp / (tp + fp) if tp + fp > 0 else 0
+            )
+
+            matched = match_matrix(token_lists, [rules[j]]).toarray()[:, 0]
+            assert report["true_positives"][j] == np.sum(matched & (true_val == 1))
+            assert report["false_positives"][j] == np.sum(matched & (true_val == 0))
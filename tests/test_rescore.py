@@ -0,0 +1,171 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+import core_model.app.rescore
+from core_model.app import create_app
+from core_model.app.rescore import InboundRescorer
+
+insert_rule = (
+    "INSERT INTO urgency_rules ("
+    "urgency_rule_tags_include, urgency_rule_tags_exclude, "
+    "urgency_rule_author, urgency_rule_title, "
+    "urgency_rule_added_utc) "
+    "VALUES (:include, '{}', 'Pytest rescore', :title, '2022-05-02') "
+    "RETURNING urgency_rule_id"
+)
+insert_inbound = (
+    "INSERT INTO inbounds_ud (feedback_secret_key, inbound_text, inbound_utc, "
+    "urgency_score, returned_content, returned_utc) "
+    "VALUES ('abc123', :text, '2022-05-02', :score, '{}', '2022-05-02') "
+    "RETURNING inbound_id"
+)
+
+
+class TestInboundRescorer:
+    @pytest.fixture
+    def rescore_app(self, test_params, db_engine):
+        app = create_app(test_params)
+        with db_engine.connect() as db_connection:
+            db_connection.execute(text("DELETE FROM inbounds_ud"))
+            hike_id = db_connection.execute(
+                text(insert_rule), include=["hike"], title="hike"
+            ).scalar()
+            swim_id = db_connection.execute(
+                text(insert_rule), include=["swim"], title="swim"
+            ).scalar()
+
+            # Scored when only a "lake" rule existed
+            old_score = json.dumps([{"rule_id": -1, "title": "lake"}])
+            for message, score in [
+                ("I like to hike", "[]"),
+                ("I like to hike by the lake", old_score),
+                ("I like the lake", old_score),
+                ("Nothing to see here", "[]"),
+                ("I like to swim", "null"),
+            ]:
+                db_connection.execute(text(insert_inbound), text=message, score=score)
+        yield app, hike_id, swim_id
+
+        with db_engine.connect() as db_connection:
+            db_connection.execute(text("DELETE FROM inbound_rescore_runs"))
+            db_connection.execute(text("DELETE FROM inbound_tokens"))
+            db_connection.execute(text("DELETE FROM inbounds_ud"))
+            db_connection.execute(
+                text(
+                    "DELETE FROM urgency_rules "
+                    "WHERE urgency_rule_author='Pytest rescore'"
+                )
+            )
+
+    def get_results(self, db_engine, rescore_run_id):
+        with db_engine.connect() as db_connection:
+            run = db_connection.execute(
+                text(
+                    "SELECT n_inbounds, n_newly_urgent, n_no_longer_urgent, "
+                    "finished_utc IS NOT NULL FROM inbound_rescore_runs "
+                    "WHERE rescore_run_id = :id"
+                ),
+                id=rescore_run_id,
+            ).one()
+            diffs = db_connection.execute(
+                text(
+                    "SELECT urgency_rule_id, n_newly_matched, n_no_longer_matched "
+                    "FROM inbound_rescore_rule_diffs WHERE rescore_run_id = :id"
+                ),
+                id=rescore_run_id,
+            ).fetchall()
+        return tuple(run), {tuple(row) for row in diffs}
+
+    def test_rescore(self, rescore_app, db_engine):
+        app, hike_id, swim_id = rescore_app
+        rescore_run_id = InboundRescorer(app, chunk_size=2, max_db_share=1).run()
+
+        assert self.get_results(db_engine, rescore_run_id) == (
+            (5, 2, 1, True),
+            {(hike_id, 2, 0), (swim_id, 1, 0), (-1, 0, 2)},
+        )
+
+    def test_finished_run_is_not_repeated(self, rescore_app):
+        app, _, _ = rescore_app
+        assert InboundRescorer(app, max_db_share=1).run() is not None
+        assert InboundRescorer(app, max_db_share=1).run() is None
+
+    def test_interrupted_run_resumes(self, rescore_app, db_engine, monkeypatch):
+        app, hike_id, swim_id = rescore_app
+        rescorer = InboundRescorer(app, chunk_size=2, max_db_share=1)
+        rescore_chunk = rescorer._rescore_chunk
+        n_chunks = 0
+
+        def interrupted_rescore_chunk(*args):
+            nonlocal n_chunks
+            n_chunks += 1
+            if n_chunks > 1:
+                raise KeyboardInterrupt
+            return rescore_chunk(*args)
+
+        monkeypatch.setattr(rescorer, "_rescore_chunk", interrupted_rescore_chunk)
+        with pytest.raises(KeyboardInterrupt):
+            rescorer.run()
+
+        rescore_run_id = InboundRescorer(app, chunk_size=2, max_db_share=1).run()
+        assert self.get_results(db_engine, rescore_run_id) == (
+            (5, 2, 1, True),
+            {(hike_id, 2, 0), (swim_id, 1, 0), (-1, 0, 2)},
+        )
+
+    def test_parallel_preprocessing(self, rescore_app, db_engine):
+        app, hike_id, swim_id = rescore_app
+        rescore_run_id = InboundRescorer(
+            app, chunk_size=2, n_processes=2, max_db_share=1
+        ).run()
+
+        assert self.get_results(db_engine, rescore_run_id)[0] == (5, 2, 1, True)
+
+    def test_messages_saved_late_are_rescored(
+        self, rescore_app, db_engine, monkeypatch
+    ):
+        app, hike_id, swim_id = rescore_app
+
+        def save_late_message(seconds):
+            # A message received before the run started, saved with an id
+            # reserved earlier by another worker
+            with db_engine.connect() as db_connection:
+                db_connection.execute(
+                    text(
+                        "INSERT INTO inbounds_ud (inbound_id, feedback_secret_key, "
+                        "inbound_text, inbound_utc, urgency_score, returned_content, "
+                        "returned_utc) SELECT min(inbound_id) - 1, 'abc123', "
+                        "'I like to hike', '2022-05-02', '[]', '{}', '2022-05-02' "
+                        "FROM inbounds_ud"
+                    )
+                )
+
+        monkeypatch.setattr(
+            core_model.app.rescore,
+            "time",
+            SimpleNamespace(sleep=save_late_message, perf_counter=lambda: 0.0),
+        )
+        rescore_run_id = InboundRescorer(app, chunk_size=2, max_db_share=1).run()
+
+        assert self.get_results(db_engine, rescore_run_id)[0] == (6, 3, 1, True)
+
+    def test_messages_received_after_start_are_skipped(self, rescore_app, db_engine):
+        app, _, _ = rescore_app
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text(
+                    "INSERT INTO inbounds_ud (feedback_secret_key, inbound_text, "
+                    "inbound_utc, urgency_score, returned_content, returned_utc) "
+                    "VALUES ('abc123', 'I like to hike', '2100-01-01', '[]', '{}', "
+                    "'2100-01-01')"
+                )
+            )
+
+        rescore_run_id = InboundRescorer(
+            app, chunk_size=2, max_db_share=1, save_delay=0
+        ).run()
+
+        assert self.get_results(db_engine, rescore_run_id)[0] == (5, 2, 1, True)
@@ -0,0 +1,131 @@
+import random
+
+import pytest
+from faqt import KeywordRule
+from faqt.model.urgency_detection.urgency_detection_base import RuleBasedUD
+
+from core_model.app.src.rule_evaluation import KeywordRuleIndex, RuleEvaluator
+
+rules = [
+    KeywordRule(include=["rock", "guitar", "melodi"], exclude=[]),
+    KeywordRule(include=["guitar", "hike"], exclude=["melodi"]),
+    KeywordRule(include=["rock", "lake", "hike"], exclude=[]),
+    KeywordRule(include=[], exclude=["love"]),
+]
+
+
+class CountingPreprocessor:
+    def __init__(self):
+        self.n_calls = 0
+
+    def __call__(self, message):
+        self.n_calls += 1
+        return message.lower().split()
+
+
+class TestRuleEvaluator:
+    @pytest.mark.parametrize(
+        "message",
+        [
+            "love hike rock lake",
+            "rock guitar melodi lake hike",
+            "hike rock lake",
+            "love melodi guitar",
+            "",
+        ],
+    )
+    def test_scores_match_rule_based_ud(self, message):
+        preprocessor = CountingPreprocessor()
+        evaluator = RuleEvaluator(model=rules, preprocessor=preprocessor)
+        reference = RuleBasedUD(model=rules, preprocessor=preprocessor)
+
+        evaluation = evaluator.evaluate(message)
+
+        assert evaluation.urgency_scores == reference.predict_scores(message)
+        assert evaluation.urgency_score == reference.predict(message)
+
+    def test_message_is_preprocessed_once(self):
+        preprocessor = CountingPreprocessor()
+        evaluator = RuleEvaluator(model=rules, preprocessor=preprocessor)
+
+        evaluation = evaluator.evaluate("Rock Lake Hike")
+
+        assert preprocessor.n_calls == 1
+        assert evaluation.preprocessed_text == ["rock", "lake", "hike"]
+        assert evaluation.matched_rule_indices == [2, 3]
+        assert evaluation.urgency_scores == [0.0, 0.0, 1.0, 1.0]
+        assert evaluation.urgency_score == 1.0
+
+    def test_no_rules_gives_no_score(self):
+        evaluator = RuleEvaluator(model=[], preprocessor=CountingPreprocessor())
+
+        evaluation = evaluator.evaluate("rock lake hike")
+
+        assert evaluation.urgency_scores == []
+        assert evaluation.urgency_score is None
+
+
+class TestKeywordRuleIndex:
+    def test_duplicate_keywords_in_rule(self):
+        index = KeywordRuleIndex(
+            [KeywordRule(include=["rock", "rock"], exclude=["love", "love"])]
+        )
+
+        assert index.match({"rock"}) == [0]
+        assert index.match({"rock", "love"}) == []
+
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_index_matches_linear_evaluation(self, seed):
+        rng = random.Random(seed)
+        vocabulary = ["word%d" % i for i in range(50)]
+        random_rules = [
+            KeywordRule(
+                include=rng.sample(vocabulary, rng.randint(0, 3)),
+                exclude=rng.sample(vocabulary, rng.randint(0, 2)),
+            )
+            for _ in range(200)
+        ]
+        messages = [
+            " ".join(rng.sample(vocabulary, rng.randint(0, 15))) for _ in range(100)
+        ]
+
+        evaluator = RuleEvaluator(model=random_rules, preprocessor=str.split)
+        reference = RuleBasedUD(model=random_rules, preprocessor=str.split)
+
+        for message in messages:
+            assert evaluator.predict_scores(message) == reference.predict_scores(
+                message
+            )
+
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_patched_index_matches_rebuilt_index(self, seed):
+        rng = random.Random(seed)
+        vocabulary = ["word%d" % i for i in range(30)]
+
+        def random_rule():
+            return KeywordRule(
+                include=rng.sample(vocabulary, rng.randint(0, 3)),
+                exclude=rng.sample(vocabulary, rng.randint(0, 2)),
+            )
+
+        rules = {key: random_rule() for key in range(100)}
+        evaluator = RuleEvaluator(
+            model=list(rules.values()), preprocessor=str.split, keys=list(rules)
+        )
+
+        removed_keys = rng.sample(list(rules), 20)
+        added_rules = {key: random_rule() for key in rng.sample(range(150), 30)}
+        for key in removed_keys:
+            del rules[key]
+        rules.update(added_rules)
+
+        patched = evaluator.patched(removed_keys, added_rules)
+        keys = sorted(rules)
+        rebuilt = RuleEvaluator(
+            model=[rules[key] for key in keys], preprocessor=str.split, keys=keys
+        )
+
+        assert patched.keys == keys
+        for _ in range(100):
+            message = " ".join(rng.sample(vocabulary, rng.randint(0, 10)))
+            assert patched.evaluate(message) == rebuilt.evaluate(message)
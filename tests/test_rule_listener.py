@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import text
+
+from core_model.app import create_app
+
+insert_rule = (
+    "INSERT INTO urgency_rules ("
+    "urgency_rule_tags_include, urgency_rule_tags_exclude, "
+    "urgency_rule_author, urgency_rule_title, "
+    "urgency_rule_added_utc) "
+    "VALUES ('{\"hike\"}', '{}', 'Pytest listener', 'listener_rule', "
+    "'2022-05-02')"
+)
+headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+
+
+def wait_for_version(app, min_version, timeout=5):
+    deadline = time.monotonic() + timeout
+    while app.rule_set.version < min_version:
+        assert time.monotonic() < deadline, "Rules were not refreshed in time"
+        time.sleep(0.05)
+
+
+class TestRuleChangeListener:
+    @pytest.fixture
+    def listen_app(self, test_params, db_engine):
+        app = create_app({**test_params, "RULE_REFRESH_MODE": "listen"})
+        app.rule_listener.poll_interval = 0.1
+        initial_version = app.rule_set.version
+        app.rule_listener.start()
+        # The listener refreshes once when it connects
+        wait_for_version(app, initial_version + 1)
+        yield app
+
+        app.rule_listener.stop()
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text(
+                    "DELETE FROM urgency_rules WHERE urgency_rule_author='Pytest listener'"
+                )
+            )
+
+    def test_rules_loaded_at_startup(self, listen_app):
+        assert listen_app.rule_set.version >= 1
+
+    def test_rules_refreshed_after_change(self, listen_app, db_engine):
+        version = listen_app.rule_set.version
+        with db_engine.connect() as db_connection:
+            db_connection.execute(text(insert_rule))
+
+        wait_for_version(listen_app, version + 1, timeout=1)
+
+        titles = [rule["title"] for rule in listen_app.rule_set.rules]
+        assert "listener_rule" in titles
+
+        response = listen_app.test_client().post(
+            "/inbound/check", json={"text_to_match": "I love to hike"}, headers=headers
+        )
+        matched_titles = [
+            rule["title"] for rule in response.get_json()["matched_urgency_rules"]
+        ]
+        assert "listener_rule" in matched_titles
+
+    def test_invalid_refresh_mode(self, test_params):
+        with pytest.raises(ValueError):
+            create_app({**test_params, "RULE_REFRESH_MODE": "sometimes"})
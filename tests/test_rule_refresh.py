@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import text
+
+from core_model.app import create_app, refresh_rule_based_model
+
+insert_rule = (
+    "INSERT INTO urgency_rules ("
+    "urgency_rule_tags_include, urgency_rule_tags_exclude, "
+    "urgency_rule_author, urgency_rule_title, "
+    "urgency_rule_added_utc) "
+    "VALUES (:include, '{}', 'Pytest incremental', :title, '2022-05-02') "
+    "RETURNING urgency_rule_id"
+)
+
+
+class TestIncrementalRuleRefresh:
+    @pytest.fixture
+    def incremental_app(self, test_params, db_engine):
+        app = create_app(
+            {
+                **test_params,
+                "RULE_REFRESH_INCREMENTAL": "true",
+                "RULE_FULL_REFRESH_EVERY": 100,
+            }
+        )
+        refresh_rule_based_model(app)
+        yield app
+
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text(
+                    "DELETE FROM urgency_rules "
+                    "WHERE urgency_rule_author='Pytest incremental'"
+                )
+            )
+
+    def add_rule(self, db_engine, title, include):
+        with db_engine.connect() as db_connection:
+            return db_connection.execute(
+                text(insert_rule), include=include, title=title
+            ).scalar()
+
+    def assert_matches_full_refresh(self, app, test_params):
+        full_app = create_app(test_params)
+        refresh_rule_based_model(full_app)
+
+        rules = app.rule_set.rules
+        full_rules = full_app.rule_set.rules
+        assert [r["rule_id"] for r in rules] == [r["rule_id"] for r in full_rules]
+        assert [r["title"] for r in rules] == [r["title"] for r in full_rules]
+        for message in ["I love to hike", "I love to swim", "nothing here"]:
+            assert app.rule_set.evaluator.evaluate(
+                message
+            ) == full_app.rule_set.evaluator.evaluate(message)
+
+    def test_db_version_recorded(self, incremental_app):
+        assert incremental_app.rule_set.db_version is not None
+
+    def test_added_updated_and_deleted_rules(
+        self, incremental_app, db_engine, test_params
+    ):
+        hike_id = self.add_rule(db_engine, "hike_rule", ["hike"])
+        swim_id = self.add_rule(db_engine, "swim_rule", ["swim"])
+        refresh_rule_based_model(incremental_app)
+        assert incremental_app.n_incremental_rule_refreshes == 1
+        self.assert_matches_full_refresh(incremental_app, test_params)
+
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text(
+                    "UPDATE urgency_rules SET urgency_rule_tags_include='{\"run\"}' "
+                    "WHERE urgency_rule_id=:rule_id"
+                ),
+                rule_id=hike_id,
+            )
+            db_connection.execute(
+                text("DELETE FROM urgency_rules WHERE urgency_rule_id=:rule_id"),
+                rule_id=swim_id,
+            )
+        refresh_rule_based_model(incremental_app)
+
+        assert incremental_app.n_incremental_rule_refreshes == 2
+        rule_ids = [rule["rule_id"] for rule in incremental_app.rule_set.rules]
+        assert hike_id in rule_ids
+        assert swim_id not in rule_ids
+        self.assert_matches_full_refresh(incremental_app, test_params)
+
+    def test_no_changes_keeps_rule_set(self, incremental_app):
+        rule_set = incremental_app.rule_set
+        refresh_rule_based_model(incremental_app)
+
+        assert incremental_app.rule_set is rule_set
+
+    def test_periodic_full_refresh(self, incremental_app, db_engine):
+        incremental_app.config["RULE_FULL_REFRESH_EVERY"] = 1
+        self.add_rule(db_engine, "hike_rule", ["hike"])
+        refresh_rule_based_model(incremental_app)
+        assert incremental_app.n_incremental_rule_refreshes == 1
+
+        self.add_rule(db_engine, "swim_rule", ["swim"])
+        refresh_rule_based_model(incremental_app)
+        assert incremental_app.n_incremental_rule_refreshes == 0
@@ -0,0 +1,207 @@
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+from faqt import KeywordRule
+
+import core_model.app
+import core_model.app.main.inbound
+import core_model.app.rule_store
+from core_model.app import create_app, refresh_rule_based_model
+from core_model.app.rule_store import SharedRuleStore
+from core_model.app.src.rule_evaluation import RuleEvaluator
+from core_model.app.src.shared_rules import (
+    SharedRuleEvaluator,
+    SharedRules,
+    serialize_rules,
+)
+
+headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+
+
+def random_rules(rng, vocabulary, n_rules):
+    return [
+        {
+            "rule_id": 10 * i,
+            "title": "rule %d" % i,
+            "rule": KeywordRule(
+                include=rng.sample(vocabulary, rng.randint(0, 3)),
+                exclude=rng.sample(vocabulary, rng.randint(0, 2)),
+            ),
+        }
+        for i in range(n_rules)
+    ]
+
+
+class TestSharedRules:
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matches_rule_evaluator(self, seed):
+        rng = random.Random(seed)
+        vocabulary = ["word%d" % i for i in range(50)] + ["naïve", "día"]
+        rules = random_rules(rng, vocabulary, 200)
+
+        shared = SharedRuleEvaluator(
+            SharedRules(serialize_rules(rules)), preprocessor=str.split
+        )
+        reference = RuleEvaluator(
+            model=[rule["rule"] for rule in rules], preprocessor=str.split
+        )
+
+        for _ in range(100):
+            message = " ".join(rng.sample(vocabulary, rng.randint(0, 15)))
+            assert shared.evaluate(message) == reference.evaluate(message)
+            assert shared.predict_scores(message) == reference.predict_scores(message)
+            assert shared.predict(message) == reference.predict(message)
+
+    def test_rules_decoded_by_position(self):
+        rules = random_rules(random.Random(0), ["a", "b", "c"], 5)
+        shared = SharedRules(serialize_rules(rules))
+
+        assert len(shared) == 5
+        for rule, shared_rule in zip(rules, shared):
+            assert shared_rule["rule_id"] == rule["rule_id"]
+            assert shared_rule["title"] == rule["title"]
+            assert shared_rule["rule"].include == rule["rule"].include
+            assert shared_rule["rule"].exclude == rule["rule"].exclude
+        assert shared[-1]["rule_id"] == rules[-1]["rule_id"]
+        with pytest.raises(IndexError):
+            shared[5]
+
+    def test_no_rules(self):
+        shared = SharedRuleEvaluator(
+            SharedRules(serialize_rules([])), preprocessor=str.split
+        )
+
+        assert len(shared.rules) == 0
+        assert shared.evaluate("anything").urgency_score is None
+
+    def test_invalid_buffer(self):
+        with pytest.raises(ValueError):
+            SharedRules(b"\0" * 1024)
+
+
+class TestSharedRuleStore:
+    def test_publish_and_load(self, tmp_path):
+        store = SharedRuleStore(str(tmp_path))
+        other_store = SharedRuleStore(str(tmp_path))
+        rules = random_rules(random.Random(0), ["a", "b", "c"], 5)
+        assert store.generation == 0
+
+        with store.lock():
+            store.publish(rules)
+            store.publish(rules[:2])
+
+        generation, shared = other_store.load()
+        assert generation == other_store.generation == 2
+        assert len(shared) == 2
+
+    def test_loaded_rules_survive_publish(self, tmp_path):
+        store = SharedRuleStore(str(tmp_path))
+        rules = random_rules(random.Random(0), ["a", "b", "c"], 5)
+        with store.lock():
+            store.publish(rules)
+        _, shared = store.load()
+
+        with store.lock():
+            store.publish([])
+
+        assert [rule["rule_id"] for rule in shared] == [
+            rule["rule_id"] for rule in rules
+        ]
+
+
+class TestSharedRuleRefresh:
+    @pytest.fixture
+    def count_queries(self, monkeypatch):
+        counts = {"refresh_rules": 0}
+        refresh_rules = core_model.app.refresh_rules
+
+        def counting_refresh_rules(app):
+            counts["refresh_rules"] += 1
+            return refresh_rules(app)
+
+        monkeypatch.setattr(core_model.app, "refresh_rules", counting_refresh_rules)
+        return counts
+
+    def test_workers_share_published_rules(self, test_params, tmp_path, count_queries):
+        params = {**test_params, "RULE_SHARED_DIR": str(tmp_path)}
+        worker_apps = [create_app(params) for _ in range(3)]
+
+        # Every worker queries the DB on its first refresh
+        for app in worker_apps:
+            refresh_rule_based_model(app)
+        assert count_queries["refresh_rules"] == 3
+
+        # Later, one worker queries and the others attach to its rules
+        for app in worker_apps:
+            refresh_rule_based_model(app)
+        assert count_queries["refresh_rules"] == 4
+
+        rule_sets = [app.rule_set for app in worker_apps]
+        assert all(isinstance(rs.evaluator, SharedRuleEvaluator) for rs in rule_sets)
+        assert len({len(rs.rules) for rs in rule_sets}) == 1
+
+    def test_forced_refresh_queries_db(self, test_params, tmp_path, count_queries):
+        params = {**test_params, "RULE_SHARED_DIR": str(tmp_path)}
+        app, other_app = create_app(params), create_app(params)
+        refresh_rule_based_model(app)
+        refresh_rule_based_model(other_app)
+
+        # `app` is behind, but still queries the DB
+        refresh_rule_based_model(app, force=True)
+
+        assert count_queries["refresh_rules"] == 3
+
+    def test_requests_attach_to_published_rules(self, test_params, tmp_path):
+        params = {
+            **test_params,
+            "RULE_SHARED_DIR": str(tmp_path),
+            "RULE_REFRESH_FREQ": 0,
+        }
+        app, other_app = create_app(params), create_app(params)
+        refresh_rule_based_model(app)
+        version = app.rule_set.version
+        refresh_rule_based_model(other_app)
+
+        assert app.shared_rule_generation < other_app.shared_rule_generation
+
+        app.test_client().post(
+            "/inbound/check", json={"text_to_match": "hi"}, headers=headers
+        )
+
+        assert app.shared_rule_generation == other_app.shared_rule_generation
+        assert app.rule_set.version == version + 1
+
+    def test_requests_query_db_once_per_window(
+        self, test_params, tmp_path, count_queries, monkeypatch
+    ):
+        clock = SimpleNamespace(now=1_000_000.0)
+        monkeypatch.setattr(
+            core_model.app.main.inbound,
+            "get_ttl_hash",
+            lambda seconds: clock.now // seconds,
+        )
+        monkeypatch.setattr(
+            core_model.app.rule_store, "time", SimpleNamespace(time=lambda: clock.now)
+        )
+        params = {
+            **test_params,
+            "RULE_SHARED_DIR": str(tmp_path),
+            "RULE_REFRESH_FREQ": 60,
+        }
+        clients = [create_app(params).test_client() for _ in range(4)]
+        store = SharedRuleStore(str(tmp_path))
+
+        for window in range(3):
+            for client in clients:
+                clock.now += 1
+                client.post(
+                    "/inbound/check", json={"text_to_match": "hi"}, headers=headers
+                )
+            assert count_queries["refresh_rules"] == window + 1
+            assert store.generation == window + 1
+            clock.now += 60
+
+        generations = {client.application.shared_rule_generation for client in clients}
+        assert generations == {3}
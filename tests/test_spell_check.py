@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from core_model.app.src.spell_check import ThreadLocalSpellChecker
+
+
+class FakeSpellChecker:
+    def __init__(self):
+        self.custom_spell_correct_map = {"virginia": "vagina"}
+
+    def spell(self, word):
+        return word not in self.custom_spell_correct_map
+
+    def suggest(self, word):
+        return [self.custom_spell_correct_map.get(word, word)]
+
+
+class TestThreadLocalSpellChecker:
+    def test_one_instance_per_thread(self):
+        spell_checker = ThreadLocalSpellChecker(FakeSpellChecker)
+        main_instance = spell_checker.spell_checker
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            thread_instances = list(
+                executor.map(lambda _: id(spell_checker.spell_checker), range(20))
+            )
+
+        assert spell_checker.spell_checker is main_instance
+        assert id(main_instance) not in thread_instances
+        assert len(set(thread_instances)) <= 4
+
+    def test_delegates_to_spell_checker(self):
+        spell_checker = ThreadLocalSpellChecker(FakeSpellChecker)
+
+        assert spell_checker.spell("virginia") is False
+        assert spell_checker.suggest("virginia") == ["vagina"]
+        assert spell_checker.custom_spell_correct_map == {"virginia": "vagina"}
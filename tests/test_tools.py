@@ -1,5 +1,14 @@
 import os
 
+import pytest
+from sqlalchemy import text
+
+insert_inbound = (
+    "INSERT INTO inbounds_ud (feedback_secret_key, inbound_text, inbound_utc, "
+    "urgency_score, returned_content, returned_utc) "
+    "VALUES ('abc123', :text, :utc, '0.0', '{}', :utc) RETURNING inbound_id"
+)
+
 
 class TestNewRuleTool:
     def test_check_new_rule(self, client):
@@ -24,6 +33,52 @@ class TestNewRuleTool:
 
         assert json_data["urgency_scores"] == [0, 0, 0, 1, 1]
 
+    def test_check_new_rules_batch(self, client):
+        request_data = {
+            "rules": [
+                {"include_keywords": ["hike"], "exclude_keywords": []},
+                {"include_keywords": ["lake", "rock"], "exclude_keywords": ["love"]},
+                {"include_keywords": ["guitar"], "exclude_keywords": []},
+            ],
+            "queries_to_check": [
+                "I like to hike by the lake and climb rocks",
+                "I love to hike by the lake and climb rocks",
+                "Nothing to see here",
+            ],
+            "return_preprocessed_queries": True,
+        }
+
+        headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+
+        response = client.post(
+            "/tools/check-new-rules-batch", json=request_data, headers=headers
+        )
+        json_data = response.get_json()
+
+        assert json_data["matched_rule_indices"] == [[0, 1], [0], []]
+        assert json_data["rule_match_counts"] == [2, 1, 0]
+        assert len(json_data["preprocessed_rules"]) == 3
+        assert len(json_data["preprocessed_queries"]) == 3
+
+    def test_check_new_rules_batch_limits(self, client):
+        headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+        rules = [{"include_keywords": ["hike"], "exclude_keywords": []}]
+
+        response = client.post(
+            "/tools/check-new-rules-batch",
+            json={"rules": rules, "queries_to_check": []},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+        max_queries = client.application.config["CHECK_RULES_MAX_QUERIES"]
+        response = client.post(
+            "/tools/check-new-rules-batch",
+            json={"rules": rules, "queries_to_check": ["hike"] * (max_queries + 1)},
+            headers=headers,
+        )
+        assert response.status_code == 413
+
     def test_if_rule_overlap_is_detected(self, client):
         request_data = {
             "include_keywords": ["cry", "running"],
@@ -92,3 +147,104 @@ class TestNewRuleTool:
         json_data = response.get_json()
 
         assert json_data["no_errors"] == True
+
+
+class TestRulesHistoryTool:
+    headers = {"Authorization": "Bearer %s" % os.getenv("UD_INBOUND_CHECK_TOKEN")}
+    messages = [
+        ("I like to hike by the lake", "2001-01-01 10:00"),
+        ("I love to hike by the lake", "2001-01-02 10:00"),
+        ("Nothing to see here", "2001-01-03 10:00"),
+        ("A hike outside the date range", "2001-02-01 10:00"),
+    ]
+
+    @pytest.fixture
+    def inbound_ids(self, db_engine):
+        with db_engine.connect() as db_connection:
+            ids = [
+                db_connection.execute(text(insert_inbound), text=t, utc=utc).scalar()
+                for t, utc in self.messages
+            ]
+        yield ids
+
+        with db_engine.connect() as db_connection:
+            db_connection.execute(
+                text("DELETE FROM inbound_tokens WHERE inbound_id = ANY(:ids)"),
+                ids=ids,
+            )
+            db_connection.execute(
+                text("DELETE FROM inbounds_ud WHERE inbound_id = ANY(:ids)"),
+                ids=ids,
+            )
+
+    def check_history(self, client, **kwargs):
+        request_data = {
+            "include_keywords": ["hike"],
+            "exclude_keywords": ["love"],
+            "start_utc": "2001-01-01T00:00:00",
+            "end_utc": "2001-01-31T00:00:00",
+            **kwargs,
+        }
+        return client.post(
+            "/tools/check-rules-history", json=request_data, headers=self.headers
+        )
+
+    def test_check_rules_history(self, client, inbound_ids):
+        json_data = self.check_history(client).get_json()
+
+        assert json_data["n_checked"] == 3
+        assert json_data["n_matched"] == 1
+        assert json_data["n_preprocessed"] == 3
+        assert json_data["matched_sample"] == [
+            {
+                "inbound_id": inbound_ids[0],
+                "inbound_utc": "2001-01-01T10:00:00",
+                "inbound_text": "I like to hike by the lake",
+            }
+        ]
+
+    def test_tokens_are_reused(self, client, inbound_ids, db_engine):
+        self.check_history(client)
+        with db_engine.connect() as db_connection:
+            n_saved = db_connection.execute(
+                text(
+                    "SELECT count(*) FROM inbound_tokens WHERE inbound_id = ANY(:ids)"
+                ),
+                ids=inbound_ids,
+            ).scalar()
+        assert n_saved == 3
+
+        json_data = self.check_history(client, include_keywords=["lake"]).get_json()
+        assert json_data["n_matched"] == 1
+        assert json_data["n_preprocessed"] == 0
+
+    def test_sample_size(self, client, inbound_ids):
+        json_data = self.check_history(
+            client, exclude_keywords=[], end_utc="2001-03-01T00:00:00", sample_size=1
+        ).get_json()
+
+        assert json_data["n_matched"] == 3
+        assert len(json_data["matched_sample"]) == 1
+
+    @pytest.mark.parametrize(
+        "start_utc, end_utc",
+        [
+            ("2001-01-01T00:00:00Z", "2001-01-31T00:00:00Z"),
+            ("2001-01-01T02:00:00+02:00", "2001-01-31T00:00:00+00:00"),
+            ("2001-01-01T00:00:00+00:00", "2001-01-31T01:00:00+01:00"),
+        ],
+    )
+    def test_dates_with_timezone(self, client, inbound_ids, start_utc, end_utc):
+        response = self.check_history(
+            client, start_utc=start_utc, end_utc=end_utc, exclude_keywords=[]
+        )
+
+        assert response.status_code == 200
+        assert response.get_json()["n_checked"] == 3
+
+    def test_invalid_date_range(self, client):
+        response = self.check_history(client, start_utc="2001-02-01T00:00:00")
+        assert response.status_code == 400
+
+        response = self.check_history(client, start_utc="not a date")
+        assert response.status_code == 400